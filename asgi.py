@@ -0,0 +1,7 @@
+import os
+from dummyauth import create_app
+from dummyauth.asgi import ASGIApp
+
+# Serve it with any ASGI server, such as `uvicorn asgi:app`. Everything is
+# built now, so that the first logins don't have to. See dummyauth.startup.
+app = ASGIApp(create_app(os.environ.get('STARTUP_PROFILE', 'preload')))
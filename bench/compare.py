@@ -0,0 +1,49 @@
+"""
+Compares two benchmark reports written with --output, page by page.
+
+    $ python -m bench.compare before.json after.json
+"""
+import argparse
+import json
+import sys
+
+METRICS = (
+    ('wall', lambda result: result['wall']['median']),
+    ('cpu', lambda result: result['cpu']['median']),
+    ('bytes_read', lambda result: result['bytes_read']),
+    ('peak_memory', lambda result: result['peak_memory']),
+)
+
+
+def ratio(before, after) -> float:
+    if not before:
+        return 1.0 if not after else float('inf')
+    return after / before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bench.compare',
+        description='Compare two benchmark reports.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    args = parser.parse_args(argv)
+
+    with open(args.before) as fp:
+        before = {result['page']: result for result in json.load(fp)['results']}
+    with open(args.after) as fp:
+        after = {result['page']: result for result in json.load(fp)['results']}
+
+    print('{:<22}'.format('page') +
+          ''.join('{:>14}'.format(name) for name, _ in METRICS))
+    for page in before:
+        if page not in after:
+            continue
+        print('{:<22}'.format(page) + ''.join(
+            '{:>13.2f}x'.format(ratio(value(before[page]), value(after[page])))
+            for _, value in METRICS))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+Measures how many logins a single process serves at once under WSGI, the
+way uWSGI runs wsgi.py, and under ASGI, the way asgi.py runs. Every login
+loads the form, posts it, and comes back through the callback, against a
+local stand-in provider that takes a while to answer each request, like a
+remote site would.
+
+    $ python -m bench.concurrency --logins 200 --latency 0.05
+
+A WSGI worker handles one request per thread: with uWSGI defaults, the
+whole process waits for the provider during every discovery and every
+verification. Use --threads to give it more. The ASGI app awaits them on
+the event loop instead. Both apps are called in-process, without an HTTP
+server in front, so only how they wait for the provider is compared.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import re
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlencode, urlsplit
+from dummyauth import create_app
+from dummyauth.asgi import ASGIApp
+from dummyauth.bulkhead import bulkhead
+from dummyauth.forms import normalize_profile_url, profile_url_memo
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+class ProviderHandler(BaseHTTPRequestHandler):
+    """ Serves a profile page for any path, and verifies any code, after
+    waiting for the latency of the server. """
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self, headers: dict, body: bytes=b''):
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        endpoint = self.server.url('/auth')
+        self.respond({'Cache-Control': 'no-store',
+                      'Link': '<{0}>; rel="authorization_endpoint", '
+                              '<{0}>; rel="token_endpoint"'.format(endpoint)})
+
+    do_GET = do_HEAD
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps({'me': self.server.url('/')}).encode('utf-8')
+        self.respond({'Content-Type': 'application/json'}, body)
+
+
+class ProviderServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, latency: float):
+        super().__init__(('127.0.0.1', 0), ProviderHandler)
+        self.latency = latency
+
+    def url(self, path: str) -> str:
+        return 'http://127.0.0.1:{}{}'.format(self.server_port, path)
+
+
+def build_app(concurrency: int):
+    """ Builds the app, with connection pools large enough for the logins
+    in flight, since all of them go to the same host here. The bulkhead is
+    disabled, or it would turn most of them down for the same reason. """
+    app = create_app('lazy')
+    app.config['SECRET_KEY'] = 'bench'
+    app.config['HTTP_POOL_MAXSIZE'] = concurrency
+    bulkhead.max_concurrent = 0
+    return app
+
+
+def profile_urls(provider: ProviderServer, server: str, logins: int) -> list:
+    """ Returns a different profile URL for every login, so that no cache
+    answers for the provider. Profile URLs may not have a port, which the
+    provider has, so they are vouched for in the memo of the validator. """
+    urls = []
+    for i in range(logins):
+        url = provider.url('/{}/user{}'.format(server, i))
+        profile_url_memo.set(url, normalize_profile_url(url)._replace(
+            error=None))
+        urls.append(url)
+    return urls
+
+
+def wsgi_login(app, url: str) -> float:
+    """ Logs in through the WSGI app. Returns how long it took. """
+    start = time.perf_counter()
+    client = app.test_client()
+    page = client.get('/').get_data(as_text=True)
+    response = client.post('/', data={
+        'csrf_token': CSRF_TOKEN.search(page).group(1), 'domain': url})
+    state = parse_qs(urlsplit(response.headers['Location']).query)['state']
+    response = client.get('/callback?' + urlencode({'code': 'x',
+                                                    'state': state[0]}))
+    assert response.status_code == 302, response.status_code
+    return time.perf_counter() - start
+
+
+async def asgi_request(app, cookies: dict, method: str, path: str,
+                       form: dict=None):
+    """ Sends a request to the ASGI app. Returns its status, headers and
+    body, keeping the cookies it sets. """
+    path, _, query = path.partition('?')
+    headers = [(b'host', b'localhost')]
+    if form is not None:
+        headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+    if cookies:
+        headers.append((b'cookie', '; '.join(
+            '{}={}'.format(*cookie) for cookie in cookies.items())
+            .encode('latin-1')))
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query.encode('latin-1'), 'headers': headers,
+             'scheme': 'http', 'server': ('localhost', 80)}
+    messages = [{'type': 'http.request',
+                 'body': urlencode(form or {}).encode('ascii')}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+    await app(scope, receive, send)
+
+    response_headers = {}
+    for name, value in sent[0]['headers']:
+        name, value = name.decode('latin-1'), value.decode('latin-1')
+        if name == 'set-cookie':
+            key, _, value = value.partition(';')[0].partition('=')
+            cookies[key] = value
+        response_headers[name] = value
+    return sent[0]['status'], response_headers, sent[1]['body']
+
+
+async def asgi_login(app, url: str) -> float:
+    """ Logs in through the ASGI app. Returns how long it took. """
+    start = time.perf_counter()
+    cookies = {}
+    _, _, page = await asgi_request(app, cookies, 'GET', '/')
+    token = CSRF_TOKEN.search(page.decode('utf-8')).group(1)
+    _, headers, _ = await asgi_request(app, cookies, 'POST', '/', {
+        'csrf_token': token, 'domain': url})
+    state = parse_qs(urlsplit(headers['location']).query)['state']
+    status, _, _ = await asgi_request(
+        app, cookies, 'GET',
+        '/callback?' + urlencode({'code': 'x', 'state': state[0]}))
+    assert status == 302, status
+    return time.perf_counter() - start
+
+
+def measure_wsgi(urls: list, threads: int) -> list:
+    app = build_app(len(urls))
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        return list(pool.map(lambda url: wsgi_login(app, url), urls))
+
+
+def measure_asgi(urls: list) -> list:
+    app = ASGIApp(build_app(len(urls)))
+
+    async def run():
+        try:
+            return await asyncio.gather(*(asgi_login(app, url)
+                                          for url in urls))
+        finally:
+            await app.spider.async_http_client.close()
+    # asyncio.run() is not available on Python 3.6.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(run())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def summary(server: str, workers: int, elapsed: float, latencies: list):
+    latencies = sorted(latencies)
+    return {
+        'server': server,
+        'workers': workers,
+        'logins': len(latencies),
+        'elapsed': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'median': statistics.median(latencies),
+        'p95': latencies[int(len(latencies) * 0.95) - 1],
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bench.concurrency',
+        description='Compare the concurrent logins per process of the WSGI '
+                    'and the ASGI apps.')
+    parser.add_argument('--logins', type=int, default=100,
+                        help='logins started at once (default: 100)')
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the provider takes to answer each '
+                             'request (default: 0.05)')
+    parser.add_argument('--threads', type=int, action='append',
+                        help='threads of the WSGI worker (default: 1, may be '
+                             'repeated)')
+    parser.add_argument('--output', help='also write the report as JSON here')
+    args = parser.parse_args(argv)
+
+    provider = ProviderServer(args.latency)
+    thread = threading.Thread(target=provider.serve_forever, args=(0.05,))
+    thread.daemon = True
+    thread.start()
+
+    results = []
+    try:
+        for threads in args.threads or [1]:
+            urls = profile_urls(provider, 'wsgi{}'.format(threads),
+                                args.logins)
+            start = time.perf_counter()
+            latencies = measure_wsgi(urls, threads)
+            results.append(summary('wsgi', threads,
+                                   time.perf_counter() - start, latencies))
+        urls = profile_urls(provider, 'asgi', args.logins)
+        start = time.perf_counter()
+        latencies = measure_asgi(urls)
+        results.append(summary('asgi', 1, time.perf_counter() - start,
+                               latencies))
+    finally:
+        provider.shutdown()
+        provider.server_close()
+
+    print('{:<8}{:>9}{:>8}{:>11}{:>11}{:>12}{:>10}'.format(
+        'server', 'threads', 'logins', 'seconds', 'logins/s', 'median ms',
+        'p95 ms'))
+    for result in results:
+        print('{:<8}{:>9}{:>8}{:>11.2f}{:>11.1f}{:>12.1f}{:>10.1f}'.format(
+            result['server'], result['workers'], result['logins'],
+            result['elapsed'], result['throughput'], result['median'] * 1000,
+            result['p95'] * 1000))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'python': platform.python_version(),
+                       'latency': args.latency, 'results': results},
+                      fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+import json
+import os
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus')
+
+HEAD_LINKS = """<link rel="authorization_endpoint" href="https://auth.example.com/auth">
+<link rel="token_endpoint" href="https://auth.example.com/token">
+"""
+
+
+class Page(object):
+    """ A page of the corpus, as served by the stand-in server. """
+
+    def __init__(self, name: str, body: bytes, headers: dict=None,
+                 chunked: bool=False):
+        self.name = name
+        self.body = body
+        self.headers = headers or {}
+        self.chunked = chunked
+
+    @property
+    def path(self) -> str:
+        return '/' + self.name
+
+
+def inline_svg(size: int) -> str:
+    """ A page with the endpoints in the head and a huge inline SVG drawing
+    in the body, like the ones exported by illustration tools. """
+    path = '<path d="M{0} {1}c{2}.5-{1}.25 {0}.75 {2} {1}-{0}z" ' \
+           'fill="#{3:06x}" stroke-width="1.{0}"/>\n'
+    parts = ['<!DOCTYPE html>\n<html><head><meta charset="utf-8">\n'
+             '<title>Drawings</title>\n', HEAD_LINKS,
+             '</head><body><svg xmlns="http://www.w3.org/2000/svg" '
+             'viewBox="0 0 4096 4096">\n']
+    length, i = sum(map(len, parts)), 0
+    while length < size:
+        part = path.format(i % 4096, (i * 7) % 4096, i % 97, i * 2654435761 %
+                           0xffffff)
+        parts.append(part)
+        length += len(part)
+        i += 1
+    parts.append('</svg></body></html>\n')
+    return ''.join(parts)
+
+
+def late_endpoints_head(size: int) -> str:
+    """ A page that inlines a huge JSON blob in a script inside the head,
+    so the endpoints only come after that many bytes of markup. """
+    entries = []
+    length, i = 0, 0
+    while length < size:
+        entry = json.dumps({'id': i, 'title': 'Post number {}'.format(i),
+                            'url': 'https://late.example.com/{}/'.format(i),
+                            'tags': ['indieweb', 'notes', str(i % 13)]})
+        entries.append(entry)
+        length += len(entry) + 1
+        i += 1
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8">\n'
+            '<title>Late endpoints</title>\n'
+            '<script>window.__STATE__ = [' + ','.join(entries) +
+            '];</script>\n' + HEAD_LINKS + '</head><body><p>Hi!</p>'
+            '</body></html>\n')
+
+
+def late_relme_body(size: int) -> str:
+    """ A page without endpoints whose rel=me links come at the end of a
+    long body. """
+    paragraph = '<p>Lorem ipsum dolor sit amet, consectetur adipiscing ' \
+                'elit, sed do eiusmod tempor <a href="/{0}">incididunt</a>.' \
+                '</p>\n'
+    parts = ['<!DOCTYPE html>\n<html><head><meta charset="utf-8">\n'
+             '<title>Long page</title></head><body>\n']
+    length, i = len(parts[0]), 0
+    while length < size:
+        part = paragraph.format(i)
+        parts.append(part)
+        length += len(part)
+        i += 1
+    parts.append('<a rel="me" href="https://github.com/late">GitHub</a>\n'
+                 '</body></html>\n')
+    return ''.join(parts)
+
+
+GENERATORS = {
+    'inline_svg': inline_svg,
+    'late_endpoints_head': late_endpoints_head,
+    'late_relme_body': late_relme_body,
+}
+
+
+def load_corpus(manifest: str=None) -> list:
+    """ Returns the pages described by a manifest. Pages with a file are
+    read from the corpus directory, the rest are generated. """
+    manifest = manifest or os.path.join(CORPUS_DIR, 'manifest.json')
+    with open(manifest) as fp:
+        entries = json.load(fp)['pages']
+
+    pages = []
+    for entry in entries:
+        if 'file' in entry:
+            with open(os.path.join(os.path.dirname(manifest),
+                                   entry['file']), 'rb') as fp:
+                body = fp.read()
+        else:
+            body = GENERATORS[entry['generate']](entry['size']).encode('utf-8')
+        headers = {'Content-Type': 'text/html; charset=utf-8'}
+        headers.update(entry.get('headers', {}))
+        pages.append(Page(entry['name'], body, headers,
+                          entry.get('chunked', False)))
+    return pages
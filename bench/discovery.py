@@ -0,0 +1,148 @@
+"""
+Measures how long the spider takes to discover the endpoints of the pages in
+the benchmark corpus, and how much it reads and allocates while doing so.
+
+    $ python -m bench.discovery --repeat 10 --output before.json
+    $ python -m bench.discovery --repeat 10 --output after.json
+    $ python -m bench.compare before.json after.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from bench.corpus import load_corpus
+from bench.server import StandInServer
+from dummyauth.cache import DiscoveryCache, NegativeCache, RedirectMemo
+from dummyauth.client import HTTPClient
+from dummyauth.spider import EndpointDiscoverySpider
+from dummyauth.strategy import DiscoveryStrategy
+
+
+class MeasuringHTTPClient(HTTPClient):
+    """ An HTTPClient that counts how many body bytes it has read. """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.bytes_read = 0
+
+    def fetch(self, fetch, deadline=None):
+        reader = self.reader()
+        reader.reset()
+        result = super().fetch(fetch, deadline)
+        self.bytes_read += reader.length
+        return result
+
+
+def discover(client: HTTPClient, url: str, strict: bool):
+    """ Runs a discovery without any of the caches the spider may use. """
+    spider = EndpointDiscoverySpider(
+        url, client=client, cache=DiscoveryCache(max_entries=0),
+        strict=strict, strategy=DiscoveryStrategy(html_threshold=0),
+        redirects=RedirectMemo(max_entries=0),
+        failures=NegativeCache(max_entries=0))
+    spider.authorization_endpoint
+    return spider
+
+
+def summarize(values: list) -> dict:
+    return {
+        'min': min(values),
+        'median': statistics.median(values),
+        'mean': statistics.mean(values),
+        'max': max(values),
+    }
+
+
+def measure(client: MeasuringHTTPClient, url: str, strict: bool,
+            repeat: int) -> dict:
+    """ Measures the discovery of a URL. Memory is traced in a separate
+    run, because tracing slows everything else down. """
+    discover(client, url, strict)
+
+    walls, cpus, reads = [], [], []
+    for _ in range(repeat):
+        client.bytes_read = 0
+        wall, cpu = time.perf_counter(), time.process_time()
+        spider = discover(client, url, strict)
+        cpus.append(time.process_time() - cpu)
+        walls.append(time.perf_counter() - wall)
+        reads.append(client.bytes_read)
+
+    tracemalloc.start()
+    try:
+        discover(client, url, strict)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall': summarize(walls),
+        'cpu': summarize(cpus),
+        'bytes_read': max(reads),
+        'peak_memory': peak,
+        'found': {
+            'authorization_endpoint': spider.authorization_endpoint,
+            'token_endpoint': spider.token_endpoint,
+            'relme': spider.supports_relmeauth(),
+        },
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bench.discovery',
+        description='Benchmark endpoint discovery over the page corpus.')
+    parser.add_argument('--manifest', help='corpus manifest to use')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='measured discoveries per page (default: 5)')
+    parser.add_argument('--strict', action='store_true',
+                        help='parse whole documents using html5lib')
+    parser.add_argument('--page', action='append', dest='pages',
+                        help='only run this page (may be repeated)')
+    parser.add_argument('--output', help='write the results to this file '
+                                         'instead of stdout')
+    args = parser.parse_args(argv)
+
+    pages = load_corpus(args.manifest)
+    if args.pages:
+        pages = [page for page in pages if page.name in args.pages]
+
+    results = []
+    client = MeasuringHTTPClient()
+    with StandInServer(args.manifest) as server:
+        for page in pages:
+            result = measure(client, server.url(page.path), args.strict,
+                             args.repeat)
+            result.update({'page': page.name, 'size': len(page.body)})
+            results.append(result)
+            print('{:<22} {:>9} B  wall {:8.2f} ms  cpu {:8.2f} ms  '
+                  'read {:>9} B  peak {:>9} B'.format(
+                      page.name, len(page.body),
+                      result['wall']['median'] * 1000,
+                      result['cpu']['median'] * 1000,
+                      result['bytes_read'], result['peak_memory']),
+                  file=sys.stderr)
+    client.close()
+
+    report = {
+        'benchmark': 'discovery',
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parser': 'html5lib' if args.strict else 'streaming',
+        'repeat': args.repeat,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fp:
+            fp.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,96 @@
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from bench.corpus import load_corpus
+
+
+class CorpusHandler(BaseHTTPRequestHandler):
+    """ Serves the pages of the corpus, keeping connections alive. """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately. Without this, small pages
+    # would wait for the delayed ACK of the client.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body: bool):
+        page = self.server.pages.get(self.path)
+        if page is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        for name, value in page.headers.items():
+            self.send_header(name, value)
+        if page.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(page.body)))
+        self.end_headers()
+        if not send_body:
+            return
+        try:
+            if page.chunked:
+                for i in range(0, len(page.body), 8192):
+                    piece = page.body[i:i + 8192]
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(piece), piece))
+                self.wfile.write(b'0\r\n\r\n')
+            else:
+                self.wfile.write(page.body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client has seen enough of the page and hung up.
+            self.close_connection = True
+
+
+class CorpusServer(ThreadingMixIn, HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, pages):
+        super().__init__(('127.0.0.1', 0), CorpusHandler)
+        self.pages = {page.path: page for page in pages}
+
+    def handle_error(self, request, client_address):
+        # The spider hangs up as soon as it has read enough of a page.
+        pass
+
+
+def serve(manifest, conn):
+    server = CorpusServer(load_corpus(manifest))
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+class StandInServer(object):
+    """
+    Runs the corpus server in a child process, so that its CPU time and
+    memory are not mixed with those of the spider being measured.
+    """
+
+    def __init__(self, manifest: str=None):
+        self.manifest = manifest
+        self.port = None
+        self.__process = None
+
+    def __enter__(self):
+        parent, child = multiprocessing.Pipe()
+        self.__process = multiprocessing.Process(
+            target=serve, args=(self.manifest, child), daemon=True)
+        self.__process.start()
+        self.port = parent.recv()
+        return self
+
+    def __exit__(self, *exc):
+        self.__process.terminate()
+        self.__process.join()
+
+    def url(self, path: str) -> str:
+        return 'http://127.0.0.1:{}{}'.format(self.port, path)
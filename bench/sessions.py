@@ -0,0 +1,106 @@
+"""
+Measures how long every session backend takes to load and save the session
+of the login handshake, compared to the signed cookie sessions.
+
+    $ python -m bench.sessions --requests 5000
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from flask import Flask, session
+from dummyauth.sessions import MemorySessionStore, SQLiteSessionStore, \
+    ServerSessionInterface
+
+BACKENDS = ('cookie', 'memory', 'sqlite')
+
+
+def build_app(backend: str, directory: str) -> Flask:
+    """ Builds an app whose views use the session like the login does: the
+    first one stores the state of the handshake, the second one reads it
+    and replaces it with the profile. """
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    if backend == 'memory':
+        app.session_interface = ServerSessionInterface(MemorySessionStore())
+    elif backend == 'sqlite':
+        path = os.path.join(directory, 'sessions.sqlite3')
+        app.session_interface = ServerSessionInterface(SQLiteSessionStore(path))
+
+    @app.route('/login')
+    def login():
+        session['login.endpoint'] = 'https://auth.example.com/auth'
+        session['login.state'] = 'b5d7aa3a5bcd2e84b5d7aa3a5bcd2e84'
+        session['login.profile'] = 'https://example.com/'
+        return ''
+
+    @app.route('/callback')
+    def callback():
+        session.pop('login.endpoint')
+        session.pop('login.state')
+        session['login.me'] = session.pop('login.profile')
+        return ''
+
+    return app
+
+
+def measure(backend: str, requests: int, directory: str) -> dict:
+    app = build_app(backend, directory)
+    client = app.test_client()
+    timings = []
+    cookie_size = 0
+    for _ in range(requests):
+        client.cookie_jar.clear()
+        start = time.perf_counter()
+        response = client.get('/login')
+        client.get('/callback')
+        timings.append((time.perf_counter() - start) / 2)
+        cookie_size = max(cookie_size, len(response.headers['Set-Cookie']))
+    timings.sort()
+    return {
+        'backend': backend,
+        'requests': requests * 2,
+        'mean': statistics.mean(timings),
+        'median': statistics.median(timings),
+        'p99': timings[int(len(timings) * 0.99)],
+        'cookie_size': cookie_size,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bench.sessions',
+        description='Measure the time per request of every session backend.')
+    parser.add_argument('--requests', type=int, default=2000,
+                        help='login handshakes to run per backend')
+    parser.add_argument('--backend', action='append', choices=BACKENDS,
+                        help='only measure this backend (may be repeated)')
+    parser.add_argument('--output', help='also write the report as JSON here')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        results = [measure(backend, args.requests, directory)
+                   for backend in args.backend or BACKENDS]
+
+    baseline = results[0]['median']
+    print('{:<10}{:>12}{:>12}{:>12}{:>12}{:>10}'.format(
+        'backend', 'mean us', 'median us', 'p99 us', 'vs first', 'cookie'))
+    for result in results:
+        print('{:<10}{:>12.1f}{:>12.1f}{:>12.1f}{:>+11.1f}%{:>10}'.format(
+            result['backend'], result['mean'] * 1e6, result['median'] * 1e6,
+            result['p99'] * 1e6, (result['median'] / baseline - 1) * 100,
+            result['cookie_size']))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'python': platform.python_version(),
+                       'results': results}, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
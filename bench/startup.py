@@ -0,0 +1,145 @@
+"""
+Measures how long each startup profile takes to build the app, how long the
+first login of a worker takes to get going, and how much memory each worker
+uses after forking, the way uWSGI does.
+
+    $ python -m bench.startup --workers 4
+
+Every profile is measured in a new interpreter, so that nothing is imported
+beforehand. Memory is read from /proc/<pid>/smaps_rollup, so it only works
+on Linux: rss counts the pages shared with the master too, while private is
+what each worker has copied or allocated on its own.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+PROFILES = ('lazy', 'preload')
+
+
+def memory() -> dict:
+    """ Returns the memory used by this process, in KiB. """
+    fields = {}
+    with open('/proc/self/smaps_rollup') as fp:
+        for line in fp:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'private': fields.get('Private_Clean', 0) +
+                   fields.get('Private_Dirty', 0),
+    }
+
+
+def worker(app, ready_fd: int, go_fd: int, report_fd: int):
+    """ Serves a page and gets ready to log in, like the first request of a
+    worker would, then reports its memory once every worker is alive. """
+    from dummyauth import startup
+    client = app.test_client()
+    start = time.perf_counter()
+    client.get('/')
+    startup.load_spider(app)
+    first_request = time.perf_counter() - start
+    os.write(ready_fd, b'.')
+    os.read(go_fd, 1)
+    report = dict(memory(), first_request=first_request)
+    os.write(report_fd, (json.dumps(report) + '\n').encode('ascii'))
+
+
+def child(profile: str, workers: int):
+    """ Builds the app using a profile and forks the workers. Writes the
+    results as JSON to stdout. """
+    start = time.perf_counter()
+    from dummyauth import create_app
+    app = create_app(profile)
+    startup_time = time.perf_counter() - start
+    app.config['SECRET_KEY'] = 'bench'
+    master = memory()
+    heavy = [name for name in ('requests', 'bs4', 'html5lib', 'dummyauth.spider')
+             if name in sys.modules]
+
+    ready_r, ready_w = os.pipe()
+    go_r, go_w = os.pipe()
+    report_r, report_w = os.pipe()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                worker(app, ready_w, go_r, report_w)
+            finally:
+                os._exit(0)
+        pids.append(pid)
+
+    for _ in range(workers):
+        os.read(ready_r, 1)
+    os.write(go_w, b'.' * workers)
+    with os.fdopen(report_r) as fp:
+        reports = [json.loads(fp.readline()) for _ in range(workers)]
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+    json.dump({
+        'profile': profile,
+        'startup': startup_time,
+        'imported': heavy,
+        'master': master,
+        'workers': reports,
+    }, sys.stdout)
+
+
+def mean(values) -> float:
+    values = list(values)
+    return sum(values) / len(values)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m bench.startup',
+        description='Measure the startup time and memory of every profile.')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='workers to fork (default: 4)')
+    parser.add_argument('--profile', action='append', choices=PROFILES,
+                        help='only measure this profile (may be repeated)')
+    parser.add_argument('--output', help='also write the report as JSON here')
+    parser.add_argument('--child', choices=PROFILES, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        child(args.child, args.workers)
+        return 0
+
+    results = []
+    for profile in args.profile or PROFILES:
+        output = subprocess.run(
+            [sys.executable, '-m', 'bench.startup', '--child', profile,
+             '--workers', str(args.workers)],
+            check=True, stdout=subprocess.PIPE).stdout
+        results.append(json.loads(output.decode('utf-8')))
+
+    print('{:<9}{:>11}{:>15}{:>12}{:>12}{:>14}'.format(
+        'profile', 'startup ms', 'first req ms', 'rss KiB', 'pss KiB',
+        'private KiB'))
+    for result in results:
+        workers = result['workers']
+        print('{:<9}{:>11.1f}{:>15.1f}{:>12.0f}{:>12.0f}{:>14.0f}'.format(
+            result['profile'], result['startup'] * 1000,
+            mean(w['first_request'] for w in workers) * 1000,
+            mean(w['rss'] for w in workers), mean(w['pss'] for w in workers),
+            mean(w['private'] for w in workers)))
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'python': platform.python_version(),
+                       'results': results}, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
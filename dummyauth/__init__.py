@@ -1,12 +1,26 @@
 from flask import Flask
 from flask_wtf import CSRFProtect
-from dummyauth import views
+from dummyauth import assets, sessions, startup, templating, views
+from dummyauth.breaker import circuit_breaker
+from dummyauth.bulkhead import bulkhead
+from dummyauth.cache import discovery_cache, negative_cache, redirect_memo, \
+    relme_cache
 from dummyauth.exceptions import DummyAuthException
+from dummyauth.metrics import metrics
+from dummyauth.prefetch import prefetcher
+from dummyauth.resolver import dns_cache
+from dummyauth.singleflight import single_flight
+from dummyauth.strategy import discovery_strategy
 import os
 
 csrf = CSRFProtect()
 
-def create_app():
+def create_app(profile: str=None):
+    """ Builds the application.
+
+    :param profile: the startup profile, lazy or preload. If not given,
+        STARTUP_PROFILE is used. See dummyauth.startup.
+    """
     configs = {
         'production': 'dummyauth.config.BaseConfig',
         'development': 'dummyauth.config.DevelopmentConfig',
@@ -15,15 +29,40 @@ def create_app():
     app = Flask(__name__)
     app.config.from_object(configs.get(app.env, configs['production']))
     csrf.init_app(app)
+    discovery_cache.init_app(app)
+    discovery_strategy.init_app(app)
+    redirect_memo.init_app(app)
+    negative_cache.init_app(app)
+    relme_cache.init_app(app)
+    single_flight.init_app(app)
+    metrics.init_app(app)
+    dns_cache.init_app(app)
+    circuit_breaker.init_app(app)
+    bulkhead.init_app(app)
+    prefetcher.init_app(app)
+    sessions.init_app(app)
+    templating.init_app(app)
+    assets.init_app(app)
 
     app.add_url_rule('/', 'login', views.login_view, methods=['GET', 'POST'])
+    app.add_url_rule('/discover', 'discover', views.discover_view,
+                     methods=['POST'])
     app.add_url_rule('/callback', 'callback', views.login_callback)
     app.add_url_rule('/success', 'success', views.display_profile)
     app.add_url_rule('/error', 'failure', views.handle_error_response)
     app.add_url_rule('/logout', 'logout', views.clear_session, methods=['POST'])
+    app.add_url_rule('/metrics', 'metrics', views.metrics_view)
+    if app.debug:
+        app.add_url_rule('/debug/discovery', 'discovery_stats',
+                         views.discovery_stats)
+        app.add_url_rule('/debug/circuits', 'circuit_stats',
+                         views.circuit_stats)
 
     # Register an error handler for exceptions.
     app.register_error_handler(DummyAuthException, views.handle_error_response)
+
+    # Import and build the rest now or on first use, depending on the profile.
+    startup.init_app(app, profile or app.config['STARTUP_PROFILE'])
     return app
 
 __all__ = ['create_app']
@@ -0,0 +1,445 @@
+import asyncio
+import ssl
+import time
+from urllib.parse import urlencode, urlsplit
+from dummyauth.breaker import CircuitBreaker, circuit_breaker
+from dummyauth.client import BoundedReader, Fetch, FetchResult, build_result
+from dummyauth.deadline import Deadline
+from dummyauth.resolver import dns_cache
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Requests that can be sent again if a reused connection fails. A POST may
+# have reached the server, and sending a code again could redeem it twice.
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD'))
+
+
+class ResponseBody(object):
+    """
+    Reads the body of an HTTP/1.1 response from a stream, whether it is
+    delimited by Content-Length, sent using chunked transfer encoding or
+    delimited by the server closing the connection.
+    """
+
+    def __init__(self, stream: asyncio.StreamReader, length: int=None,
+                 chunked: bool=False):
+        self.__stream = stream
+        self.__chunked = chunked
+        self.__chunk_left = 0
+        self.length = length
+        self.finished = length == 0
+
+    @property
+    def remaining(self) -> int:
+        """ Returns how many bytes are left, or None if it is unknown. """
+        return None if self.__chunked else self.length
+
+    async def read(self, amount: int) -> bytes:
+        """ Reads up to amount bytes. Returns b'' once the body is over. """
+        if self.finished:
+            return b''
+        if self.__chunked:
+            return await self.__read_chunked(amount)
+        if self.length is None:
+            data = await self.__stream.read(amount)
+            self.finished = not data
+            return data
+
+        data = await self.__stream.read(min(amount, self.length))
+        if not data:
+            raise asyncio.IncompleteReadError(b'', self.length)
+        self.length -= len(data)
+        self.finished = self.length == 0
+        return data
+
+    async def __read_chunked(self, amount: int) -> bytes:
+        if not self.__chunk_left:
+            line = await self.__stream.readline()
+            try:
+                size = int(line.split(b';', 1)[0].strip(), 16)
+            except ValueError:
+                raise ConnectionError('Invalid chunk size: {!r}'.format(line))
+            if size == 0:
+                # Skip the trailer section, up to the final empty line.
+                while (await self.__stream.readline()).strip():
+                    pass
+                self.finished = True
+                return b''
+            self.__chunk_left = size
+
+        data = await self.__stream.read(min(amount, self.__chunk_left))
+        if not data:
+            raise asyncio.IncompleteReadError(b'', self.__chunk_left)
+        self.__chunk_left -= len(data)
+        if not self.__chunk_left:
+            await self.__stream.readexactly(2)
+        return data
+
+
+class AsyncConnection(object):
+    """ A keep-alive connection to a host, owned by an AsyncHTTPClient. """
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.reused = False
+        self.idle_since = None
+
+    @property
+    def dropped(self) -> bool:
+        """ Returns true if the server has hung up on this connection. """
+        # StreamWriter.is_closing() is missing from Python 3.6.
+        return self.reader.at_eof() or self.writer.transport.is_closing()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncHTTPClient(object):
+    """
+    Outbound HTTP/1.1 client for asyncio. This is the non-blocking
+    counterpart of HTTPClient: it runs the same discovery and verification
+    flows, but many of them can be in flight at once on a single event loop.
+
+    Connections are kept alive and reused per host, and no more than
+    pool_maxsize requests are sent to the same host at the same time.
+    Bodies are read into BoundedReader buffers, which are recycled between
+    requests, so the memory used is bounded by the number of requests in
+    flight.
+
+    Like asyncio primitives, a client is bound to the event loop where it
+    is first used. If it is used again from a different loop, the pooled
+    connections of the previous one are forgotten.
+    """
+
+    def __init__(self, pool_maxsize: int=4, idle_timeout: float=30.0,
+                 max_body_size: int=1024 * 1024, read_size: int=16384,
+                 drain_limit: int=65536, ssl_context: ssl.SSLContext=None,
+                 breaker: CircuitBreaker=None):
+        """ Initialize the client.
+
+        :param pool_maxsize: how many requests may be sent to the same host
+            at once, and how many connections to keep alive per host.
+        :param idle_timeout: seconds a connection may sit idle in the pool
+            before being discarded instead of reused.
+        :param max_body_size: the maximum number of bytes read from the
+            body of a response.
+        :param read_size: how many bytes to read from the network at once.
+        :param drain_limit: when a response is not read completely, if at
+            most this many bytes are left they are discarded to reuse the
+            connection. Otherwise, the connection is closed.
+        :param ssl_context: the context used for https URLs. A default
+            context that verifies certificates is built if not given.
+        :param breaker: the circuit breaker of the hosts. By default, the
+            shared circuit breaker is used.
+        """
+        self.breaker = circuit_breaker if breaker is None else breaker
+        self.pool_maxsize = pool_maxsize
+        self.idle_timeout = idle_timeout
+        self.max_body_size = max_body_size
+        self.read_size = read_size
+        self.drain_limit = drain_limit
+        self.__ssl_context = ssl_context
+        self.__loop = None
+        self.__idle = {}
+        self.__limits = {}
+        self.__readers = []
+
+    def init_app(self, app):
+        """ Configure the client using the settings of a Flask app. """
+        self.pool_maxsize = app.config['HTTP_POOL_MAXSIZE']
+        self.idle_timeout = app.config['HTTP_POOL_IDLE_TIMEOUT']
+        self.max_body_size = app.config['HTTP_MAX_BODY_SIZE']
+        self.read_size = app.config['HTTP_READ_SIZE']
+
+    @property
+    def ssl_context(self) -> ssl.SSLContext:
+        if self.__ssl_context is None:
+            self.__ssl_context = ssl.create_default_context()
+        return self.__ssl_context
+
+    async def run(self, flow, deadline: Deadline=None):
+        """ Runs a flow, sending each Fetch it yields. Returns its result.
+        If a request fails, the exception is thrown into the flow.
+
+        :param deadline: the time budget of the whole flow, if any.
+        """
+        try:
+            fetch = next(flow)
+            while True:
+                try:
+                    result = await self.fetch(fetch, deadline)
+                except Exception as e:
+                    fetch = flow.throw(e)
+                else:
+                    fetch = flow.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    async def fetch(self, fetch: Fetch, deadline: Deadline=None) -> FetchResult:
+        """ Sends the request described by a Fetch. Redirects aren't followed.
+
+        :param deadline: if given, the request is not sent once it is over,
+            and each step of the request is limited by it.
+        :raise DeadlineExceeded: if the deadline is over.
+        :raise CircuitOpen: if the circuit of the host is open.
+        """
+        if deadline is not None:
+            deadline.check(fetch.url)
+        with self.breaker.guard(fetch.url) as call:
+            try:
+                result = await self.__fetch(fetch, deadline)
+            except Exception as e:
+                if deadline is not None and deadline.expired:
+                    raise deadline.exceeded(fetch.url) from e
+                raise
+            call.status_code = result.status_code
+        return result
+
+    async def __fetch(self, fetch: Fetch,
+                      deadline: Deadline=None) -> FetchResult:
+        url = urlsplit(fetch.url)
+        if url.scheme not in DEFAULT_PORTS or not url.hostname:
+            raise ValueError('Unsupported URL: {}'.format(fetch.url))
+        key = (url.scheme, url.hostname, url.port or DEFAULT_PORTS[url.scheme])
+
+        async with self.__limit(key):
+            conn = self.__take_idle(key)
+            if conn is not None:
+                try:
+                    return await self.__exchange(key, conn, url, fetch,
+                                                 deadline)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    # The server may have closed a kept-alive connection
+                    # right when it was reused. Try with a new one.
+                    conn.close()
+                    if fetch.method not in IDEMPOTENT_METHODS:
+                        raise
+            conn = await self.__within(self.__connect(key), deadline,
+                                       'connect')
+            return await self.__exchange(key, conn, url, fetch, deadline)
+
+    async def close(self):
+        """ Closes every idle connection. """
+        idle, self.__idle = self.__idle, {}
+        if asyncio.get_event_loop() is not self.__loop:
+            # Those connections belong to another loop, which may be over.
+            return
+        for connections in idle.values():
+            for conn in connections:
+                conn.close()
+
+    def __limit(self, key) -> asyncio.Semaphore:
+        loop = asyncio.get_event_loop()
+        if loop is not self.__loop:
+            self.__loop = loop
+            self.__idle = {}
+            self.__limits = {}
+        if key not in self.__limits:
+            self.__limits[key] = asyncio.Semaphore(self.pool_maxsize)
+        return self.__limits[key]
+
+    def __take_idle(self, key) -> AsyncConnection:
+        connections = self.__idle.get(key, [])
+        while connections:
+            conn = connections.pop()
+            idle = time.monotonic() - conn.idle_since
+            if conn.dropped or idle > self.idle_timeout:
+                conn.close()
+            else:
+                conn.reused = True
+                return conn
+        return None
+
+    def __put_idle(self, key, conn: AsyncConnection):
+        connections = self.__idle.setdefault(key, [])
+        if len(connections) >= self.pool_maxsize:
+            conn.close()
+            return
+        conn.idle_since = time.monotonic()
+        connections.append(conn)
+
+    async def __connect(self, key) -> AsyncConnection:
+        scheme, host, port = key
+        tls = {}
+        if scheme == 'https':
+            tls = {'ssl': self.ssl_context, 'server_hostname': host}
+        error = ConnectionError('No addresses found for {}'.format(host))
+        for address in await self.__resolve(host, port):
+            try:
+                reader, writer = await asyncio.open_connection(address, port,
+                                                               **tls)
+            except OSError as e:
+                error = e
+            else:
+                return AsyncConnection(reader, writer)
+        raise error
+
+    @staticmethod
+    async def __resolve(host: str, port: int) -> list:
+        # Only a lookup that isn't cached is run in the executor, since
+        # getaddrinfo() blocks.
+        addresses = dns_cache.cached_addresses(host, port)
+        if addresses is not None:
+            return addresses
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, dns_cache.addresses,
+                                          host, port)
+
+    def __take_reader(self) -> BoundedReader:
+        while self.__readers:
+            reader = self.__readers.pop()
+            if reader.max_bytes == self.max_body_size:
+                reader.chunk_size = self.read_size
+                return reader
+        return BoundedReader(self.max_body_size, self.read_size,
+                             self.drain_limit)
+
+    @staticmethod
+    async def __within(awaitable, deadline: Deadline, phase: str,
+                       expires: float=None):
+        """ Awaits a step of a request, for no longer than the deadline
+        allows for its phase, nor past expires, a monotonic time. """
+        if deadline is None:
+            return await awaitable
+        timeout = deadline.timeout(phase)
+        if expires is not None:
+            timeout = min(timeout, expires - time.monotonic())
+            if timeout <= 0:
+                awaitable.close()
+                raise asyncio.TimeoutError()
+        return await asyncio.wait_for(awaitable, timeout)
+
+    async def __exchange(self, key, conn: AsyncConnection, url,
+                         fetch: Fetch, deadline: Deadline=None) -> FetchResult:
+        """ Sends a request using the given connection and reads the reply.
+        """
+        try:
+            return await self.__transfer(key, conn, url, fetch, deadline)
+        except Exception:
+            # The connection may be in the middle of a response, or the
+            # response may have been rejected. Don't reuse it.
+            conn.close()
+            raise
+
+    async def __transfer(self, key, conn: AsyncConnection, url,
+                         fetch: Fetch, deadline: Deadline) -> FetchResult:
+        self.__write_request(conn, url, fetch)
+        await self.__within(conn.writer.drain(), deadline, 'response')
+        version, status_code, headers = await self.__within(
+            self.__read_head(conn), deadline, 'response')
+
+        # Find out how the body is delimited.
+        length = None
+        chunked = 'chunked' in headers.get('transfer-encoding', '').lower()
+        if fetch.method == 'HEAD' or status_code in (204, 304) or \
+           100 <= status_code < 200:
+            length = 0
+        elif not chunked and 'content-length' in headers:
+            length = int(headers['content-length'])
+        body = ResponseBody(conn.reader, length, chunked)
+        keep_alive = version == 'HTTP/1.1' and (length is not None or chunked)
+        if 'close' in headers.get('connection', '').lower():
+            keep_alive = False
+
+        parser = None
+        if fetch.parser is not None:
+            parser = fetch.parser(status_code, headers)
+
+        expires = deadline.body_expires() if deadline is not None else None
+        reader = self.__take_reader()
+        try:
+            reader.reset()
+            parsed = None
+            if parser is not None or fetch.read_body:
+                while not reader.full:
+                    amount = min(reader.chunk_size,
+                                 reader.max_bytes - reader.length)
+                    data = await self.__within(body.read(amount), deadline,
+                                               'response', expires)
+                    if not data:
+                        break
+                    chunk = reader.append(data)
+                    if parser is not None:
+                        parser.feed(chunk)
+                        if parser.done:
+                            break
+                reader.complete = body.finished
+                if parser is not None:
+                    parsed = parser.finish(reader.content)
+            content = bytes(reader.content) if fetch.read_body else None
+        finally:
+            self.__readers.append(reader)
+
+        # Get rid of the rest of the body, if it's short enough, to be able
+        # to reuse the connection. Otherwise, hang up.
+        if not body.finished and body.remaining is not None and \
+           body.remaining <= self.drain_limit:
+            while await self.__within(body.read(self.read_size), deadline,
+                                      'response', expires):
+                pass
+        if keep_alive and body.finished:
+            self.__put_idle(key, conn)
+        else:
+            conn.close()
+        return build_result(status_code, headers, content, parsed)
+
+    @staticmethod
+    def __write_request(conn: AsyncConnection, url, fetch: Fetch):
+        target = url.path or '/'
+        if url.query:
+            target += '?' + url.query
+        host = url.hostname if url.port is None else \
+            '{}:{}'.format(url.hostname, url.port)
+
+        headers = {
+            'Host': host,
+            'User-Agent': 'dummyauth',
+            'Accept': '*/*',
+            'Accept-Encoding': 'identity',
+            'Connection': 'keep-alive',
+        }
+        payload = b''
+        if fetch.data is not None:
+            payload = urlencode(fetch.data).encode('utf-8')
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        if payload or fetch.method == 'POST':
+            headers['Content-Length'] = str(len(payload))
+        headers.update(fetch.headers)
+
+        lines = ['{} {} HTTP/1.1'.format(fetch.method, target)]
+        lines.extend('{}: {}'.format(k, v) for k, v in headers.items())
+        head = '\r\n'.join(lines) + '\r\n\r\n'
+        conn.writer.write(head.encode('latin-1') + payload)
+
+    @staticmethod
+    async def __read_head(conn: AsyncConnection):
+        try:
+            head = await conn.reader.readuntil(b'\r\n\r\n')
+        except asyncio.LimitOverrunError:
+            raise ConnectionError('Response headers are too large.')
+        status_line, *lines = head.decode('latin-1').split('\r\n')
+        try:
+            version, status, *_ = status_line.split(' ', 2)
+            status_code = int(status)
+        except ValueError:
+            raise ConnectionError('Invalid status line: ' + status_line)
+
+        # Repeated headers, such as Link, are combined into a single one.
+        headers = {}
+        for line in lines:
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+            name = name.strip().lower()
+            value = value.strip()
+            if name in headers:
+                headers[name] += ', ' + value
+            else:
+                headers[name] = value
+        return version, status_code, headers
+
+
+# The client used by default. Flask apps configure it using init_app().
+async_http_client = AsyncHTTPClient()
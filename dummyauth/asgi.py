@@ -0,0 +1,229 @@
+import asyncio
+import io
+import sys
+from flask import current_app, request, session
+from dummyauth import startup, views
+from dummyauth.bulkhead import bulkhead
+from dummyauth.exceptions import Overloaded
+from dummyauth.forms import LoginForm
+from dummyauth.prefetch import prefetcher
+
+# The largest request body read. Only the login form is ever posted.
+MAX_BODY_SIZE = 64 * 1024
+
+
+class ASGIApp(object):
+    """
+    Serves a DummyAuth Flask app through ASGI, so that a single process can
+    have many logins in flight at once, instead of one per worker.
+
+    Flask, and the views, run the same way they do under WSGI: same
+    templates, CSRF protection, sessions and error pages. What changes is
+    that the requests that have to wait for other servers, the discovery of
+    a profile, the check of its rel="me" links and the verification of a
+    code, are done before handing the request to Flask, using the asyncio
+    spiders. Their results are left in the WSGI environ, where the views
+    pick them up instead of fetching anything themselves, and raise the
+    errors they got, if any. See dummyauth.views.DISCOVERY_KEY.
+
+    Once nothing is left to wait for, Flask only does CPU work, so it runs
+    on the event loop thread. Note that the sqlite session backend still
+    blocks it while the database is read and written.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.spider = startup.load_spider(app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.__lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.__http(scope, receive, send)
+
+    async def __lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.spider.async_http_client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __http(self, scope, receive, send):
+        body = await read_body(receive, MAX_BODY_SIZE)
+        if body is None:
+            await send_response(send, 413, [(b'content-type', b'text/plain')],
+                                [b'Request Entity Too Large'])
+            return
+        environ = build_environ(scope, body)
+        await self.prefetch(build_environ(scope, body), environ)
+        status, headers, chunks = call_wsgi(self.app, environ)
+        await send_response(send, status, headers, chunks)
+
+    async def prefetch(self, probe: dict, environ: dict):
+        """ Fetches what the view of a request will need, and leaves it in
+        its environ.
+
+        :param probe: a copy of the environ, to look at the request without
+            consuming the body of the one given to Flask.
+        """
+        future = None
+        with self.app.request_context(probe):
+            if request.endpoint == 'login' and request.method == 'POST':
+                form = LoginForm(request.form)
+                if not form.validate():
+                    return
+                # Started by discover_view while the form was filled in.
+                future = prefetcher.take(form.domain.data)
+                url, key = form.domain.data, views.DISCOVERY_KEY
+                options = views.discovery_options(current_app.config)
+                fetch = self.__discover(environ, url, options)
+            elif request.endpoint == 'callback' and self.__valid_callback():
+                url, key = session['login.endpoint'], views.VERIFICATION_KEY
+                options = views.verification_options()
+                fetch = self.__verify(environ, options)
+            else:
+                return
+        if future is not None:
+            environ.update(await asyncio.wrap_future(future))
+            if key in environ:
+                fetch.close()
+                return
+            # The bulkhead turned the prefetch away. Discover it here all
+            # the same, or the view would do it, blocking the event loop.
+        try:
+            slot = bulkhead.acquire(url)
+        except Overloaded as e:
+            # The view raises it, turning the request down.
+            fetch.close()
+            environ[key] = e
+            return
+        try:
+            await fetch
+        finally:
+            bulkhead.release(slot)
+
+    async def __discover(self, environ: dict, url: str, options: dict):
+        spider = self.spider.AsyncEndpointDiscoverySpider(url, **options)
+        try:
+            await spider.discover()
+        except Exception as e:
+            environ[views.DISCOVERY_KEY] = e
+            return
+        environ[views.DISCOVERY_KEY] = spider
+        if spider.authorization_endpoint or not spider.supports_relmeauth():
+            return
+        verifier = self.spider.AsyncRelMeVerifier(
+            **views.relme_options(spider, self.app.config))
+        try:
+            await verifier.verify()
+        except Exception as e:
+            environ[views.RELME_KEY] = e
+            return
+        environ[views.RELME_KEY] = verifier
+
+    async def __verify(self, environ: dict, options: dict):
+        validator = self.spider.AsyncAuthorizationCodeValidator(**options)
+        try:
+            await validator.verify()
+        except Exception as e:
+            environ[views.VERIFICATION_KEY] = e
+            return
+        environ[views.VERIFICATION_KEY] = validator
+
+    @staticmethod
+    def __valid_callback() -> bool:
+        """ Tells whether the callback view will verify the code, so that a
+        forged callback doesn't get anything sent. """
+        try:
+            return session['login.state'] is not None and \
+                int(request.args['state']) == session['login.state'] and \
+                session.get('login.endpoint') is not None and \
+                'code' in request.args
+        except (KeyError, ValueError):
+            return False
+
+
+async def read_body(receive, max_size: int) -> bytes:
+    """ Reads the body of a request, or returns None if it is too large. """
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if size > max_size:
+            return None
+        chunks.append(chunk)
+        if not message.get('more_body', False):
+            break
+    return b''.join(chunks)
+
+
+def build_environ(scope: dict, body: bytes) -> dict:
+    """ Builds the WSGI environ of an ASGI HTTP request. """
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8')
+                                                 .decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/{}'.format(scope.get('http_version', '1.1')),
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': False,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'CONTENT_LENGTH':
+            key = 'HTTP_' + name
+            if key in environ:
+                # HTTP/2 clients may send each cookie in its own header.
+                separator = '; ' if name == 'COOKIE' else ','
+                value = environ[key] + separator + value
+            environ[key] = value
+    return environ
+
+
+def call_wsgi(app, environ: dict):
+    """ Calls a WSGI app. Returns its status code, headers and body. """
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = [(name.lower().encode('latin-1'),
+                                value.encode('latin-1'))
+                               for name, value in headers]
+        return lambda data: response.setdefault('written', []).append(data)
+
+    iterable = app(environ, start_response)
+    try:
+        chunks = response.get('written', []) + [chunk for chunk in iterable]
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
+    return response['status'], response['headers'], chunks
+
+
+async def send_response(send, status: int, headers: list, chunks: list):
+    """ Sends a response through ASGI. """
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers})
+    await send({'type': 'http.response.body', 'body': b''.join(chunks)})
@@ -0,0 +1,151 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+import tempfile
+import click
+from flask import current_app, request
+from flask.cli import with_appcontext
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# Name of the file that maps every asset to its fingerprinted name.
+MANIFEST = 'manifest.json'
+
+# Assets worth compressing. Images are already compressed.
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.html', '.json')
+
+# Fingerprinted assets never change, so clients may keep them forever.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def fingerprint(name: str, content: bytes) -> str:
+    """ Returns the name of an asset with the hash of its content in it,
+    such as vapor.1a2b3c4d5e6f.css for vapor.css. """
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    root, ext = os.path.splitext(name)
+    return '{}.{}{}'.format(root, digest, ext)
+
+
+def write_atomic(path: str, content: bytes):
+    """ Writes a file under a temporary name and then renames it, so that a
+    server never sends half of it. """
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(content)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def gzip_compress(content: bytes) -> bytes:
+    """ Compresses an asset with gzip, leaving the time out of the header so
+    that building the same asset again gives the same file. """
+    # gzip.compress() takes no mtime before Python 3.8.
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                       mtime=0) as fp:
+        fp.write(content)
+    return buf.getvalue()
+
+
+def build(source: str, output: str, use_brotli: bool=True) -> dict:
+    """
+    Copies every asset in source to output under its fingerprinted name,
+    next to a gzip and, if the brotli module is installed, a brotli version
+    of the compressible ones, and writes the manifest.
+
+    Assets from earlier builds are kept, so that pages rendered by workers
+    still running the previous version can still load them.
+
+    :return: the manifest, which maps every asset to its fingerprinted name.
+    """
+    manifest = {}
+    for root, _, files in os.walk(source):
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            name = os.path.relpath(path, source).replace(os.sep, '/')
+            with open(path, 'rb') as fp:
+                content = fp.read()
+            hashed = fingerprint(name, content)
+            manifest[name] = hashed
+
+            target = os.path.join(output, *hashed.split('/'))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.exists(target):
+                continue
+            variants = [(target, content)]
+            if name.endswith(COMPRESSIBLE):
+                variants.append((target + '.gz', gzip_compress(content)))
+                if use_brotli and brotli is not None:
+                    variants.append((target + '.br', brotli.compress(content)))
+            # The uncompressed one goes last, so it only exists once the
+            # variants that a server may look for next to it do.
+            for path, data in reversed(variants):
+                write_atomic(path, data)
+
+    write_atomic(os.path.join(output, MANIFEST),
+                 json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(directory: str) -> dict:
+    """ Returns the manifest of a build, or None if there is none yet. """
+    try:
+        with open(os.path.join(directory, MANIFEST), 'rb') as fp:
+            return json.loads(fp.read().decode('utf-8'))
+    except FileNotFoundError:
+        return None
+
+
+def init_app(app):
+    """
+    Serves the assets built into STATIC_BUILD_DIR, if set and built, and
+    makes url_for('static', filename=...) return their fingerprinted names.
+    Adds the build-assets command.
+    """
+    app.cli.add_command(build_command)
+    directory = app.config['STATIC_BUILD_DIR']
+    manifest = load_manifest(directory) if directory else None
+    if manifest is None:
+        return
+    app.extensions['dummyauth.assets'] = manifest
+    app.static_folder = os.path.abspath(directory)
+    hashed = frozenset(manifest.values())
+
+    @app.url_defaults
+    def fingerprinted_url(endpoint, values):
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = manifest.get(values['filename'],
+                                              values['filename'])
+
+    @app.after_request
+    def immutable_headers(response):
+        if request.endpoint == 'static' and \
+                request.view_args.get('filename') in hashed:
+            response.headers['Cache-Control'] = IMMUTABLE
+            response.headers.pop('Expires', None)
+        return response
+
+
+@click.command('build-assets')
+@click.option('--no-brotli', is_flag=True,
+              help="Don't write brotli versions of the assets.")
+@with_appcontext
+def build_command(no_brotli):
+    """ Build the fingerprinted and compressed assets into STATIC_BUILD_DIR.
+    """
+    output = current_app.config['STATIC_BUILD_DIR']
+    if not output:
+        raise click.UsageError('Set STATIC_BUILD_DIR to the directory '
+                               'where the assets are built.')
+    source = os.path.join(current_app.root_path, 'static')
+    manifest = build(source, output, use_brotli=not no_brotli)
+    for name, hashed in sorted(manifest.items()):
+        click.echo('{} -> {}'.format(name, hashed))
@@ -0,0 +1,161 @@
+import argparse
+import asyncio
+import json
+import sys
+import time
+from dummyauth.aio import AsyncHTTPClient
+from dummyauth.cache import DiscoveryCache
+from dummyauth.exceptions import DummyAuthException
+from dummyauth.forms import parse_profile_urls
+from dummyauth.spider import AsyncEndpointDiscoverySpider
+from dummyauth.strategy import DiscoveryStrategy
+
+
+def read_urls(lines):
+    """ Yields the profile URLs in some lines, skipping blanks and comments.
+    """
+    lines = (line.strip() for line in lines)
+    urls = (line for line in lines if line and not line.startswith('#'))
+    for profile in parse_profile_urls(urls):
+        yield profile.url
+
+
+async def discover_one(url: str, client: AsyncHTTPClient,
+                       cache: DiscoveryCache=None, strict: bool=False) -> dict:
+    """ Discovers the endpoints of a single URL. Errors are not raised, but
+    reported in the error field of the result. """
+    spider = AsyncEndpointDiscoverySpider(url, client=client, cache=cache,
+                                          strict=strict)
+    result = {'url': url}
+    start = time.perf_counter()
+    try:
+        await spider.discover()
+    except DummyAuthException as e:
+        result['error'] = e.message
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    else:
+        result.update({
+            'canonical_url': spider.canonical_url,
+            'target_url': spider.target_url,
+            'authorization_endpoint': spider.authorization_endpoint,
+            'token_endpoint': spider.token_endpoint,
+            'relme': spider.supports_relmeauth(),
+            'redirects': len(spider.redirect_chain),
+            'error': None,
+        })
+    result['elapsed'] = round(time.perf_counter() - start, 6)
+    return result
+
+
+async def discover_many(urls, concurrency: int=32, per_host: int=4,
+                        client: AsyncHTTPClient=None,
+                        cache: DiscoveryCache=None, strict: bool=False):
+    """
+    Discovers the endpoints of many URLs at once. This is an asynchronous
+    generator that yields the result of each URL as soon as it is ready, so
+    they don't come in the same order as the URLs.
+
+    URLs are taken from the iterable as the discoveries progress, so it may
+    be a file with thousands of lines.
+
+    :param urls: an iterable with the profile URLs.
+    :param concurrency: how many discoveries may run at once.
+    :param per_host: how many discoveries may run at once on the same host.
+    :param client: the client used to send the requests. A new client is
+        built and closed at the end if not given.
+    :param cache: the discovery cache. A new one is used if not given, to
+        get fresh results.
+    """
+    own_client = client is None
+    if own_client:
+        client = AsyncHTTPClient(pool_maxsize=per_host)
+    if cache is None:
+        cache = DiscoveryCache()
+
+    pending = asyncio.Queue(maxsize=concurrency * 2)
+    results = asyncio.Queue()
+    host_limits = {}
+
+    async def produce():
+        for url in urls:
+            await pending.put(url)
+        for _ in range(concurrency):
+            await pending.put(None)
+
+    async def work():
+        while True:
+            url = await pending.get()
+            if url is None:
+                return
+            host = DiscoveryStrategy.host(url)
+            if host not in host_limits:
+                host_limits[host] = asyncio.Semaphore(per_host)
+            async with host_limits[host]:
+                await results.put(await discover_one(url, client, cache,
+                                                     strict))
+
+    async def run():
+        try:
+            await asyncio.gather(produce(), *(work() for _ in
+                                              range(concurrency)))
+        finally:
+            await results.put(None)
+
+    runner = asyncio.ensure_future(run())
+    try:
+        while True:
+            result = await results.get()
+            if result is None:
+                break
+            yield result
+        await runner
+    finally:
+        runner.cancel()
+        if own_client:
+            await client.close()
+
+
+def main(argv=None):
+    """ Entry point of the dummyauth-discover command. """
+    parser = argparse.ArgumentParser(
+        prog='dummyauth-discover',
+        description='Discover the IndieAuth endpoints of many profile URLs. '
+                    'Results are written as JSON Lines as they finish.')
+    parser.add_argument('file', nargs='?', type=argparse.FileType('r'),
+                        default=sys.stdin,
+                        help='file with one URL per line (default: stdin)')
+    parser.add_argument('-c', '--concurrency', type=int, default=32,
+                        help='discoveries to run at once (default: 32)')
+    parser.add_argument('-p', '--per-host', type=int, default=4,
+                        help='discoveries to run at once on the same host '
+                             '(default: 4)')
+    parser.add_argument('--strict', action='store_true',
+                        help='parse whole documents using html5lib')
+    args = parser.parse_args(argv)
+    if args.concurrency < 1 or args.per_host < 1:
+        parser.error('concurrency limits must be positive')
+
+    async def run():
+        async for result in discover_many(read_urls(args.file),
+                                          args.concurrency, args.per_host,
+                                          strict=args.strict):
+            sys.stdout.write(json.dumps(result) + '\n')
+            sys.stdout.flush()
+
+    # asyncio.run() is not available on Python 3.6.
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(run())
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        asyncio.set_event_loop(None)
+        loop.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+from dummyauth.exceptions import CircuitOpen, DeadlineExceeded
+from dummyauth.metrics import CIRCUIT_REJECTIONS, CIRCUIT_TRANSITIONS
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+def is_outage(error: BaseException) -> bool:
+    """ Tells whether a request failed because of the host: it could not be
+    reached, hung up, or took too long. Errors such as a body rejected by a
+    parser are the fault of the response, not of the host. """
+    return isinstance(error, (OSError, asyncio.IncompleteReadError,
+                              asyncio.TimeoutError, DeadlineExceeded))
+
+
+class HostCircuit(object):
+    """ The circuit of a host, and its recent requests. """
+
+    __slots__ = ('state', 'calls', 'opened_at', 'probes', 'opened')
+
+    def __init__(self):
+        self.state = CLOSED
+        # A (finished, failed, slow) tuple per request, oldest first.
+        self.calls = deque()
+        self.opened_at = None
+        self.probes = 0
+        self.opened = 0
+
+    def as_dict(self, now: float, open_seconds: float) -> dict:
+        stats = {
+            'state': self.state,
+            'requests': len(self.calls),
+            'failures': sum(1 for _, failed, _ in self.calls if failed),
+            'slow': sum(1 for _, _, slow in self.calls if slow),
+            'opened': self.opened,
+            'retry_after': None,
+        }
+        if self.state == OPEN:
+            stats['retry_after'] = max(
+                self.opened_at + open_seconds - now, 0.0)
+        return stats
+
+
+class CircuitBreaker(object):
+    """
+    Stops sending requests to hosts that are down or too slow, so that the
+    logins and callbacks of a site that is not answering fail right away
+    instead of keeping every worker waiting for it.
+
+    Each host has a circuit, which is closed while the host behaves: its
+    requests are sent, and how they went is recorded. Once enough requests
+    have been sent to a host in the last window seconds, if too many of
+    them failed or were slow, the circuit opens: for open_seconds, requests
+    to that host raise CircuitOpen without being sent. After that, the
+    circuit is half open and a few requests are let through as probes. If
+    they go well the circuit closes again, otherwise it opens for another
+    open_seconds.
+
+    A request fails if the host can't be reached, hangs up, times out, or
+    answers with a 5xx status code. It is slow if it takes longer than
+    slow_call_duration seconds, body included.
+
+    The clients share a breaker, so the requests of the discovery, of the
+    rel="me" checks and of the verification of codes all count. Circuits
+    are kept per process.
+    """
+
+    def __init__(self, max_hosts: int=1024, window: float=60,
+                 min_requests: int=10, error_rate: float=0.5,
+                 slow_call_duration: float=3.0, slow_call_rate: float=0.8,
+                 open_seconds: float=30, half_open_probes: int=1):
+        """ Initialize the breaker.
+
+        :param max_hosts: how many hosts to keep the circuit of. When full,
+            the least recently used host is forgotten.
+        :param window: seconds of requests looked at to decide whether to
+            open a circuit.
+        :param min_requests: how many requests must have been sent to a
+            host in the window before its circuit may open. Zero disables
+            the breaker.
+        :param error_rate: the share of failed requests that opens it.
+        :param slow_call_duration: seconds after which a request is slow.
+        :param slow_call_rate: the share of slow requests that opens it.
+        :param open_seconds: seconds a circuit stays open.
+        :param half_open_probes: how many requests may be sent at once to a
+            host whose circuit is half open.
+        """
+        self.__lock = threading.Lock()
+        self.__hosts = OrderedDict()
+        self.max_hosts = max_hosts
+        self.window = window
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+    def init_app(self, app):
+        """ Configure the breaker using the settings of a Flask app. """
+        self.max_hosts = app.config['CIRCUIT_HOSTS']
+        self.window = app.config['CIRCUIT_WINDOW']
+        self.min_requests = app.config['CIRCUIT_MIN_REQUESTS']
+        self.error_rate = app.config['CIRCUIT_ERROR_RATE']
+        self.slow_call_duration = app.config['CIRCUIT_SLOW_CALL_DURATION']
+        self.slow_call_rate = app.config['CIRCUIT_SLOW_CALL_RATE']
+        self.open_seconds = app.config['CIRCUIT_OPEN_SECONDS']
+        self.half_open_probes = app.config['CIRCUIT_HALF_OPEN_PROBES']
+        self.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return self.min_requests > 0
+
+    @staticmethod
+    def host(url: str) -> str:
+        """ Returns the key used to identify the host of a URL. """
+        return urlsplit(url).netloc.lower()
+
+    def __circuit(self, host: str) -> HostCircuit:
+        # Must be called with the lock held.
+        circuit = self.__hosts.get(host)
+        if circuit is None:
+            circuit = self.__hosts[host] = HostCircuit()
+            while len(self.__hosts) > max(self.max_hosts, 1):
+                self.__hosts.popitem(last=False)
+        else:
+            self.__hosts.move_to_end(host)
+        return circuit
+
+    def __move(self, circuit: HostCircuit, state: str, now: float):
+        # Must be called with the lock held.
+        circuit.state = state
+        circuit.probes = 0
+        if state == OPEN:
+            circuit.opened_at = now
+            circuit.opened += 1
+        else:
+            circuit.calls.clear()
+        CIRCUIT_TRANSITIONS.inc(state=state)
+
+    def state(self, url: str) -> str:
+        """ Returns the state of the circuit of the host of a URL. """
+        with self.__lock:
+            circuit = self.__hosts.get(self.host(url))
+            if circuit is None:
+                return CLOSED
+            if circuit.state == OPEN and \
+               time.monotonic() >= circuit.opened_at + self.open_seconds:
+                return HALF_OPEN
+            return circuit.state
+
+    def allow(self, url: str) -> bool:
+        """ Checks that a request may be sent to the host of a URL.
+
+        :return: true if its outcome must then be recorded using record(),
+            or false if the breaker is disabled.
+        :raise CircuitOpen: if the circuit of the host is open, or if it is
+            half open and enough probes are in flight already.
+        """
+        if not self.enabled:
+            return False
+        host = self.host(url)
+        now = time.monotonic()
+        with self.__lock:
+            circuit = self.__circuit(host)
+            if circuit.state == OPEN:
+                retry_after = circuit.opened_at + self.open_seconds - now
+                if retry_after > 0:
+                    CIRCUIT_REJECTIONS.inc()
+                    raise CircuitOpen(host, retry_after)
+                self.__move(circuit, HALF_OPEN, now)
+            if circuit.state == HALF_OPEN:
+                if circuit.probes >= self.half_open_probes:
+                    CIRCUIT_REJECTIONS.inc()
+                    raise CircuitOpen(host, 1)
+                circuit.probes += 1
+        return True
+
+    def record(self, url: str, elapsed: float, failed: bool):
+        """ Records how a request allowed by allow() went. """
+        host = self.host(url)
+        now = time.monotonic()
+        slow = elapsed >= self.slow_call_duration
+        with self.__lock:
+            circuit = self.__circuit(host)
+            if circuit.state == HALF_OPEN:
+                self.__move(circuit, OPEN if failed or slow else CLOSED, now)
+                return
+            if circuit.state == OPEN:
+                # Sent before the circuit opened.
+                return
+            calls = circuit.calls
+            calls.append((now, failed, slow))
+            while calls and calls[0][0] < now - self.window:
+                calls.popleft()
+            if len(calls) < self.min_requests:
+                return
+            failures = sum(1 for call in calls if call[1])
+            slow_calls = sum(1 for call in calls if call[2])
+            if failures >= self.error_rate * len(calls) or \
+               slow_calls >= self.slow_call_rate * len(calls):
+                self.__move(circuit, OPEN, now)
+
+    def cancel(self, url: str):
+        """ Forgets a request allowed by allow() that was not sent or not
+        finished, instead of recording it. """
+        with self.__lock:
+            circuit = self.__hosts.get(self.host(url))
+            if circuit is not None and circuit.state == HALF_OPEN:
+                circuit.probes = max(circuit.probes - 1, 0)
+
+    @contextmanager
+    def guard(self, url: str):
+        """
+        Context manager around sending a request to a URL. Raises
+        CircuitOpen without running the block if the circuit of the host is
+        open, and otherwise records how the request went: set the
+        status_code of the object it gives to the status of the response.
+        Exceptions raised by the block are recorded as failures if they are
+        outages of the host, and then raised again.
+        """
+        call = GuardedCall()
+        if not self.allow(url):
+            yield call
+            return
+        start = time.monotonic()
+        try:
+            yield call
+        except Exception as e:
+            self.record(url, time.monotonic() - start, is_outage(e))
+            raise
+        except BaseException:
+            # Cancelled, which says nothing about the host.
+            self.cancel(url)
+            raise
+        failed = call.status_code is not None and call.status_code >= 500
+        self.record(url, time.monotonic() - start, failed)
+
+    def stats(self) -> dict:
+        """ Returns the circuit of each host. """
+        now = time.monotonic()
+        with self.__lock:
+            return {host: circuit.as_dict(now, self.open_seconds)
+                    for host, circuit in self.__hosts.items()}
+
+    def clear(self):
+        """ Closes and forgets every circuit. """
+        with self.__lock:
+            self.__hosts.clear()
+
+
+class GuardedCall(object):
+    """ A request sent within CircuitBreaker.guard(). """
+
+    __slots__ = ('status_code',)
+
+    def __init__(self):
+        self.status_code = None
+
+
+# The breaker used by default. Flask apps configure it using init_app().
+circuit_breaker = CircuitBreaker()
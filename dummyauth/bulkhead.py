@@ -0,0 +1,218 @@
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g
+from urllib.parse import urlsplit
+from dummyauth.exceptions import Overloaded
+from dummyauth.metrics import BULKHEAD_REJECTIONS
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class Slot(object):
+    """ A place taken in a bulkhead by a login. Give it back with
+    Bulkhead.release(). """
+
+    __slots__ = ('host', 'files', 'started')
+
+    def __init__(self, host: str, files: list):
+        self.host = host
+        self.files = files
+        self.started = time.monotonic()
+
+
+class Bulkhead(object):
+    """
+    Limits how many logins may be waiting for other servers at once, so
+    that a wave of logins against a slow host can't take every worker, and
+    the rest of the pages keep being served. A login that doesn't find a
+    place is turned down with Overloaded right away, instead of queueing.
+
+    There are two limits: one for every host together, and one for each
+    host, so that a single slow host only takes part of the places. The
+    limit of every host together adapts to how long logins take: each one
+    that takes longer than target_latency lowers it by a tenth, down to
+    min_concurrent, and each one that doesn't raises it back a little, up
+    to max_concurrent.
+
+    Without a directory, the limits apply to the threads of a process. With
+    one, they apply to every process that uses it, such as the workers of
+    uWSGI: each place is a lock file in the directory, and taking it is
+    locking it. A worker that dies gives its places back with its locks.
+    """
+
+    def __init__(self, max_concurrent: int=16, per_host: int=4,
+                 min_concurrent: int=2, target_latency: float=2.0,
+                 retry_after: float=5, directory: str=None):
+        """ Initialize the bulkhead.
+
+        :param max_concurrent: how many logins may wait for other servers
+            at once. Zero disables the bulkhead.
+        :param per_host: how many of them may wait for the same host.
+        :param min_concurrent: the lowest the adaptive limit goes.
+        :param target_latency: seconds a login may wait for other servers
+            before the limit is lowered.
+        :param retry_after: seconds turned down logins are told to wait.
+        :param directory: where the lock files are kept, to share the
+            limits between processes.
+        """
+        self.__lock = threading.Lock()
+        self.__hosts = {}
+        self.__active = 0
+        self.__pid = os.getpid()
+        self.max_concurrent = max_concurrent
+        self.per_host = per_host
+        self.min_concurrent = min_concurrent
+        self.target_latency = target_latency
+        self.retry_after = retry_after
+        self.directory = directory
+        self.limit = float(max_concurrent)
+
+    def init_app(self, app):
+        """ Configure the bulkhead using the settings of a Flask app. """
+        self.max_concurrent = app.config['BULKHEAD_MAX_CONCURRENT']
+        self.per_host = app.config['BULKHEAD_PER_HOST']
+        self.min_concurrent = app.config['BULKHEAD_MIN_CONCURRENT']
+        self.target_latency = app.config['BULKHEAD_TARGET_LATENCY']
+        self.retry_after = app.config['BULKHEAD_RETRY_AFTER']
+        self.directory = app.config['BULKHEAD_DIR']
+        self.limit = float(self.max_concurrent)
+        app.teardown_request(self.__leave)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    @staticmethod
+    def host(url: str) -> str:
+        """ Returns the key used to identify the host of a URL. """
+        return urlsplit(url).netloc.lower()
+
+    def acquire(self, url: str) -> Slot:
+        """ Takes a place for a login that will wait for the host of a URL.
+
+        :return: the slot, or None if the bulkhead is disabled.
+        :raise Overloaded: if there are no places left.
+        """
+        if not self.enabled:
+            return None
+        host = self.host(url)
+        limit = max(int(self.limit), 1)
+        if self.directory and fcntl is not None:
+            return self.__acquire_files(host, limit)
+        with self.__lock:
+            if self.__pid != os.getpid():
+                # The places taken belong to threads of the parent.
+                self.__pid = os.getpid()
+                self.__hosts, self.__active = {}, 0
+            if self.__hosts.get(host, 0) >= self.per_host:
+                raise self.__reject('host')
+            if self.__active >= limit:
+                raise self.__reject('global')
+            self.__hosts[host] = self.__hosts.get(host, 0) + 1
+            self.__active += 1
+        return Slot(host, None)
+
+    def __acquire_files(self, host: str, limit: int) -> Slot:
+        digest = hashlib.sha1(host.encode('utf-8')).hexdigest()[:16]
+        files = []
+        try:
+            host_lock = self.__lock_any('host-{}'.format(digest),
+                                        self.per_host)
+            if host_lock is None:
+                raise self.__reject('host')
+            files.append(host_lock)
+            global_lock = self.__lock_any('global', limit)
+            if global_lock is None:
+                raise self.__reject('global')
+            files.append(global_lock)
+        except BaseException:
+            for fp in files:
+                fp.close()
+            raise
+        return Slot(host, files)
+
+    def __lock_any(self, prefix: str, count: int):
+        """ Locks the first of count lock files that is free. Returns it
+        open, or None if all of them are locked. """
+        for i in range(count):
+            path = os.path.join(self.directory,
+                                '{}-{}.lock'.format(prefix, i))
+            fp = open(path, 'a+')
+            try:
+                fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                fp.close()
+                continue
+            return fp
+        return None
+
+    def __reject(self, scope: str) -> Overloaded:
+        BULKHEAD_REJECTIONS.inc(scope=scope)
+        return Overloaded(self.retry_after)
+
+    def release(self, slot: Slot):
+        """ Gives back a place, adapting the limit to how long it was held.
+        """
+        if slot is None:
+            return
+        elapsed = time.monotonic() - slot.started
+        if slot.files is not None:
+            for fp in slot.files:
+                # Closing the file releases the lock.
+                fp.close()
+        with self.__lock:
+            if slot.files is None and self.__pid == os.getpid():
+                self.__active = max(self.__active - 1, 0)
+                left = self.__hosts.get(slot.host, 0) - 1
+                if left > 0:
+                    self.__hosts[slot.host] = left
+                else:
+                    self.__hosts.pop(slot.host, None)
+            if elapsed > self.target_latency:
+                self.limit = max(self.limit * 0.9, self.min_concurrent)
+            else:
+                self.limit = min(self.limit + 1 / max(self.limit, 1),
+                                 self.max_concurrent)
+
+    @contextmanager
+    def slot(self, url: str):
+        """ Context manager that holds a place while its block runs.
+
+        :raise Overloaded: if there are no places left.
+        """
+        slot = self.acquire(url)
+        try:
+            yield slot
+        finally:
+            self.release(slot)
+
+    def enter(self, url: str):
+        """ Takes a place for the current request, which is given back when
+        the request is over.
+
+        :raise Overloaded: if there are no places left.
+        """
+        slot = self.acquire(url)
+        if slot is not None:
+            g.setdefault('bulkhead_slots', []).append(slot)
+
+    def __leave(self, exception=None):
+        for slot in g.pop('bulkhead_slots', []):
+            self.release(slot)
+
+    def stats(self) -> dict:
+        """ Returns the places taken in this process and the current limit.
+        """
+        with self.__lock:
+            return {'limit': int(self.limit), 'active': self.__active,
+                    'hosts': dict(self.__hosts)}
+
+
+# The bulkhead used by default. Flask apps configure it using init_app().
+bulkhead = Bulkhead()
@@ -0,0 +1,386 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from email.utils import parsedate_to_datetime
+
+
+def parse_cache_control(value: str) -> dict:
+    """ Parses a Cache-Control header into a dict of directives. """
+    directives = {}
+    for directive in (value or '').split(','):
+        name, _, argument = directive.strip().partition('=')
+        if name:
+            directives[name.lower()] = argument.strip('"') or None
+    return directives
+
+
+def parse_http_date(value: str) -> float:
+    """ Converts an HTTP date into a timestamp, or None if invalid. """
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness_lifetime(headers, max_ttl: float) -> float:
+    """
+    Computes for how many seconds a response may be served from cache
+    without revalidating it, according to section 4.2 of RFC 7234. Returns
+    None if the response must not be stored at all.
+
+    The discovery cache is shared between every user of the application,
+    so it behaves as a shared cache: s-maxage is honoured and responses
+    marked as private are not stored.
+    """
+    directives = parse_cache_control(headers.get('cache-control'))
+    if 'no-store' in directives or 'private' in directives:
+        return None
+    if 'no-cache' in directives:
+        return 0
+
+    lifetime = None
+    for directive in ('s-maxage', 'max-age'):
+        if directive in directives:
+            try:
+                lifetime = int(directives[directive])
+            except (TypeError, ValueError):
+                lifetime = 0
+            break
+
+    date = parse_http_date(headers.get('date')) or time.time()
+    if lifetime is None and 'expires' in headers:
+        # An invalid Expires header means "already expired".
+        expires = parse_http_date(headers['expires'])
+        lifetime = expires - date if expires else 0
+
+    if lifetime is None and 'last-modified' in headers:
+        # Heuristic freshness: 10% of the time since the last change.
+        last_modified = parse_http_date(headers['last-modified'])
+        if last_modified:
+            lifetime = (date - last_modified) / 10
+
+    try:
+        age = max(0, int(headers.get('age', 0)))
+    except ValueError:
+        age = 0
+    return max(0, min((lifetime or 0) - age, max_ttl))
+
+
+class CachedDiscovery(object):
+    """ The result of discovering a URL, plus the data to revalidate it. """
+
+    __slots__ = ('data', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, data: dict, etag: str, last_modified: str,
+                 expires: float):
+        self.data = data
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+    @property
+    def fresh(self) -> bool:
+        """ Returns true if this entry can be used without revalidating. """
+        return time.time() < self.expires
+
+    @property
+    def validators(self) -> dict:
+        """ Returns the headers to send in a conditional request. """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class DiscoveryCache(object):
+    """
+    Keeps the endpoints discovered for recently seen profile URLs, following
+    the caching rules that the origin server sends along with the document.
+
+    Fresh entries are served without sending any request. Stale entries are
+    kept as long as they have an ETag or a Last-Modified date, so that the
+    spider can send a conditional request and skip downloading and parsing
+    the page again if the server answers with 304 Not Modified.
+
+    The cache is bounded: when it is full, the least recently used entry
+    is evicted.
+    """
+
+    def __init__(self, max_entries: int=1024, max_ttl: float=86400):
+        """ Initialize the cache.
+
+        :param max_entries: the maximum number of URLs to keep. A value of
+            zero disables the cache.
+        :param max_ttl: upper bound in seconds for the freshness lifetime
+            of an entry, whatever the origin server says.
+        """
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+
+    def init_app(self, app):
+        """ Configure the cache using the settings of a Flask app. """
+        self.max_entries = app.config['DISCOVERY_CACHE_SIZE']
+        self.max_ttl = app.config['DISCOVERY_CACHE_MAX_TTL']
+        self.clear()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, url: str) -> CachedDiscovery:
+        """ Returns the entry for the given URL, fresh or not, or None. """
+        with self.__lock:
+            entry = self.__entries.get(url)
+            if entry is not None:
+                self.__entries.move_to_end(url)
+            return entry
+
+    def store(self, url: str, data: dict, headers) -> CachedDiscovery:
+        """ Saves the discovery result for a URL given the response headers.
+
+        :return: the new entry, or None if the response is not cacheable.
+        """
+        lifetime = freshness_lifetime(headers, self.max_ttl)
+        etag = headers.get('etag')
+        last_modified = headers.get('last-modified')
+        if lifetime is None or not (lifetime or etag or last_modified):
+            # Either forbidden, or useless because it could not be reused
+            # nor revalidated. Forget any previous version.
+            self.discard(url)
+            return None
+
+        entry = CachedDiscovery(dict(data), etag, last_modified,
+                                time.time() + lifetime)
+        with self.__lock:
+            if self.max_entries <= 0:
+                return None
+            self.__entries[url] = entry
+            self.__entries.move_to_end(url)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+        return entry
+
+    def refresh(self, url: str, entry: CachedDiscovery, headers,
+                data: dict=None) -> CachedDiscovery:
+        """ Updates an entry after a 304 Not Modified response.
+
+        The 304 response may update the caching headers of the stored
+        response, but any header that it doesn't send is kept.
+
+        :param data: the discovery result to store, if it has changed.
+        """
+        merged = {}
+        if entry.etag:
+            merged['etag'] = entry.etag
+        if entry.last_modified:
+            merged['last-modified'] = entry.last_modified
+        for header in ('etag', 'last-modified', 'cache-control', 'expires',
+                       'date', 'age'):
+            if header in headers:
+                merged[header] = headers[header]
+        return self.store(url, data or entry.data, merged)
+
+    def discard(self, url: str):
+        """ Removes the entry for the given URL, if any. """
+        with self.__lock:
+            self.__entries.pop(url, None)
+
+    def clear(self):
+        """ Removes every entry. """
+        with self.__lock:
+            self.__entries.clear()
+
+
+# The cache used by default. Flask apps configure it using init_app().
+discovery_cache = DiscoveryCache()
+
+
+class TTLCache(object):
+    """
+    A bounded mapping whose entries expire after some seconds. When it is
+    full, the least recently used entry is evicted. Expired entries are
+    removed as they are found.
+    """
+
+    def __init__(self, max_entries: int=1024, ttl: float=60):
+        """ Initialize the cache.
+
+        :param max_entries: the maximum number of keys to keep. A value of
+            zero disables the cache.
+        :param ttl: default number of seconds an entry is kept.
+        """
+        self.__lock = threading.Lock()
+        self.__entries = OrderedDict()
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key, default=None):
+        """ Returns the value for the given key, if it hasn't expired. """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if time.monotonic() >= expires:
+                del self.__entries[key]
+                return default
+            self.__entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float=None):
+        """ Saves a value for ttl seconds, or the default TTL if not given.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        with self.__lock:
+            if self.max_entries <= 0 or ttl <= 0:
+                self.__entries.pop(key, None)
+                return
+            self.__entries[key] = (value, time.monotonic() + ttl)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+
+    def discard(self, key):
+        """ Removes the entry for the given key, if any. """
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        """ Removes every entry. """
+        with self.__lock:
+            self.__entries.clear()
+
+
+class RedirectMemo(TTLCache):
+    """
+    Remembers permanent redirections (HTTP 301 and HTTP 308), so that the
+    spider can jump to their target without requesting the source URL again.
+
+    Permanent redirections are cacheable by default, so each hop is kept for
+    the configured TTL. If the response has caching headers, they are
+    honoured instead, up to that TTL: hops that must not be stored are not
+    remembered.
+    """
+
+    def __init__(self, max_entries: int=1024, ttl: float=86400):
+        super().__init__(max_entries, ttl)
+
+    def init_app(self, app):
+        """ Configure the memo using the settings of a Flask app. """
+        self.max_entries = app.config['DISCOVERY_REDIRECT_MEMO_SIZE']
+        self.ttl = app.config['DISCOVERY_REDIRECT_MEMO_TTL']
+        self.clear()
+
+    def remember(self, url: str, target_url: str, status_code: int,
+                 headers):
+        """ Saves a permanent redirection from url to target_url. """
+        if status_code not in (301, 308):
+            return
+        ttl = self.ttl
+        if 'cache-control' in headers or 'expires' in headers:
+            ttl = freshness_lifetime(headers, self.ttl) or 0
+        self.set(url, (target_url, status_code), ttl)
+
+
+# The memo used by default. Flask apps configure it using init_app().
+redirect_memo = RedirectMemo()
+
+
+# A discovery that failed. kind is one of NegativeCache.KINDS, message is
+# the error shown to the user and data is the result of the discovery, if
+# it finished.
+NegativeResult = namedtuple('NegativeResult', 'kind message data')
+
+
+class NegativeCache(TTLCache):
+    """
+    Remembers, for a short while, the profile URLs whose discovery failed,
+    so that retrying them is answered without sending any request. Each
+    kind of failure has its own TTL:
+
+    * no_endpoint: the page has neither an authorization endpoint nor
+      rel="me" links.
+    * dns: the host name could not be resolved.
+    * timeout: the host took too long to answer.
+    * redirects: there were too many redirects, or a redirect loop.
+
+    A TTL of zero disables caching that kind of failure.
+    """
+
+    KINDS = ('no_endpoint', 'dns', 'timeout', 'redirects')
+
+    def __init__(self, max_entries: int=1024, ttls: dict=None):
+        super().__init__(max_entries)
+        self.ttls = {'no_endpoint': 300, 'dns': 60, 'timeout': 30,
+                     'redirects': 300}
+        self.ttls.update(ttls or {})
+
+    def init_app(self, app):
+        """ Configure the cache using the settings of a Flask app. """
+        self.max_entries = app.config['DISCOVERY_NEGATIVE_CACHE_SIZE']
+        for kind in self.KINDS:
+            key = 'DISCOVERY_NEGATIVE_TTL_' + kind.upper()
+            self.ttls[kind] = app.config[key]
+        self.clear()
+
+    def remember(self, url: str, kind: str, message: str=None,
+                 data: dict=None):
+        """ Saves a failed discovery of the given kind. """
+        self.set(url, NegativeResult(kind, message, data), self.ttls[kind])
+
+
+# The negative cache used by default. Flask apps configure it using
+# init_app().
+negative_cache = NegativeCache()
+
+
+class RelMeCache(TTLCache):
+    """
+    Remembers the rel="me" links of each profile, and which of them link
+    back to it, so that logging in again with RelMeAuth doesn't crawl the
+    same pages again.
+
+    A link that links back stays verified for the TTL. The links of a
+    profile, and the ones that didn't link back, are only kept for
+    recheck_ttl seconds, so that fixing a profile takes effect soon.
+    """
+
+    def __init__(self, max_entries: int=1024, ttl: float=86400,
+                 recheck_ttl: float=300):
+        super().__init__(max_entries, ttl)
+        self.recheck_ttl = recheck_ttl
+
+    def init_app(self, app):
+        """ Configure the cache using the settings of a Flask app. """
+        self.max_entries = app.config['RELME_CACHE_SIZE']
+        self.ttl = app.config['RELME_CACHE_TTL']
+        self.recheck_ttl = app.config['RELME_RECHECK_TTL']
+        self.clear()
+
+    def links(self, profile_url: str) -> list:
+        """ Returns the rel="me" links of a profile, or None if unknown. """
+        return self.get(('links', profile_url))
+
+    def remember_links(self, profile_url: str, links: list):
+        """ Saves the rel="me" links found in a profile. """
+        self.set(('links', profile_url), list(links), self.recheck_ttl)
+
+    def verified(self, profile_url: str, link: str) -> bool:
+        """ Tells whether a link has been seen linking back to a profile,
+        or not, or None if it hasn't been checked recently. """
+        return self.get(('backlink', profile_url, link))
+
+    def remember_backlink(self, profile_url: str, link: str, verified: bool):
+        """ Saves whether a link links back to a profile. """
+        ttl = self.ttl if verified else self.recheck_ttl
+        self.set(('backlink', profile_url, link), verified, ttl)
+
+
+# The cache used by default. Flask apps configure it using init_app().
+relme_cache = RelMeCache()
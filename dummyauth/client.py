@@ -0,0 +1,546 @@
+import asyncio
+import os
+import socket
+import threading
+import time
+import requests
+from collections import namedtuple
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import parse_header_links
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+from dummyauth.breaker import CircuitBreaker, circuit_breaker
+from dummyauth.deadline import Deadline
+from dummyauth.resolver import dns_cache
+
+
+class Fetch(namedtuple('Fetch', 'method url headers data parser read_body')):
+    """
+    An HTTP request that a discovery or verification flow wants to send.
+
+    Flows are generators that yield Fetch objects and receive FetchResult
+    objects back, without doing any I/O themselves. This lets the blocking
+    client and the asyncio client run the very same flows.
+
+    :param parser: if set, a callable that receives the status code and
+        the headers of the response, and returns either None or an object
+        with feed(), done and finish() that the body of the response is fed
+        to as it is downloaded. Reading stops as soon as the parser is done.
+    :param read_body: if true, the body is read and returned as bytes.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, method: str, url: str, headers: dict=None,
+                data: dict=None, parser=None, read_body: bool=False):
+        return super().__new__(cls, method, url, headers or {}, data,
+                               parser, read_body)
+
+
+# The response to a Fetch. Headers are a case-insensitive dict, links are
+# the parsed Link headers keyed by rel, and parsed is what the parser of
+# the Fetch returned after reading the body.
+FetchResult = namedtuple('FetchResult', 'status_code headers links body parsed')
+
+
+def parse_link_header(value: str) -> dict:
+    """ Parses a Link header into a dict of URLs keyed by rel value. """
+    links = {}
+    for link in parse_header_links(value or ''):
+        for rel in link.get('rel', '').lower().split():
+            links.setdefault(rel, link['url'])
+    return links
+
+
+def parse_media_type(value: str):
+    """ Splits a Content-Type header into its media type and parameters.
+
+    :return: a (media_type, params) tuple. The media type and the names of
+        the parameters are lowercase. Quoted values are unquoted.
+    """
+    media_type, _, rest = (value or '').partition(';')
+    params = {}
+    for param in rest.split(';'):
+        name, sep, param_value = param.partition('=')
+        if sep:
+            param_value = param_value.strip()
+            if len(param_value) > 1 and param_value[0] == param_value[-1] == '"':
+                param_value = param_value[1:-1].replace('\\"', '"')
+            params[name.strip().lower()] = param_value
+    return media_type.strip().lower(), params
+
+
+def failure_kind(error: BaseException) -> str:
+    """ Tells why a request failed, looking at the exception and its causes.
+
+    :return: 'dns' if the host name could not be resolved, 'timeout' if the
+        host took too long to answer, or None for any other error.
+    """
+    pending, seen = [error], set()
+    while pending:
+        error = pending.pop()
+        if id(error) in seen:
+            continue
+        seen.add(id(error))
+        if isinstance(error, socket.gaierror):
+            return 'dns'
+        if isinstance(error, (socket.timeout, asyncio.TimeoutError,
+                              requests.exceptions.Timeout)):
+            return 'timeout'
+        # requests and urllib3 wrap the original error in their own ones.
+        causes = [error.__cause__, error.__context__,
+                  getattr(error, 'reason', None)] + list(error.args)
+        pending.extend(cause for cause in causes
+                       if isinstance(cause, BaseException))
+    return None
+
+
+def response_socket(response: requests.Response) -> socket.socket:
+    """ Returns the socket a streamed response is read from, if known. """
+    connection = getattr(response.raw, 'connection', None) or \
+        getattr(response.raw, '_connection', None)
+    return getattr(connection, 'sock', None)
+
+
+def build_result(status_code: int, headers, body: bytes=None,
+                 parsed=None) -> FetchResult:
+    """ Builds a FetchResult from the parts of a response. """
+    headers = CaseInsensitiveDict(headers)
+    links = parse_link_header(headers.get('link'))
+    return FetchResult(status_code, headers, links, body, parsed)
+
+
+class IdleExpiryMixin(object):
+    """
+    Mixin for urllib3 connection pools that discards keep-alive connections
+    that have been sitting in the pool for too long. Servers tend to close
+    idle connections on their own after a few seconds, and reusing one of
+    those just means paying a failed write before reconnecting.
+    """
+
+    idle_timeout = None
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        idle_since = getattr(conn, 'idle_since', None)
+        if self.idle_timeout is not None and idle_since is not None:
+            if time.monotonic() - idle_since > self.idle_timeout:
+                # Dropping the socket is enough: urllib3 will reconnect
+                # the next time this connection object is used.
+                conn.close()
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            conn.idle_since = time.monotonic()
+        super()._put_conn(conn)
+
+
+class CachedDNSMixin(object):
+    """
+    Mixin for urllib3 connections that looks up the host in the DNS cache
+    instead of asking the resolver on every new connection. Every address
+    of the host is tried in turn until one accepts the connection.
+    """
+
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addresses = dns_cache.addresses(host, self.port)
+        except socket.gaierror as e:
+            # What urllib3 1.x raises when it can't resolve the host itself.
+            # failure_kind() finds the gaierror in its cause.
+            raise NewConnectionError(
+                self, 'Failed to resolve {}: {}'.format(self.host, e)) from e
+        error = None
+        for address in addresses:
+            # urllib3 connects to _dns_host, but still uses host for TLS.
+            self._dns_host = address
+            try:
+                return super()._new_conn()
+            except NewConnectionError as e:
+                error = e
+            finally:
+                self._dns_host = host
+        raise error
+
+
+class CachedDNSHTTPConnection(CachedDNSMixin, HTTPConnection):
+    pass
+
+
+class CachedDNSHTTPSConnection(CachedDNSMixin, HTTPSConnection):
+    pass
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """ An HTTP adapter whose per-host pools expire idle connections and
+    look up hosts in the DNS cache. """
+
+    def __init__(self, idle_timeout: float=None, **kwargs):
+        self.idle_timeout = idle_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        attrs = {'idle_timeout': self.idle_timeout}
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': type('HTTPConnectionPool',
+                         (IdleExpiryMixin, HTTPConnectionPool),
+                         dict(attrs, ConnectionCls=CachedDNSHTTPConnection)),
+            'https': type('HTTPSConnectionPool',
+                          (IdleExpiryMixin, HTTPSConnectionPool),
+                          dict(attrs, ConnectionCls=CachedDNSHTTPSConnection)),
+        }
+
+
+class BoundedReader(object):
+    """
+    Reads the body of a streamed response into a buffer that is allocated
+    once and reused for every response read by this object, so that reading
+    a large document doesn't allocate and copy ever-growing byte strings.
+
+    No more than max_bytes are ever read. What has been read is exposed as
+    a memoryview of the buffer, which is only valid until the next response
+    is read by the same reader. Because of that, a reader must not be shared
+    between threads: use HTTPClient.reader() to get one.
+    """
+
+    def __init__(self, max_bytes: int=1024 * 1024, chunk_size: int=16384,
+                 drain_limit: int=65536):
+        """ Initialize the reader.
+
+        :param max_bytes: hard limit for the size of the body to read.
+        :param chunk_size: how many bytes to read from the network at once.
+        :param drain_limit: when the reader stops before the end of the
+            body, if at most this many bytes are left they are discarded
+            to return the connection to the pool. Otherwise, the connection
+            is closed.
+        """
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.drain_limit = drain_limit
+        self.__view = memoryview(bytearray(max_bytes))
+        self.length = 0
+        self.complete = False
+
+    @property
+    def content(self) -> memoryview:
+        """ Returns the part of the body read so far. """
+        return self.__view[:self.length]
+
+    @property
+    def full(self) -> bool:
+        """ Returns true if no more bytes can be read. """
+        return self.length >= self.max_bytes
+
+    def reset(self):
+        """ Forget the previous body, to start reading a new one. """
+        self.length = 0
+        self.complete = False
+
+    def append(self, data) -> memoryview:
+        """ Copies as much data as fits into the buffer.
+
+        This is used by transports that don't read through a requests
+        response, such as the asyncio client.
+
+        :return: a view of the part of data that was copied.
+        """
+        start = self.length
+        end = min(start + len(data), self.max_bytes)
+        self.__view[start:end] = data[:end - start]
+        self.length = end
+        return self.__view[start:end]
+
+    def iter_chunks(self, response, expires: float=None):
+        """
+        Reads the body of a response, yielding each chunk as a memoryview
+        as soon as it is read. The caller may stop iterating at any time,
+        but then it should call release() to dispose of the response.
+
+        :param expires: if given, the monotonic time when reading is given
+            up, raising socket.timeout, even if the server is still sending
+            the body a few bytes at a time.
+        """
+        self.reset()
+        raw = response.raw
+        read, sock, previous = raw.read, None, None
+        if expires is not None:
+            # Return as soon as some data arrives instead of waiting for a
+            # whole chunk, to be able to stop in time.
+            read = getattr(raw, 'read1', raw.read)
+            sock = response_socket(response)
+            previous = sock.gettimeout() if sock is not None else None
+        try:
+            while not self.full:
+                if expires is not None:
+                    remaining = expires - time.monotonic()
+                    if remaining <= 0:
+                        raise socket.timeout('Timed out reading the body.')
+                    if sock is not None:
+                        sock.settimeout(remaining if previous is None
+                                        else min(remaining, previous))
+                amount = min(self.chunk_size, self.max_bytes - self.length)
+                data = read(amount, decode_content=True)
+                if not data:
+                    self.complete = True
+                    return
+                yield self.append(data)
+        finally:
+            if sock is not None and sock.fileno() != -1:
+                sock.settimeout(previous)
+
+    def read(self, response, expires: float=None) -> memoryview:
+        """ Reads and releases a response, returning the body read. """
+        for _ in self.iter_chunks(response, expires):
+            pass
+        self.release(response)
+        return self.content
+
+    def release(self, response):
+        """ Gives the connection used by a response back to the pool. """
+        raw = response.raw
+        if not self.complete:
+            remaining = raw.length_remaining
+            if remaining is None or remaining > self.drain_limit:
+                # Reading the rest would take too long. Hang up instead.
+                response.close()
+                return
+            if not self.__drain(raw):
+                response.close()
+                return
+        raw.release_conn()
+
+    def __drain(self, raw) -> bool:
+        # Discards the rest of the body, so that the connection can be
+        # reused. HTTPResponse.drain_conn() is missing from urllib3 1.x.
+        drained = 0
+        try:
+            while drained <= self.drain_limit:
+                data = raw.read(self.chunk_size, decode_content=False)
+                if not data:
+                    return True
+                drained += len(data)
+        except Exception:
+            return False
+        # Longer than it said.
+        return False
+
+
+class HTTPClient(object):
+    """
+    Outbound HTTP client shared by the endpoint discovery spider and the
+    authorization code validator.
+
+    Every request goes through a single requests session, so connections to
+    the same host are kept alive and reused: the HEAD and GET sent during
+    discovery, and the POST sent to verify a code, don't have to do a new
+    TCP and TLS handshake each time if the host has been seen recently.
+
+    The session is owned by the process that created it. If the process
+    forks (as uWSGI does when spawning workers), the child will build its
+    own session the first time it is used instead of sharing sockets with
+    the parent.
+
+    Requests sent with fetch() go through a circuit breaker, which fails
+    them right away while their host is down or too slow.
+    """
+
+    def __init__(self, pool_hosts: int=32, pool_maxsize: int=4,
+                 pool_block: bool=False, idle_timeout: float=30.0,
+                 max_body_size: int=1024 * 1024, read_size: int=16384,
+                 breaker: CircuitBreaker=None):
+        """ Initialize the client.
+
+        No connection is opened here. The session and its pools are built
+        lazily on first use.
+
+        :param pool_hosts: how many per-host connection pools to keep.
+            When more hosts than this are contacted, the pool for the least
+            recently used host is discarded.
+        :param pool_maxsize: how many connections to keep alive per host.
+        :param pool_block: if true, never open more than pool_maxsize
+            connections to the same host at once; wait for one instead.
+        :param idle_timeout: seconds a connection may sit idle in the pool
+            before being discarded instead of reused.
+        :param max_body_size: the maximum number of bytes read from the
+            body of a response by the readers of this client.
+        :param read_size: how many bytes to read from the network at once.
+        :param breaker: the circuit breaker of the hosts. By default, the
+            shared circuit breaker is used.
+        """
+        self.breaker = circuit_breaker if breaker is None else breaker
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__session = None
+        self.__pid = None
+        self.__settings = {}
+        self.configure(pool_hosts=pool_hosts, pool_maxsize=pool_maxsize,
+                       pool_block=pool_block, idle_timeout=idle_timeout,
+                       max_body_size=max_body_size, read_size=read_size)
+
+    def init_app(self, app):
+        """ Configure the client using the settings of a Flask app. """
+        self.configure(pool_hosts=app.config['HTTP_POOL_HOSTS'],
+                       pool_maxsize=app.config['HTTP_POOL_MAXSIZE'],
+                       pool_block=app.config['HTTP_POOL_BLOCK'],
+                       idle_timeout=app.config['HTTP_POOL_IDLE_TIMEOUT'],
+                       max_body_size=app.config['HTTP_MAX_BODY_SIZE'],
+                       read_size=app.config['HTTP_READ_SIZE'])
+
+    def configure(self, **settings):
+        """ Change some settings. Open connections are discarded.
+
+        Settings are given as keyword arguments, using the same names as
+        the parameters of the constructor.
+        """
+        with self.__lock:
+            self.__settings.update(settings)
+            self.__reset()
+
+    def close(self):
+        """ Close every pooled connection. """
+        with self.__lock:
+            self.__reset()
+
+    def __reset(self):
+        if self.__session is not None and self.__pid == os.getpid():
+            self.__session.close()
+        self.__session = None
+        self.__pid = None
+
+    def __build_session(self) -> requests.Session:
+        settings = self.__settings
+        adapter = PooledHTTPAdapter(idle_timeout=settings['idle_timeout'],
+                                    pool_connections=settings['pool_hosts'],
+                                    pool_maxsize=settings['pool_maxsize'],
+                                    pool_block=settings['pool_block'])
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        """ Returns the session for this process, building it if needed. """
+        with self.__lock:
+            if self.__session is None or self.__pid != os.getpid():
+                # Never close a session inherited through fork(): the parent
+                # still owns those sockets.
+                self.__session = self.__build_session()
+                self.__pid = os.getpid()
+            return self.__session
+
+    def reader(self) -> BoundedReader:
+        """ Returns the body reader of the current thread. """
+        reader = getattr(self.__local, 'reader', None)
+        max_bytes = self.__settings['max_body_size']
+        if reader is None or reader.max_bytes != max_bytes:
+            reader = BoundedReader(max_bytes, self.__settings['read_size'])
+            self.__local.reader = reader
+        reader.chunk_size = self.__settings['read_size']
+        return reader
+
+    def fetch(self, fetch: Fetch, deadline: Deadline=None) -> FetchResult:
+        """ Sends the request described by a Fetch. Redirects aren't followed.
+
+        :param deadline: if given, the request is not sent once it is over,
+            and its timeouts are taken from it.
+        :raise DeadlineExceeded: if the deadline is over.
+        :raise CircuitOpen: if the circuit of the host is open.
+        """
+        if deadline is not None:
+            deadline.check(fetch.url)
+        with self.breaker.guard(fetch.url) as call:
+            try:
+                result = self.__fetch(fetch, deadline)
+            except Exception as e:
+                if deadline is not None and deadline.expired:
+                    raise deadline.exceeded(fetch.url) from e
+                raise
+            call.status_code = result.status_code
+        return result
+
+    def __fetch(self, fetch: Fetch, deadline: Deadline=None) -> FetchResult:
+        stream = fetch.parser is not None or fetch.read_body
+        timeout, expires = None, None
+        if deadline is not None:
+            timeout = (deadline.timeout('connect'),
+                       deadline.timeout('response'))
+        response = self.request(fetch.method, fetch.url, data=fetch.data,
+                                headers=fetch.headers, stream=stream,
+                                allow_redirects=False, timeout=timeout)
+        parser = None
+        if fetch.parser is not None:
+            try:
+                parser = fetch.parser(response.status_code, response.headers)
+            except Exception:
+                # The response was rejected before reading its body.
+                response.close()
+                raise
+        if parser is None and not fetch.read_body:
+            # Nothing to read. This will release the connection too.
+            response.close()
+            return build_result(response.status_code, response.headers)
+
+        reader = self.reader()
+        parsed = None
+        if deadline is not None:
+            expires = deadline.body_expires()
+        try:
+            if parser is not None:
+                for chunk in reader.iter_chunks(response, expires):
+                    parser.feed(chunk)
+                    if parser.done:
+                        break
+                # Stop downloading the rest of the document, if any.
+                reader.release(response)
+                parsed = parser.finish(reader.content)
+            else:
+                reader.read(response, expires)
+        except Exception:
+            # The connection is in the middle of a body. Don't reuse it.
+            response.close()
+            raise
+        body = bytes(reader.content) if fetch.read_body else None
+        return build_result(response.status_code, response.headers, body,
+                            parsed)
+
+    def run(self, flow, deadline: Deadline=None):
+        """ Runs a flow, sending each Fetch it yields. Returns its result.
+        If a request fails, the exception is thrown into the flow.
+
+        :param deadline: the time budget of the whole flow, if any.
+        """
+        try:
+            fetch = next(flow)
+            while True:
+                try:
+                    result = self.fetch(fetch, deadline)
+                except Exception as e:
+                    fetch = flow.throw(e)
+                else:
+                    fetch = flow.send(result)
+        except StopIteration as stop:
+            return stop.value
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """ Send an HTTP request through the pooled session. """
+        return self.session.request(method, url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+
+# The client used by default. Flask apps configure it using init_app().
+http_client = HTTPClient()
@@ -5,6 +5,117 @@ class BaseConfig(object):
     pass
     SECRET_KEY = os.environ.get('SECRET_KEY')
 
+    # lazy or preload. See dummyauth.startup.
+    STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', 'lazy')
+
+    # Directory of the template bytecode cache. See dummyauth.templating.
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR')
+
+    # Directory of the fingerprinted static assets. See dummyauth.assets.
+    STATIC_BUILD_DIR = os.environ.get('STATIC_BUILD_DIR')
+
+    # Outbound HTTP connection pool. See dummyauth.client.HTTPClient.
+    HTTP_POOL_HOSTS = int(os.environ.get('HTTP_POOL_HOSTS', 32))
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 4))
+    HTTP_POOL_BLOCK = os.environ.get('HTTP_POOL_BLOCK', '0') == '1'
+    HTTP_POOL_IDLE_TIMEOUT = float(os.environ.get('HTTP_POOL_IDLE_TIMEOUT', 30))
+    HTTP_MAX_BODY_SIZE = int(os.environ.get('HTTP_MAX_BODY_SIZE', 1024 * 1024))
+    HTTP_READ_SIZE = int(os.environ.get('HTTP_READ_SIZE', 16384))
+
+    # Host name lookups cache. See dummyauth.resolver.DNSCache.
+    DNS_CACHE_SIZE = int(os.environ.get('DNS_CACHE_SIZE', 1024))
+    DNS_CACHE_TTL = float(os.environ.get('DNS_CACHE_TTL', 60))
+    DNS_NEGATIVE_TTL = float(os.environ.get('DNS_NEGATIVE_TTL', 5))
+
+    # Circuit breaker of outbound hosts. See dummyauth.breaker.CircuitBreaker.
+    CIRCUIT_HOSTS = int(os.environ.get('CIRCUIT_HOSTS', 1024))
+    CIRCUIT_WINDOW = float(os.environ.get('CIRCUIT_WINDOW', 60))
+    CIRCUIT_MIN_REQUESTS = int(os.environ.get('CIRCUIT_MIN_REQUESTS', 10))
+    CIRCUIT_ERROR_RATE = float(os.environ.get('CIRCUIT_ERROR_RATE', 0.5))
+    CIRCUIT_SLOW_CALL_DURATION = float(os.environ.get('CIRCUIT_SLOW_CALL_DURATION', 3))
+    CIRCUIT_SLOW_CALL_RATE = float(os.environ.get('CIRCUIT_SLOW_CALL_RATE', 0.8))
+    CIRCUIT_OPEN_SECONDS = float(os.environ.get('CIRCUIT_OPEN_SECONDS', 30))
+    CIRCUIT_HALF_OPEN_PROBES = int(os.environ.get('CIRCUIT_HALF_OPEN_PROBES', 1))
+
+    # Limits of the logins waiting for other servers. See
+    # dummyauth.bulkhead.Bulkhead.
+    BULKHEAD_MAX_CONCURRENT = int(os.environ.get('BULKHEAD_MAX_CONCURRENT', 16))
+    BULKHEAD_PER_HOST = int(os.environ.get('BULKHEAD_PER_HOST', 4))
+    BULKHEAD_MIN_CONCURRENT = int(os.environ.get('BULKHEAD_MIN_CONCURRENT', 2))
+    BULKHEAD_TARGET_LATENCY = float(os.environ.get('BULKHEAD_TARGET_LATENCY', 2))
+    BULKHEAD_RETRY_AFTER = float(os.environ.get('BULKHEAD_RETRY_AFTER', 5))
+    BULKHEAD_DIR = os.environ.get('BULKHEAD_DIR')
+
+    # Discovery cache. See dummyauth.cache.DiscoveryCache.
+    DISCOVERY_CACHE_SIZE = int(os.environ.get('DISCOVERY_CACHE_SIZE', 1024))
+    DISCOVERY_CACHE_MAX_TTL = float(os.environ.get('DISCOVERY_CACHE_MAX_TTL', 86400))
+
+    # Parse the whole profile page with html5lib instead of only its <head>.
+    DISCOVERY_STRICT_PARSER = os.environ.get('DISCOVERY_STRICT_PARSER', '0') == '1'
+
+    # Per-host discovery strategy. See dummyauth.strategy.DiscoveryStrategy.
+    DISCOVERY_STRATEGY_HOSTS = int(os.environ.get('DISCOVERY_STRATEGY_HOSTS', 1024))
+    DISCOVERY_HTML_THRESHOLD = int(os.environ.get('DISCOVERY_HTML_THRESHOLD', 2))
+
+    # Permanent redirections memo. See dummyauth.cache.RedirectMemo.
+    DISCOVERY_REDIRECT_MEMO_SIZE = int(
+        os.environ.get('DISCOVERY_REDIRECT_MEMO_SIZE', 1024))
+    DISCOVERY_REDIRECT_MEMO_TTL = float(
+        os.environ.get('DISCOVERY_REDIRECT_MEMO_TTL', 86400))
+
+    # Failed discoveries cache. See dummyauth.cache.NegativeCache.
+    DISCOVERY_NEGATIVE_CACHE_SIZE = int(
+        os.environ.get('DISCOVERY_NEGATIVE_CACHE_SIZE', 1024))
+    DISCOVERY_NEGATIVE_TTL_NO_ENDPOINT = float(
+        os.environ.get('DISCOVERY_NEGATIVE_TTL_NO_ENDPOINT', 300))
+    DISCOVERY_NEGATIVE_TTL_DNS = float(
+        os.environ.get('DISCOVERY_NEGATIVE_TTL_DNS', 60))
+    DISCOVERY_NEGATIVE_TTL_TIMEOUT = float(
+        os.environ.get('DISCOVERY_NEGATIVE_TTL_TIMEOUT', 30))
+    DISCOVERY_NEGATIVE_TTL_REDIRECTS = float(
+        os.environ.get('DISCOVERY_NEGATIVE_TTL_REDIRECTS', 300))
+
+    # RelMeAuth verification. See dummyauth.spider.RelMeVerifier.
+    RELME_CONCURRENCY = int(os.environ.get('RELME_CONCURRENCY', 4))
+    RELME_MAX_LINKS = int(os.environ.get('RELME_MAX_LINKS', 20))
+    RELME_CACHE_SIZE = int(os.environ.get('RELME_CACHE_SIZE', 1024))
+    RELME_CACHE_TTL = float(os.environ.get('RELME_CACHE_TTL', 86400))
+    RELME_RECHECK_TTL = float(os.environ.get('RELME_RECHECK_TTL', 300))
+
+    # Discovery of the profile URL while the login form is filled in. See
+    # dummyauth.prefetch.Prefetcher.
+    PREFETCH_WORKERS = int(os.environ.get('PREFETCH_WORKERS', 4))
+    PREFETCH_MAX_PENDING = int(os.environ.get('PREFETCH_MAX_PENDING', 32))
+    PREFETCH_CACHE_SIZE = int(os.environ.get('PREFETCH_CACHE_SIZE', 1024))
+    PREFETCH_TTL = float(os.environ.get('PREFETCH_TTL', 30))
+
+    # Coalescing of concurrent discoveries. See dummyauth.singleflight.
+    DISCOVERY_SINGLEFLIGHT_DIR = os.environ.get('DISCOVERY_SINGLEFLIGHT_DIR')
+    DISCOVERY_SINGLEFLIGHT_WAIT = float(
+        os.environ.get('DISCOVERY_SINGLEFLIGHT_WAIT', 10))
+
+    # Directory where every worker shares its metrics. See dummyauth.metrics.
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+
+    # Largest response accepted from an authorization endpoint when
+    # verifying a code. See dummyauth.parser.FieldsParser.
+    VERIFY_MAX_BODY_SIZE = int(os.environ.get('VERIFY_MAX_BODY_SIZE', 16384))
+
+    # Time budget of each login. See dummyauth.deadline.Deadline.
+    DEADLINE_DISCOVERY = float(os.environ.get('DEADLINE_DISCOVERY', 10))
+    DEADLINE_VERIFY = float(os.environ.get('DEADLINE_VERIFY', 5))
+    DEADLINE_RELME = float(os.environ.get('DEADLINE_RELME', 10))
+    DEADLINE_CONNECT = float(os.environ.get('DEADLINE_CONNECT', 3))
+    DEADLINE_RESPONSE = float(os.environ.get('DEADLINE_RESPONSE', 5))
+    DEADLINE_BODY = float(os.environ.get('DEADLINE_BODY', 5))
+
+    # Where the session is kept: cookie, memory or sqlite. See dummyauth.sessions.
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'cookie')
+    SESSION_TTL = float(os.environ.get('SESSION_TTL', 3600))
+    SESSION_MEMORY_SIZE = int(os.environ.get('SESSION_MEMORY_SIZE', 10000))
+    SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH')
+    SESSION_SQLITE_SIZE = int(os.environ.get('SESSION_SQLITE_SIZE', 100000))
+
 
 class DevelopmentConfig(BaseConfig):
     DEBUG = True
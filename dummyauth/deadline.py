@@ -0,0 +1,81 @@
+import time
+from dummyauth.exceptions import DeadlineExceeded
+
+
+class Deadline(object):
+    """
+    The time budget of a login. Everything the login sends, the requests of
+    the discovery with each redirect hop and the verification of the code,
+    has to be done before the budget runs out.
+
+    The budget is split across the phases of each request: connecting to
+    the host, waiting for the response headers, and reading the body. Each
+    phase gets at most its own limit, and never more than what is left of
+    the budget, so a single slow host can't use up the whole budget and a
+    tarpit that sends its page a byte at a time is hung up on as soon as the
+    budget is over.
+
+    The HTTP clients apply the deadline given to their run() method, and
+    raise DeadlineExceeded once it is over.
+    """
+
+    def __init__(self, budget: float, connect: float=None,
+                 response: float=None, body: float=None):
+        """ Start counting.
+
+        :param budget: seconds the whole login may take.
+        :param connect: seconds to open a connection, or None for no limit
+            other than the budget.
+        :param response: seconds to wait for the headers of a response,
+            and for each read of its body.
+        :param body: seconds to read the body of a response.
+        """
+        self.budget = budget
+        self.connect = connect
+        self.response = response
+        self.body = body
+        self.expires = time.monotonic() + budget
+
+    @classmethod
+    def from_config(cls, config, budget: str):
+        """ Builds a deadline from the settings of a Flask app.
+
+        :param budget: the name of the setting with the whole budget.
+        """
+        return cls(config[budget], config['DEADLINE_CONNECT'],
+                   config['DEADLINE_RESPONSE'], config['DEADLINE_BODY'])
+
+    @property
+    def remaining(self) -> float:
+        """ Returns how many seconds are left. """
+        return max(self.expires - time.monotonic(), 0.0)
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires
+
+    def check(self, url: str):
+        """ Raises DeadlineExceeded if there is no time left to fetch url. """
+        if self.expired:
+            raise self.exceeded(url)
+
+    def exceeded(self, url: str) -> DeadlineExceeded:
+        """ Returns the error to raise when the deadline is over. """
+        return DeadlineExceeded(
+            'Ran out of time after {:g} seconds while fetching {}.'.format(
+                self.budget, url))
+
+    def timeout(self, phase: str) -> float:
+        """ Returns the seconds a phase may take: connect, response or body.
+        """
+        limit = getattr(self, phase)
+        remaining = self.remaining
+        if limit is not None:
+            remaining = min(limit, remaining)
+        # A timeout of 0 would make the sockets non-blocking instead.
+        return max(remaining, 0.001)
+
+    def body_expires(self) -> float:
+        """ Returns the monotonic time when a body starting now must be read.
+        """
+        return time.monotonic() + self.timeout('body')
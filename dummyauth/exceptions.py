@@ -19,3 +19,47 @@ class InvalidAuthorizationResponseException(DummyAuthException):
 
     def __init__(self, message):
         DummyAuthException.__init__(self, message, status_code=401)
+
+
+class RedirectionException(DummyAuthException):
+    """ Used when a profile URL redirects too many times or in a loop. """
+
+    def __init__(self, message):
+        DummyAuthException.__init__(self, message, status_code=502)
+
+
+class UnreachableProfileException(DummyAuthException):
+    """ Used when a profile URL can't be resolved or takes too long. """
+
+    def __init__(self, message):
+        DummyAuthException.__init__(self, message, status_code=502)
+
+
+class DeadlineExceeded(DummyAuthException):
+    """ Used when the time budget of a login runs out. """
+
+    def __init__(self, message):
+        DummyAuthException.__init__(self, message, status_code=504)
+
+
+class CircuitOpen(DummyAuthException):
+    """ Used when requests to a host are not sent because it has been
+    failing or too slow. See dummyauth.breaker.CircuitBreaker. """
+
+    def __init__(self, host: str, retry_after: float):
+        message = '{} is not answering properly. Requests to it are paused ' \
+                  'for {:.0f} seconds.'.format(host, max(retry_after, 1))
+        DummyAuthException.__init__(self, message, status_code=503)
+        self.host = host
+        self.retry_after = retry_after
+
+
+class Overloaded(DummyAuthException):
+    """ Used when a login is turned down because too many are waiting for
+    other servers already. See dummyauth.bulkhead.Bulkhead. """
+
+    def __init__(self, retry_after: float):
+        message = 'Too many logins are in progress. Please try again in ' \
+                  '{:.0f} seconds.'.format(max(retry_after, 1))
+        DummyAuthException.__init__(self, message, status_code=503)
+        self.retry_after = retry_after
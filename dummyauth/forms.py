@@ -1,8 +1,144 @@
+import re
+from collections import namedtuple
 from flask_wtf import FlaskForm
-from wtforms.validators import DataRequired, URL, ValidationError
+from wtforms.validators import DataRequired, ValidationError
 from wtforms import Field, StringField
 from urllib.parse import urlsplit, urlunsplit
 from ipaddress import ip_address
+from dummyauth.cache import TTLCache
+
+# The same hostname rules that the URL validator of WTForms applies.
+HOSTNAME_LABEL = re.compile(r'^(xn-|[a-z0-9_]+)(-[a-z0-9_]+)*$', re.IGNORECASE)
+HOSTNAME_TLD = re.compile(r'^([a-z]{2,20}|xn--([a-z0-9]+-)*[a-z0-9]+)$',
+                          re.IGNORECASE)
+
+
+class ProfileURL(namedtuple('ProfileURL', 'url scheme netloc hostname path '
+                                          'query fragment error fixed')):
+    """
+    A profile URL typed by a user, once normalized: the hostname is
+    lowercase, and a missing scheme or path is added. Read url for the
+    normalized URL as a string.
+
+    :param error: why the normalized URL is not a valid profile URL
+        according to section 3.1 of the IndieAuth spec, or None if it is.
+    :param fixed: what the normalization had to add to the URL that was
+        typed: 'scheme' and/or 'path'. A URL that needed them is not a valid
+        profile URL as typed, even if it is once normalized.
+    """
+
+    __slots__ = ()
+
+    @property
+    def valid(self) -> bool:
+        """ Returns true if the normalized URL is a valid profile URL. """
+        return self.error is None
+
+    def __str__(self):
+        return self.url
+
+
+def __check(components, hostname: str) -> str:
+    """ Returns why a split URL is not a valid profile URL, or None. """
+    # Scheme must be http or https.
+    if components.scheme not in ('http', 'https'):
+        return 'scheme'
+
+    # Things that must not be present: username, password, fragment, port.
+    if components.username or components.password:
+        return 'userinfo'
+    if components.fragment:
+        return 'fragment'
+    try:
+        if components.port:
+            return 'port'
+    except ValueError:
+        return 'port'
+
+    # Must have a path, without /./ or /../ as segments.
+    if not components.path:
+        return 'path'
+    path_segments = components.path.split('/')
+    if '.' in path_segments or '..' in path_segments:
+        return 'path'
+
+    # Netloc should be a hostname, not an IP address.
+    try:
+        ip_address(hostname)
+    except ValueError:
+        pass
+    else:
+        return 'ip_address'
+
+    # And a hostname with a top level domain.
+    try:
+        hostname = hostname.encode('idna').decode('ascii')
+    except UnicodeError:
+        return 'hostname'
+    labels = hostname.split('.')
+    if len(hostname) > 253 or len(labels) < 2 or \
+       not HOSTNAME_TLD.match(labels[-1]) or \
+       not all(len(label) <= 63 and HOSTNAME_LABEL.match(label)
+               for label in labels):
+        return 'hostname'
+    return None
+
+
+def normalize_profile_url(value: str) -> ProfileURL:
+    """
+    Normalizes a profile URL and checks whether it is valid, splitting it
+    only once (twice if the scheme is missing). Results are not memoized:
+    use parse_profile_url() for that.
+    """
+    fixed = []
+    components = urlsplit(value)
+    if not components.scheme:
+        # Without a scheme the host is parsed as a path.
+        fixed.append('scheme')
+        components = urlsplit('http://' + value)
+    components = components._replace(netloc=components.netloc.lower())
+    if not components.path:
+        fixed.append('path')
+        components = components._replace(path='/')
+    hostname = components.hostname or ''
+    return ProfileURL(urlunsplit(components), components.scheme,
+                      components.netloc, hostname, components.path,
+                      components.query, components.fragment,
+                      __check(components, hostname), tuple(fixed))
+
+
+# The profile URLs parsed recently. Entries never expire, but the least
+# recently used ones are evicted once it is full.
+profile_url_memo = TTLCache(max_entries=4096, ttl=float('inf'))
+
+
+def parse_profile_url(value: str) -> ProfileURL:
+    """ Normalizes and validates a profile URL, remembering the result so
+    that parsing the same URL again is just a lookup. The normalized URL is
+    remembered too, since it is what the validators of a form get. """
+    result = profile_url_memo.get(value)
+    if result is None:
+        result = normalize_profile_url(value)
+        profile_url_memo.set(value, result)
+        if result.url != value:
+            profile_url_memo.set(result.url, result._replace(fixed=()))
+    return result
+
+
+def parse_profile_urls(values):
+    """
+    Normalizes and validates many profile URLs, such as the ones of a bulk
+    audit. This is a generator that yields the ProfileURL of each value, in
+    the same order, as they are taken from the iterable. Repeated URLs are
+    parsed once. The shared memo is neither used nor filled, so a large
+    batch doesn't evict the URLs of the logins.
+    """
+    parsed = {}
+    for value in values:
+        result = parsed.get(value)
+        if result is None:
+            result = parsed[value] = normalize_profile_url(value)
+        yield result
 
 
 class CanonicalFilter(object):
@@ -14,25 +150,7 @@ class CanonicalFilter(object):
     def __call__(self, value):
         # If the form is empty, give up.
         if not value: return ''
-
-        url_components = urlsplit(value)
-
-        # Convert the netloc to lowercase.
-        components_list = list(url_components)
-        components_list[1] = url_components.netloc.lower()
-        value = urlunsplit(components_list)
-
-        # If a scheme is missing, set the scheme to http.
-        if not url_components.scheme:
-            value = 'http://' + value
-            url_components = urlsplit(value)
-
-        # If a path is missing, append an empty slash.
-        if not url_components.path:
-            value += '/'
-            url_components = urlsplit(value)
-
-        return value
+        return parse_profile_url(value).url
 
 
 class ValidUserProfile(object):
@@ -41,6 +159,9 @@ class ValidUserProfile(object):
     comply. These rules are defined in section 3.1 of the IndieAuth spec.
     There may be something similar in the OAuth 2.0 spec, but I haven't read
     the entire spec at this moment.
+
+    The URL must also have a valid hostname with a top level domain, like
+    the URL validator of WTForms requires.
     """
     def __init__(self, message=None):
         if not message:
@@ -48,34 +169,8 @@ class ValidUserProfile(object):
         self.message = message
 
     def __call__(self, form: FlaskForm, field: Field):
-        components = urlsplit(field.data or '')
-
-        # Scheme must be http or https.
-        if not components.scheme or components.scheme not in ('http', 'https'):
-            raise ValidationError(self.message)
-
-        # Things that must not be present: username, password, fragment, port.
-        if components.username or components.password or \
-           components.fragment or components.port:
-            raise ValidationError(self.message)
-
-        # Must have a path.
-        if not components.path:
-            raise ValidationError(self.message)
-
-        # Must not have /./ or /../ as segments in the path.
-        path_segments = components.path.split('/')
-        if '.' in path_segments or '..' in path_segments:
-            raise ValidationError(self.message)
-
-        # Netloc should be a hostname, not an IP address.
-        try:
-            ip_address(components.netloc)
-        except ValueError:
-            pass
-        else:
-            # ValidationError is a subclass of ValueError.
-            # Can't raise this exception inside the try: block.
+        profile = parse_profile_url(field.data or '')
+        if not profile.valid or profile.fixed:
             raise ValidationError(self.message)
 
 
@@ -87,6 +182,5 @@ class LoginForm(FlaskForm):
     """
     domain = StringField('Domain', validators=[
         DataRequired('Please, input a domain name to log in'),
-        URL(message='Please, use a valid URL'),
         ValidUserProfile(message='Please, use a valid URL'),
     ], filters=[CanonicalFilter()])
@@ -0,0 +1,441 @@
+import glob
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from functools import wraps
+from flask import g
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, float('inf'))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def sample_key(name: str, labels: tuple) -> str:
+    """ Serializes a sample name and its labels into a storage key. """
+    return json.dumps([name, labels], separators=(',', ':'))
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', r'\\') \
+        .replace('\n', r'\n').replace('"', r'\"')
+    return '{' + ','.join('{}="{}"'.format(name, escape(value))
+                          for name, value in labels) + '}'
+
+
+class MemoryValues(object):
+    """ Keeps the samples of this process in a dict. Used when metrics are
+    not shared between processes. """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__values = {}
+
+    def add(self, key: str, amount: float):
+        with self.__lock:
+            self.__values[key] = self.__values.get(key, 0.0) + amount
+
+    def items(self):
+        with self.__lock:
+            return list(self.__values.items())
+
+
+class MmapValues(object):
+    """
+    Keeps the samples of this process in a memory mapped file, so that other
+    processes can read them. Each process has its own file, and only that
+    process writes to it, so no locking is needed between processes.
+
+    The file starts with the number of bytes in use, followed by entries made
+    of the length of the key, the key and the value as a double. Entries are
+    aligned to 8 bytes and never move, so updating a value is a single write.
+    """
+
+    INITIAL_SIZE = 64 * 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__offsets = {}
+        self.__fp = open(path, 'a+b')
+        if os.fstat(self.__fp.fileno()).st_size == 0:
+            self.__fp.truncate(self.INITIAL_SIZE)
+        self.__size = os.fstat(self.__fp.fileno()).st_size
+        self.__map = mmap.mmap(self.__fp.fileno(), self.__size)
+        self.__used = struct.unpack_from('q', self.__map, 0)[0] or 8
+        for key, _, offset in self.read_entries(self.__map, self.__used):
+            self.__offsets[key] = offset
+
+    @staticmethod
+    def read_entries(data, used: int):
+        """ Yields the key, value and value offset of every entry. """
+        position = 8
+        while position < used:
+            length = struct.unpack_from('i', data, position)[0]
+            key = bytes(data[position + 4:position + 4 + length])
+            offset = position + 4 + length
+            offset += (8 - offset % 8) % 8
+            yield key.decode('utf-8'), \
+                struct.unpack_from('d', data, offset)[0], offset
+            position = offset + 8
+
+    @classmethod
+    def read_file(cls, path: str):
+        """ Yields the key and value of every entry in a file. """
+        with open(path, 'rb') as fp:
+            data = fp.read()
+        if len(data) < 8:
+            return
+        used = struct.unpack_from('q', data, 0)[0]
+        for key, value, _ in cls.read_entries(data, min(used, len(data))):
+            yield key, value
+
+    def __append(self, key: str) -> int:
+        encoded = key.encode('utf-8')
+        offset = self.__used + 4 + len(encoded)
+        offset += (8 - offset % 8) % 8
+        if offset + 8 > self.__size:
+            while offset + 8 > self.__size:
+                self.__size *= 2
+            self.__map.close()
+            self.__fp.truncate(self.__size)
+            self.__map = mmap.mmap(self.__fp.fileno(), self.__size)
+        struct.pack_into('i', self.__map, self.__used, len(encoded))
+        self.__map[self.__used + 4:self.__used + 4 + len(encoded)] = encoded
+        struct.pack_into('d', self.__map, offset, 0.0)
+        # Readers only look at entries once they are complete.
+        self.__used = offset + 8
+        struct.pack_into('q', self.__map, 0, self.__used)
+        self.__offsets[key] = offset
+        return offset
+
+    def add(self, key: str, amount: float):
+        with self.__lock:
+            offset = self.__offsets.get(key)
+            if offset is None:
+                offset = self.__append(key)
+            value = struct.unpack_from('d', self.__map, offset)[0]
+            struct.pack_into('d', self.__map, offset, value + amount)
+
+    def items(self):
+        with self.__lock:
+            return [(key, value) for key, value, _ in
+                    self.read_entries(self.__map, self.__used)]
+
+    def close(self):
+        self.__map.close()
+        self.__fp.close()
+
+
+class Metric(object):
+
+    kind = None
+
+    def __init__(self, registry, name: str, documentation: str,
+                 labelnames: tuple):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def labels(self, labels: dict) -> tuple:
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+
+class Counter(Metric):
+    """ A value that only goes up. """
+
+    kind = 'counter'
+
+    def inc(self, amount: float=1, **labels):
+        key = sample_key(self.name, self.labels(labels))
+        self.registry.values.add(key, amount)
+
+
+class Histogram(Metric):
+    """ Counts observations, such as latencies, in cumulative buckets. """
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name: str, documentation: str,
+                 labelnames: tuple, buckets: tuple=DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        labels = self.labels(labels)
+        values = self.registry.values
+        for bound in self.buckets:
+            if value <= bound:
+                key = sample_key(self.name + '_bucket',
+                                 labels + (('le', format_value(bound)),))
+                values.add(key, 1)
+        values.add(sample_key(self.name + '_sum', labels), value)
+        values.add(sample_key(self.name + '_count', labels), 1)
+
+
+class Metrics(object):
+    """
+    Collects the metrics of the application and renders them using the
+    Prometheus text format.
+
+    When a directory is configured, every process writes its samples to its
+    own memory mapped file in there, and render() adds up the files of all
+    of them. This way, the metrics scraped from any uWSGI worker cover every
+    worker. The directory should be emptied before the server starts, but
+    not while it runs: the files of workers that have exited keep their
+    counts.
+
+    Without a directory, the samples are kept in the memory of the process,
+    which is enough for the development server.
+    """
+
+    def __init__(self, directory: str=None):
+        self.__lock = threading.Lock()
+        self.__metrics = []
+        self.__pid = None
+        self.__values = None
+        self.directory = directory
+
+    def init_app(self, app):
+        """ Configure the metrics using the settings of a Flask app. """
+        self.directory = app.config['METRICS_DIR']
+        with self.__lock:
+            self.__pid = None
+
+    @property
+    def values(self):
+        """ Returns where the samples of this process are stored. """
+        pid = os.getpid()
+        if self.__pid != pid:
+            # Never write into the file of the parent process after a fork.
+            with self.__lock:
+                if self.__pid != pid:
+                    if self.directory:
+                        path = os.path.join(self.directory,
+                                            'metrics_{}.db'.format(pid))
+                        self.__values = MmapValues(path)
+                    else:
+                        self.__values = MemoryValues()
+                    self.__pid = pid
+        return self.__values
+
+    def counter(self, name: str, documentation: str,
+                labelnames: tuple=()) -> Counter:
+        metric = Counter(self, name, documentation, labelnames)
+        self.__metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple=(),
+                  buckets: tuple=DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(self, name, documentation, labelnames, buckets)
+        self.__metrics.append(metric)
+        return metric
+
+    def collect(self) -> dict:
+        """ Returns the value of every sample, added up across processes. """
+        if not self.directory:
+            return dict(self.values.items())
+        self.values  # Make sure this process has a file.
+        totals = {}
+        for path in glob.glob(os.path.join(self.directory, 'metrics_*.db')):
+            try:
+                entries = list(MmapValues.read_file(path))
+            except (OSError, struct.error, UnicodeDecodeError):
+                continue
+            for key, value in entries:
+                totals[key] = totals.get(key, 0.0) + value
+        return totals
+
+    def render(self) -> str:
+        """ Renders every metric using the Prometheus text format. """
+        samples = {}
+        for key, value in self.collect().items():
+            name, labels = json.loads(key)
+            samples.setdefault(name, []).append(
+                (tuple(tuple(label) for label in labels), value))
+
+        def order(sample):
+            # Buckets must be sorted by their bound, not alphabetically.
+            labels, _ = sample
+            bound = dict(labels).get('le')
+            rest = tuple(label for label in labels if label[0] != 'le')
+            return rest, float(bound) if bound is not None else 0.0
+
+        lines = []
+        for metric in self.__metrics:
+            lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            suffixes = ('_bucket', '_sum', '_count') \
+                if metric.kind == 'histogram' else ('',)
+            series = {}
+            for suffix in suffixes:
+                for labels, value in samples.get(metric.name + suffix, []):
+                    rest = tuple(l for l in labels if l[0] != 'le')
+                    series.setdefault(rest, []).append(
+                        (suffix, labels, value))
+            for rest in sorted(series):
+                for suffix, labels, value in sorted(
+                        series[rest], key=lambda s: (suffixes.index(s[0]),
+                                                     order(s[1:]))):
+                    lines.append('{}{}{} {}'.format(
+                        metric.name, suffix, format_labels(labels),
+                        format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+# The metrics used by default. Flask apps configure them using init_app().
+metrics = Metrics()
+
+VIEW_REQUESTS = metrics.counter(
+    'dummyauth_view_requests_total',
+    'Requests handled by each view, by outcome.', ('view', 'outcome'))
+VIEW_DURATION = metrics.histogram(
+    'dummyauth_view_duration_seconds',
+    'Time spent handling requests in each view, by outcome.',
+    ('view', 'outcome'))
+OUTBOUND_REQUESTS = metrics.counter(
+    'dummyauth_outbound_requests_total',
+    'Discovery and verification steps, by phase and outcome.',
+    ('phase', 'outcome'))
+OUTBOUND_DURATION = metrics.histogram(
+    'dummyauth_outbound_duration_seconds',
+    'Time spent in discovery and verification steps, by phase and outcome.',
+    ('phase', 'outcome'))
+DNS_LOOKUPS = metrics.counter(
+    'dummyauth_dns_lookups_total',
+    'Host name lookups, by whether they were cached.', ('result',))
+CIRCUIT_TRANSITIONS = metrics.counter(
+    'dummyauth_circuit_transitions_total',
+    'Circuits of outbound hosts moved to each state.', ('state',))
+CIRCUIT_REJECTIONS = metrics.counter(
+    'dummyauth_circuit_rejections_total',
+    'Outbound requests not sent because the circuit of the host was open.')
+BULKHEAD_REJECTIONS = metrics.counter(
+    'dummyauth_bulkhead_rejections_total',
+    'Logins turned down because too many were waiting for other servers, '
+    'by the limit that was hit.', ('scope',))
+
+
+def set_outcome(outcome: str):
+    """ Sets the outcome label of the view handling this request. """
+    g.metrics_outcome = outcome
+
+
+def instrument_view(view_name: str):
+    """ Decorator that measures a view. The outcome is the one given to
+    set_outcome() by the view, 'error' if it raises, or 'ok'. """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            outcome = 'error'
+            try:
+                response = view(*args, **kwargs)
+                outcome = g.pop('metrics_outcome', 'ok')
+                return response
+            finally:
+                elapsed = time.perf_counter() - start
+                VIEW_REQUESTS.inc(view=view_name, outcome=outcome)
+                VIEW_DURATION.observe(elapsed, view=view_name, outcome=outcome)
+        return wrapper
+    return decorator
+
+
+def observe_outbound(phase: str, outcome: str, elapsed: float):
+    """ Records a discovery or verification step. """
+    OUTBOUND_REQUESTS.inc(phase=phase, outcome=outcome)
+    OUTBOUND_DURATION.observe(elapsed, phase=phase, outcome=outcome)
+
+
+class TimedParser(object):
+    """ Wraps a document parser to measure the time spent parsing. """
+
+    def __init__(self, parser):
+        self.parser = parser
+        self.elapsed = 0.0
+
+    @property
+    def done(self) -> bool:
+        return self.parser.done
+
+    def feed(self, data):
+        start = time.perf_counter()
+        try:
+            self.parser.feed(data)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+    def finish(self, content=None):
+        start = time.perf_counter()
+        try:
+            return self.parser.finish(content)
+        finally:
+            self.elapsed += time.perf_counter() - start
+
+
+def status_outcome(status_code: int) -> str:
+    """ Returns the outcome label for an HTTP status code, such as 2xx. """
+    if status_code == 304:
+        return '304'
+    return '{}xx'.format(status_code // 100)
+
+
+def parse_outcome(parsed) -> str:
+    """ Returns the outcome label for what a parser found. Link extractors
+    return a dict with a list per rel, which is empty if nothing matched. """
+    if isinstance(parsed, dict):
+        return 'found' if any(parsed.values()) else 'empty'
+    return 'found' if parsed else 'empty'
+
+
+def timed_fetch(fetch, phase: str, redirect_codes: tuple=()):
+    """
+    Sends a Fetch from a flow, recording how long it took. Use it as
+    `result = yield from timed_fetch(fetch, 'head')`. Responses with one of
+    the redirect codes are recorded under the redirect phase instead. If the
+    fetch has a parser, the time spent parsing is recorded under the parse
+    phase and not counted in the phase of the request.
+    """
+    parsers = []
+    if fetch.parser is not None:
+        factory = fetch.parser
+
+        def build_parser(status_code, headers):
+            parser = factory(status_code, headers)
+            if parser is None:
+                return None
+            parsers.append(TimedParser(parser))
+            return parsers[-1]
+        fetch = fetch._replace(parser=build_parser)
+
+    start = time.perf_counter()
+    try:
+        result = yield fetch
+    except Exception:
+        observe_outbound(phase, 'error', time.perf_counter() - start)
+        raise
+    elapsed = time.perf_counter() - start
+
+    parse_time = sum(parser.elapsed for parser in parsers)
+    if parsers:
+        observe_outbound('parse', parse_outcome(result.parsed), parse_time)
+    if result.status_code in redirect_codes:
+        phase = 'redirect'
+    observe_outbound(phase, status_outcome(result.status_code),
+                     elapsed - parse_time)
+    return result
@@ -0,0 +1,247 @@
+import codecs
+import json
+from html.parser import HTMLParser
+from urllib.parse import parse_qs, urljoin
+from dummyauth.client import parse_media_type
+from dummyauth.exceptions import InvalidAuthorizationResponseException
+
+# Elements that may appear inside <head>. Any other element implies that the
+# head is over, even if the document forgot to close it, which is how an
+# HTML5 parser would see it too.
+HEAD_ELEMENTS = frozenset((
+    'html', 'head', 'base', 'link', 'meta', 'noscript', 'script', 'style',
+    'template', 'title',
+))
+
+# The rel values that matter during endpoint discovery.
+DISCOVERY_RELS = ('authorization_endpoint', 'token_endpoint', 'me')
+
+# The media types an authorization endpoint may answer with.
+FIELDS_MEDIA_TYPES = ('application/json', 'application/x-www-form-urlencoded')
+
+
+class LinkExtractor(HTMLParser):
+    """
+    This parser extracts <link rel> values from an HTML document that is
+    being downloaded, one chunk at a time, without building a tree.
+
+    Links are resolved against the URL of the document. The rel attribute
+    is treated as a space-separated, case-insensitive list of values, so a
+    single element can provide more than one rel. Anchors with rel="me"
+    are also extracted, because RelMeAuth accepts them.
+
+    Once the parser has found a link for every wanted rel value (unless
+    collect_all is set), or once it has left the <head> of the document (if
+    head_only is set), it is done: the caller should stop downloading the
+    document and any further data fed to the parser is ignored.
+    """
+
+    class __Done(Exception):
+        pass
+
+    def __init__(self, base_url: str, wanted=DISCOVERY_RELS,
+                 head_only: bool=True, collect_all: bool=False,
+                 encoding: str=None):
+        """ Initialize the extractor.
+
+        :param base_url: the URL of the document, to resolve relative hrefs.
+        :param wanted: the rel values to look for.
+        :param head_only: if true, parsing stops at the end of <head>.
+        :param collect_all: if true, keep looking for more links after the
+            first one for each wanted rel value has been found.
+        :param encoding: the character encoding of the document. UTF-8 is
+            used if unknown. Invalid sequences are replaced, since only
+            the markup matters here.
+        """
+        super().__init__(convert_charrefs=True)
+        self.base_url = base_url
+        self.wanted = frozenset(wanted)
+        self.head_only = head_only
+        self.collect_all = collect_all
+        self.links = {rel: [] for rel in self.wanted}
+        self.done = False
+        try:
+            decoder = codecs.getincrementaldecoder(encoding or 'utf-8')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')
+        self.__decoder = decoder(errors='replace')
+
+    def first(self, rel: str) -> str:
+        """ Returns the first URL found for the given rel, or None. """
+        urls = self.links.get(rel)
+        return urls[0] if urls else None
+
+    def feed(self, data):
+        """ Parses a chunk of the document, given as bytes or a buffer. """
+        if self.done:
+            return
+        try:
+            super().feed(self.__decoder.decode(data))
+        except self.__Done:
+            self.done = True
+
+    def close(self):
+        if not self.done:
+            try:
+                super().feed(self.__decoder.decode(b'', final=True))
+                super().close()
+            except self.__Done:
+                pass
+        self.done = True
+
+    def finish(self, content=None) -> dict:
+        """ Stops parsing and returns the links found, keyed by rel. """
+        self.close()
+        return self.links
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('link', 'a'):
+            self.__handle_link(tag, dict(attrs))
+        elif self.head_only and tag not in HEAD_ELEMENTS:
+            raise self.__Done()
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if self.head_only and tag == 'head':
+            raise self.__Done()
+
+    def __handle_link(self, tag, attrs):
+        if self.head_only and tag == 'a':
+            # Anchors are not allowed in the head, so the body has started.
+            raise self.__Done()
+        href = attrs.get('href')
+        if href is None:
+            return
+        for rel in (attrs.get('rel') or '').lower().split():
+            if rel in self.wanted and (tag == 'link' or rel == 'me'):
+                self.links[rel].append(urljoin(self.base_url, href.strip()))
+        if not self.collect_all and all(self.links.values()):
+            raise self.__Done()
+
+
+class Html5libLinkExtractor(object):
+    """
+    Counterpart of LinkExtractor for the strict compatibility mode. It
+    doesn't parse anything while the document is being downloaded: the
+    whole document is parsed by html5lib once it has been read.
+    """
+
+    done = False
+
+    def __init__(self, base_url: str, wanted=DISCOVERY_RELS):
+        self.base_url = base_url
+        self.wanted = wanted
+
+    def feed(self, data):
+        pass
+
+    def finish(self, content) -> dict:
+        """ Parses the downloaded document and returns the links found. """
+        return extract_links_html5lib(content, self.base_url, self.wanted)
+
+
+def extract_links_html5lib(content, base_url: str,
+                           wanted=DISCOVERY_RELS) -> dict:
+    """
+    Extracts <link rel> values parsing the whole document with html5lib,
+    the way the spider did before the streaming extractor existed. This is
+    a lot slower, but it builds the same tree that a browser would, so it
+    is kept around as a strict compatibility mode.
+
+    :return: a dict with a list of URLs for each wanted rel value.
+    """
+    # Only the strict mode needs them, and they take a while to import.
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(bytes(content), 'html5lib')
+    links = {rel: [] for rel in wanted}
+    for rel in wanted:
+        for tag in soup.find_all('link', rel=rel):
+            if tag.has_attr('href'):
+                links[rel].append(urljoin(base_url, tag['href'].strip()))
+    return links
+
+
+class FieldsParser(object):
+    """
+    Decodes the JSON or form-encoded body of the response of an
+    authorization endpoint into a dict of fields.
+
+    Nothing is decoded while the body is being downloaded: the parser only
+    makes sure that it doesn't grow past max_bytes, and tells the client to
+    stop reading once Content-Length bytes have arrived, unless the body is
+    compressed, since they are counted once decoded. The whole body is
+    decoded in finish(), straight from the buffer of the reader.
+
+    Every problem with the response is reported raising an
+    InvalidAuthorizationResponseException.
+    """
+
+    def __init__(self, media_type: str, charset: str=None,
+                 max_bytes: int=16384, length: int=None):
+        """ Initialize the parser.
+
+        :param media_type: one of FIELDS_MEDIA_TYPES.
+        :param charset: the character encoding of the body. UTF-8 is used
+            if unknown.
+        :param max_bytes: the largest body accepted.
+        :param length: the size of the body, if known.
+        """
+        self.media_type = media_type
+        self.charset = charset or 'utf-8'
+        self.max_bytes = max_bytes
+        self.expected = length
+        self.length = 0
+        self.done = length == 0
+
+    @classmethod
+    def for_response(cls, headers, max_bytes: int=16384) -> 'FieldsParser':
+        """ Builds the parser for a response, given its headers. Responses
+        that can't be parsed are rejected before reading their body. """
+        content_type = headers.get('content-type')
+        media_type, params = parse_media_type(content_type)
+        if media_type not in FIELDS_MEDIA_TYPES:
+            message = 'Unsupported content-type: {}'.format(content_type)
+            raise InvalidAuthorizationResponseException(message)
+        length = headers.get('content-length')
+        length = int(length) if length and length.isdigit() else None
+        encoding = headers.get('content-encoding', 'identity')
+        if encoding.strip().lower() != 'identity':
+            # Content-Length counts the bytes sent, not the ones decoded.
+            length = None
+        if length is not None and length > max_bytes:
+            raise cls.__too_large(max_bytes)
+        return cls(media_type, params.get('charset'), max_bytes, length)
+
+    def feed(self, data):
+        """ Counts a chunk of the body, given as bytes or a buffer. """
+        self.length += len(data)
+        if self.length > self.max_bytes:
+            raise self.__too_large(self.max_bytes)
+        if self.expected is not None and self.length >= self.expected:
+            self.done = True
+
+    def finish(self, content) -> dict:
+        """ Decodes the body, given as bytes or a buffer. """
+        try:
+            text = codecs.decode(content, self.charset)
+        except (LookupError, UnicodeDecodeError):
+            raise InvalidAuthorizationResponseException(
+                'The response is not valid {} text.'.format(self.charset))
+        if self.media_type == 'application/x-www-form-urlencoded':
+            qs = parse_qs(text)
+            return {k: qs[k][0] for k in qs}
+        try:
+            fields = json.loads(text)
+        except ValueError:
+            fields = None
+        if not isinstance(fields, dict):
+            raise InvalidAuthorizationResponseException(
+                'The response is not a JSON object.')
+        return fields
+
+    @staticmethod
+    def __too_large(max_bytes: int) -> InvalidAuthorizationResponseException:
+        return InvalidAuthorizationResponseException(
+            'The response is larger than {} bytes.'.format(max_bytes))
@@ -0,0 +1,127 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dummyauth.cache import TTLCache
+
+
+class Prefetcher(object):
+    """
+    Discovers the profile URLs typed in the login form in the background,
+    before the form is sent, so that the login finds the work done and can
+    redirect to the authorization endpoint right away. See
+    dummyauth.views.discover_view.
+
+    Each URL gets a future, kept for a short while, which the login takes
+    instead of discovering the URL again. A future that is still waiting
+    for a thread when it is taken is cancelled, so that the login doesn't
+    wait behind other prefetches, and does the work itself.
+
+    Prefetching is speculative: once too many are waiting for a thread, new
+    ones are turned down instead of queued.
+
+    The threads and the futures belong to the process that started them.
+    After a fork, the child starts with none, since threads don't survive a
+    fork.
+    """
+
+    def __init__(self, workers: int=4, max_pending: int=32,
+                 max_entries: int=1024, ttl: float=30):
+        """ Initialize the prefetcher.
+
+        :param workers: how many URLs are discovered at once. Zero disables
+            prefetching.
+        :param max_pending: how many URLs may wait for a thread.
+        :param max_entries: how many results to keep.
+        :param ttl: seconds a result is kept, since it was asked for.
+        """
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__executor = None
+        self.__futures = None
+        self.__pending = 0
+
+    def init_app(self, app):
+        """ Configure the prefetcher using the settings of a Flask app. """
+        self.workers = app.config['PREFETCH_WORKERS']
+        self.max_pending = app.config['PREFETCH_MAX_PENDING']
+        self.max_entries = app.config['PREFETCH_CACHE_SIZE']
+        self.ttl = app.config['PREFETCH_TTL']
+        self.clear()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def __state(self):
+        """ Returns the executor and the futures of this process. Must be
+        called holding the lock. """
+        pid = os.getpid()
+        if self.__pid != pid:
+            self.__executor = None
+            self.__futures = TTLCache(self.max_entries, self.ttl)
+            self.__pending = 0
+            self.__pid = pid
+        if self.__executor is None and self.enabled:
+            self.__executor = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='prefetch')
+        return self.__executor, self.__futures
+
+    def start(self, key, function, *args) -> str:
+        """ Calls function(*args) in the background, unless it has been
+        done for the same key recently.
+
+        :return: 'started' if it was, 'pending' or 'ready' if it had been
+            already, or 'busy' if too many calls are waiting for a thread.
+        """
+        with self.__lock:
+            executor, futures = self.__state()
+            future = futures.get(key)
+            if future is not None and not future.cancelled():
+                return 'ready' if future.done() else 'pending'
+            if executor is None or self.__pending >= self.max_pending:
+                return 'busy'
+            self.__pending += 1
+            future = executor.submit(self.__run, function, *args)
+            futures.set(key, future)
+            return 'started'
+
+    def __run(self, function, *args):
+        with self.__lock:
+            self.__pending = max(self.__pending - 1, 0)
+        return function(*args)
+
+    def take(self, key):
+        """ Returns the future of the call started for a key, or None if
+        there is none or it was still waiting for a thread. """
+        with self.__lock:
+            _, futures = self.__state()
+            future = futures.get(key)
+            if future is None:
+                return None
+            if future.cancel():
+                self.__pending -= 1
+                futures.discard(key)
+                return None
+            return future
+
+    def result(self, key):
+        """ Returns the result of the call started for a key, waiting for
+        it if it is running, or None if take() returns no future. """
+        future = self.take(key)
+        return None if future is None else future.result()
+
+    def clear(self):
+        """ Forgets every result. Calls already started still run. """
+        with self.__lock:
+            self.__pid = None
+            executor, self.__executor = self.__executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+# The prefetcher used by default. Flask apps configure it using init_app().
+prefetcher = Prefetcher()
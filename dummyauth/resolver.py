@@ -0,0 +1,142 @@
+import ipaddress
+import os
+import socket
+import threading
+from dummyauth.cache import TTLCache
+from dummyauth.metrics import DNS_LOOKUPS
+
+
+class DNSCache(object):
+    """
+    Caches the addresses of the hosts contacted by the spider and the
+    validator, so that every hop of a discovery and every verification
+    doesn't have to ask the resolver again. getaddrinfo() doesn't tell the
+    TTL of the records, so every answer is kept for the same time.
+
+    Failed lookups are cached too, for a shorter time, so that a profile
+    whose host doesn't exist doesn't stall every worker on the resolver
+    while it is being retried.
+
+    The cache belongs to the process that filled it. After a fork, the
+    child starts with an empty one, since the lock of the parent may have
+    been held by another thread when it forked.
+    """
+
+    def __init__(self, max_entries: int=1024, ttl: float=60,
+                 negative_ttl: float=5, resolver=None):
+        """ Initialize the cache.
+
+        :param max_entries: how many lookups to keep. Zero disables it.
+        :param ttl: seconds the addresses of a host are kept.
+        :param negative_ttl: seconds a failed lookup is kept.
+        :param resolver: the function that resolves the lookups that are
+            not cached, with the signature of socket.getaddrinfo(), which
+            is used if not given.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.resolver = resolver
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__entries = None
+        self.hits = 0
+        self.misses = 0
+
+    def init_app(self, app):
+        """ Configure the cache using the settings of a Flask app. """
+        self.max_entries = app.config['DNS_CACHE_SIZE']
+        self.ttl = app.config['DNS_CACHE_TTL']
+        self.negative_ttl = app.config['DNS_NEGATIVE_TTL']
+        self.clear()
+
+    @property
+    def entries(self) -> TTLCache:
+        """ Returns the lookups cached by this process. """
+        pid = os.getpid()
+        if self.__pid != pid:
+            with self.__lock:
+                if self.__pid != pid:
+                    self.__entries = TTLCache(self.max_entries, self.ttl)
+                    self.hits = self.misses = 0
+                    self.__pid = pid
+        return self.__entries
+
+    def cached(self, host: str, port, family: int=0, type: int=0,
+               proto: int=0, flags: int=0) -> list:
+        """ Returns the cached result of a lookup, or None if not cached.
+
+        :raise socket.gaierror: if the lookup failed recently.
+        """
+        entry = self.entries.get((host, port, family, type, proto, flags))
+        if entry is None:
+            return None
+        self.hits += 1
+        DNS_LOOKUPS.inc(result='hit')
+        if isinstance(entry, socket.gaierror):
+            raise socket.gaierror(*entry.args)
+        return entry
+
+    def getaddrinfo(self, host: str, port, family: int=0, type: int=0,
+                    proto: int=0, flags: int=0) -> list:
+        """ Same as socket.getaddrinfo(), but cached. IP addresses are not
+        cached, nor given to the resolver, since they are not looked up. """
+        if is_address(host):
+            return socket.getaddrinfo(host.strip('[]'), port, family, type,
+                                      proto, flags | socket.AI_NUMERICHOST)
+        key = (host, port, family, type, proto, flags)
+        infos = self.cached(*key)
+        if infos is not None:
+            return infos
+        self.misses += 1
+        DNS_LOOKUPS.inc(result='miss')
+        try:
+            infos = self.__resolve(*key)
+        except socket.gaierror as e:
+            self.entries.set(key, e, self.negative_ttl)
+            raise
+        self.entries.set(key, infos)
+        return infos
+
+    def addresses(self, host: str, port) -> list:
+        """ Returns the distinct addresses to open a TCP connection to a
+        host at, in the order given by the resolver. """
+        infos = self.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    def cached_addresses(self, host: str, port) -> list:
+        """ Same as addresses(), but returns None instead of asking the
+        resolver if the host has to be looked up. """
+        if is_address(host):
+            return [host.strip('[]')]
+        infos = self.cached(host, port, 0, socket.SOCK_STREAM)
+        if infos is None:
+            return None
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    def stats(self) -> dict:
+        """ Returns the hits and misses of this process. """
+        return {'entries': len(self.entries), 'hits': self.hits,
+                'misses': self.misses}
+
+    def clear(self):
+        """ Forgets every lookup. """
+        with self.__lock:
+            self.__pid = None
+
+    def __resolve(self, *args) -> list:
+        resolver = self.resolver or socket.getaddrinfo
+        return resolver(*args)
+
+
+def is_address(host: str) -> bool:
+    """ Tells whether a host is an IP address instead of a name. """
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+    except ValueError:
+        return False
+    return True
+
+
+# The cache used by default. Flask apps configure it using init_app().
+dns_cache = DNSCache()
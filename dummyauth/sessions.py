@@ -0,0 +1,173 @@
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from flask.sessions import SessionInterface, SessionMixin, \
+    session_json_serializer
+from werkzeug.datastructures import CallbackDict
+from dummyauth.cache import TTLCache
+
+SESSION_ID = re.compile(r'^[A-Za-z0-9_-]{43}$')
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """ A session whose data is kept on the server, under an opaque id. """
+
+    def __init__(self, initial=None, sid: str=None, new: bool=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class MemorySessionStore(object):
+    """ Keeps sessions in the memory of the process. Sessions are not shared
+    between worker processes, so use it with a single process only. """
+
+    def __init__(self, max_entries: int=10000):
+        self.__sessions = TTLCache(max_entries)
+
+    def get(self, sid: str) -> bytes:
+        return self.__sessions.get(sid)
+
+    def set(self, sid: str, data: bytes, ttl: float):
+        self.__sessions.set(sid, data, ttl)
+
+    def delete(self, sid: str):
+        self.__sessions.discard(sid)
+
+
+class SQLiteSessionStore(object):
+    """
+    Keeps sessions in a SQLite database, which every worker process opens,
+    so a session started in a worker can be continued in any other one.
+
+    Each thread uses its own connection, opened again after a fork. The
+    database uses write-ahead logging so that readers don't wait for
+    writers. Expired sessions are ignored when read, and deleted every few
+    writes, along with the ones closest to expiring if there are more than
+    max_entries left.
+    """
+
+    PURGE_EVERY = 256
+
+    def __init__(self, path: str, max_entries: int=100000,
+                 timeout: float=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.__local = threading.local()
+        self.__writes = 0
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        local = self.__local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS sessions ('
+                         'sid TEXT PRIMARY KEY, data BLOB NOT NULL, '
+                         'expires REAL NOT NULL)')
+            local.connection, local.pid = conn, os.getpid()
+        return local.connection
+
+    def get(self, sid: str) -> bytes:
+        row = self.connection.execute(
+            'SELECT data FROM sessions WHERE sid = ? AND expires > ?',
+            (sid, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, sid: str, data: bytes, ttl: float):
+        conn = self.connection
+        conn.execute('INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)',
+                     (sid, data, time.time() + ttl))
+        self.__writes += 1
+        if self.__writes % self.PURGE_EVERY == 0:
+            conn.execute('DELETE FROM sessions WHERE expires <= ?',
+                         (time.time(),))
+            conn.execute('DELETE FROM sessions WHERE sid IN ('
+                         'SELECT sid FROM sessions ORDER BY expires DESC '
+                         'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def delete(self, sid: str):
+        self.connection.execute('DELETE FROM sessions WHERE sid = ?', (sid,))
+
+
+class ServerSessionInterface(SessionInterface):
+    """
+    Keeps the session data on the server, in one of the stores above, and
+    only sends a random session id in the cookie. The data is serialized
+    the same way Flask does for cookie sessions, but it isn't signed nor
+    sent back and forth on every request.
+
+    Sessions expire ttl seconds after they were last modified. Empty
+    sessions are not stored, and clearing a session deletes it.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, store, ttl: float=3600):
+        self.store = store
+        self.ttl = ttl
+
+    def open_session(self, app, request) -> ServerSession:
+        sid = request.cookies.get(app.session_cookie_name)
+        if sid and SESSION_ID.match(sid):
+            data = self.store.get(sid)
+            if data is not None:
+                try:
+                    return ServerSession(self.serializer.loads(data), sid)
+                except ValueError:
+                    pass
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session: ServerSession, response):
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(app.session_cookie_name,
+                                       domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+
+        self.store.set(session.sid, self.serializer.dumps(dict(session)),
+                       self.ttl)
+        response.set_cookie(app.session_cookie_name, session.sid,
+                            max_age=int(self.ttl), domain=domain, path=path,
+                            httponly=self.get_cookie_httponly(app),
+                            secure=self.get_cookie_secure(app),
+                            samesite=app.config.get('SESSION_COOKIE_SAMESITE'))
+
+
+def build_store(backend: str, config: dict, instance_path: str):
+    """ Builds the session store for a SESSION_BACKEND value. The sqlite
+    backend keeps its database in the instance folder unless told where. """
+    if backend == 'memory':
+        return MemorySessionStore(config['SESSION_MEMORY_SIZE'])
+    if backend == 'sqlite':
+        path = config['SESSION_SQLITE_PATH']
+        if not path:
+            os.makedirs(instance_path, mode=0o700, exist_ok=True)
+            path = os.path.join(instance_path, 'sessions.sqlite3')
+        return SQLiteSessionStore(path, config['SESSION_SQLITE_SIZE'])
+    raise ValueError('Unknown session backend: {}'.format(backend))
+
+
+def init_app(app):
+    """ Installs the session interface chosen by SESSION_BACKEND. The
+    default, cookie, keeps Flask's signed cookie sessions. """
+    backend = app.config['SESSION_BACKEND']
+    if backend == 'cookie':
+        return
+    app.session_interface = ServerSessionInterface(
+        build_store(backend, app.config, app.instance_path),
+        app.config['SESSION_TTL'])
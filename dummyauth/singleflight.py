@@ -0,0 +1,213 @@
+import asyncio
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+class Call(object):
+    """ A call in flight, which other callers of the same key wait for. """
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesces concurrent calls with the same key, so that only one of them
+    runs and the rest wait for it and share its result. The spider uses it
+    keyed by the profile URL, so a burst of logins for the same profile
+    sends a single set of requests.
+
+    Within a process, callers wait for the thread that got there first. If
+    a directory is configured, the same is done across processes using a
+    lock file per key in that directory: the process that holds the lock
+    runs the call and writes its result to the lock file, and the processes
+    that were waiting for the lock read it from there instead of running
+    the call again. If the call fails, the waiting processes run it
+    themselves. Results must be JSON serializable to be shared this way.
+    Lock files are removed once their call is over, so the directory only
+    holds those of the calls in flight.
+
+    Only calls that overlap are coalesced: once a call is over, the next
+    one runs again.
+    """
+
+    def __init__(self, directory: str=None, wait: float=10.0,
+                 poll_interval: float=0.01):
+        """ Initialize the coalescer.
+
+        :param directory: where the lock files are kept, to coalesce calls
+            across processes. If None, only calls within the same process
+            are coalesced.
+        :param wait: the maximum number of seconds to wait for another
+            process before running the call anyway.
+        :param poll_interval: seconds between attempts to take the lock of
+            another process.
+        """
+        self.__lock = threading.Lock()
+        self.__calls = {}
+        self.__async_calls = weakref.WeakKeyDictionary()
+        self.__pid = os.getpid()
+        self.directory = directory
+        self.wait = wait
+        self.poll_interval = poll_interval
+
+    def init_app(self, app):
+        """ Configure the coalescer using the settings of a Flask app. """
+        self.directory = app.config['DISCOVERY_SINGLEFLIGHT_DIR']
+        self.wait = app.config['DISCOVERY_SINGLEFLIGHT_WAIT']
+
+    def do(self, key: str, function):
+        """ Calls function, unless a call for the same key is in flight, in
+        which case its result is returned instead. Errors are shared too.
+        """
+        with self.__lock:
+            if self.__pid != os.getpid():
+                # The calls in flight belong to threads of the parent.
+                self.__pid = os.getpid()
+                self.__calls = {}
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result)
+
+        try:
+            call.result = self.__run_shared(key, function)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.__lock:
+                if self.__calls.get(key) is call:
+                    del self.__calls[key]
+            call.event.set()
+
+    async def do_async(self, key: str, function):
+        """ Awaits function(), unless a call for the same key is in flight
+        on this event loop, in which case its result is returned instead.
+        Calls are not coalesced across processes. """
+        loop = asyncio.get_event_loop()
+        calls = self.__async_calls.setdefault(loop, {})
+        future = calls.get(key)
+        if future is not None:
+            return copy.deepcopy(await asyncio.shield(future))
+
+        future = calls[key] = loop.create_future()
+        try:
+            result = await function()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody may be waiting for it: don't warn about it.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del calls[key]
+
+    def __run_shared(self, key: str, function):
+        if not self.directory or fcntl is None:
+            return function()
+
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.lock'
+        path = os.path.join(self.directory, name)
+        started = time.time()
+        deadline = time.monotonic() + self.wait
+        while True:
+            with open(path, 'a+') as fp:
+                waited = False
+                while True:
+                    try:
+                        fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() >= deadline:
+                            # Don't wait forever for a process that got
+                            # stuck.
+                            return function()
+                        waited = True
+                        time.sleep(self.poll_interval)
+
+                try:
+                    if waited:
+                        shared = self.__read_result(fp, key, started)
+                        if shared is not None:
+                            return shared['result']
+                    if not self.__is_current(fp, path):
+                        # Removed by a process that was done with it. Try
+                        # again with the file that took its place, if any.
+                        continue
+                    try:
+                        result = function()
+                        self.__write_result(fp, key, result)
+                        return result
+                    finally:
+                        # Processes waiting for the lock read the result
+                        # from the file they opened. Later calls run again,
+                        # so no file is left behind.
+                        os.unlink(path)
+                finally:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    @staticmethod
+    def __is_current(fp, path: str) -> bool:
+        """ Tells whether an open lock file is still the one at path. """
+        try:
+            current = os.stat(path)
+        except FileNotFoundError:
+            return False
+        opened = os.fstat(fp.fileno())
+        return (current.st_dev, current.st_ino) == \
+            (opened.st_dev, opened.st_ino)
+
+    @staticmethod
+    def __read_result(fp, key: str, started: float) -> dict:
+        """ Returns the result written while waiting for the lock, if any.
+        """
+        if os.fstat(fp.fileno()).st_mtime < started:
+            return None
+        fp.seek(0)
+        try:
+            shared = json.loads(fp.read())
+        except ValueError:
+            return None
+        return shared if shared.get('key') == key else None
+
+    @staticmethod
+    def __write_result(fp, key: str, result):
+        try:
+            data = json.dumps({'key': key, 'result': result})
+        except (TypeError, ValueError):
+            data = ''
+        fp.seek(0)
+        fp.truncate()
+        fp.write(data)
+        fp.flush()
+
+
+# The coalescer used by default. Flask apps configure it using init_app().
+single_flight = SingleFlight()
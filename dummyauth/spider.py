@@ -1,13 +1,41 @@
-import requests
-from dummyauth.exceptions import InvalidAuthorizationResponseException
-from urllib.parse import parse_qs, urljoin
-from bs4 import BeautifulSoup
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dummyauth.aio import AsyncHTTPClient, async_http_client
+from dummyauth.cache import DiscoveryCache, NegativeCache, RedirectMemo, \
+    RelMeCache, discovery_cache, negative_cache, redirect_memo, relme_cache
+from dummyauth.client import Fetch, HTTPClient, failure_kind, http_client, \
+    parse_link_header, parse_media_type
+from dummyauth.deadline import Deadline
+from dummyauth.exceptions import DeadlineExceeded, DummyAuthException, \
+    RedirectionException, UnreachableProfileException
+from dummyauth.metrics import timed_fetch
+from dummyauth.parser import FieldsParser, Html5libLinkExtractor, \
+    LinkExtractor
+from dummyauth.singleflight import SingleFlight, single_flight
+from dummyauth.strategy import DiscoveryStrategy, discovery_strategy
+from urllib.parse import urljoin, urlsplit
+
+REDIRECT_CODES = (301, 302, 307, 308)
+TEMPORARY_REDIRECT_CODES = (302, 307)
+
+
+def profile_key(url: str) -> tuple:
+    """ Returns what identifies a profile URL when comparing rel="me"
+    links. Like most RelMeAuth implementations, the scheme, the case of the
+    host and a trailing slash are not taken into account. """
+    parts = urlsplit(url.strip())
+    return (parts.hostname or '', parts.port, parts.path.rstrip('/'),
+            parts.query)
 
 
 class AuthorizationCodeValidator(object):
 
     def __init__(self, authorization_endpoint: str, code: str,
-                 client_id: str, redirect_uri: str):
+                 client_id: str, redirect_uri: str, client: HTTPClient=None,
+                 deadline: Deadline=None, max_body_size: int=16384):
+        self.__client = client or http_client
+        self.deadline = deadline
+        self.max_body_size = max_body_size
         self.__authorization_endpoint = authorization_endpoint
         self.__code = code
         self.__client_id = client_id
@@ -17,62 +45,104 @@ class AuthorizationCodeValidator(object):
         self.__me = None
         self.__error = None
 
-    @classmethod
-    def __parse_response(cls, request):
-        content_type = request.headers['content-type']
-        if content_type == 'application/json':
-            return request.json()
-        elif content_type == 'application/x-www-form-urlencoded':
-            qs = parse_qs(request.text)
-            return {k: qs[k][0] for k in qs }
-        else:
-            message = 'Unsupported content-type: {}'.format(content_type)
-            raise InvalidAuthorizationResponseException(message)
+    def __response_parser(self, status_code, headers) -> FieldsParser:
+        """ Returns the parser of the body of the verification response. """
+        return FieldsParser.for_response(headers, self.max_body_size)
 
-    def __fetch(self):
-        """ Perform validation. """
+    def verification_flow(self):
+        """
+        Validates the code against the authorization endpoint. This is a
+        generator that yields the HTTP requests to send instead of sending
+        them, so that it can be run by both HTTPClient and AsyncHTTPClient.
+
+        The response, JSON or form-encoded, is streamed into a FieldsParser,
+        which gives up on bodies larger than max_body_size.
+
+        :return: a dict with the valid, me and error fields.
+        """
         payload = {
             'code': self.__code,
             'client_id': self.__client_id,
             'redirect_uri': self.__redirect_uri
         }
-        request = requests.post(self.__authorization_endpoint, data=payload)
-        self.__fetched = True
+        request = yield from timed_fetch(
+            Fetch('POST', self.__authorization_endpoint, data=payload,
+                  parser=self.__response_parser), 'verify')
+        response = request.parsed
+        fields = {'valid': False, 'me': None, 'error': None}
         if request.status_code == 200:
-            self.__valid = True
-            response = self.__parse_response(request)
+            fields['valid'] = True
             if 'me' in response:
-                self.__me = response['me']
+                fields['me'] = response['me']
             else:
-                self.__valid = False
-                self.__error = 'invalid_payload'
+                fields['valid'] = False
+                fields['error'] = 'invalid_payload'
         else:
-            self.__valid = False
-            response = self.__parse_response(request)
-            self.__error = response.get('error', '')
+            fields['valid'] = False
+            fields['error'] = response.get('error', '')
+        return fields
+
+    def _fetch(self):
+        """ Perform validation. """
+        self._store(self.__client.run(self.verification_flow(),
+                                      self.deadline))
+
+    def _store(self, fields: dict):
+        """ Saves the result of the validation. """
+        self.__valid = fields['valid']
+        self.__me = fields['me']
+        self.__error = fields['error']
+        self.__fetched = True
 
     @property
     def valid(self) -> bool:
         """ Will return True if the validation request was successful. """
         if not self.__fetched:
-            self.__fetch()
+            self._fetch()
         return self.__valid
 
     @property
     def profile_url(self) -> str:
         """ In case the request is valid, will hold the canonical URL. """
         if not self.__fetched:
-            self.__fetch()
+            self._fetch()
         return self.__me
 
     @property
     def error(self) -> str:
         """ In case the request is not valid, will hold the response error. """
         if not self.__fetched:
-            self.__fetch()
+            self._fetch()
         return self.__error
 
 
+class AsyncAuthorizationCodeValidator(AuthorizationCodeValidator):
+    """
+    Non-blocking version of the AuthorizationCodeValidator. The validation
+    request is sent when verify() is awaited. After that, the properties of
+    the validator can be read as usual.
+    """
+
+    def __init__(self, authorization_endpoint: str, code: str,
+                 client_id: str, redirect_uri: str,
+                 client: AsyncHTTPClient=None, deadline: Deadline=None,
+                 max_body_size: int=16384):
+        super().__init__(authorization_endpoint, code, client_id,
+                         redirect_uri, deadline=deadline,
+                         max_body_size=max_body_size)
+        self.__client = client or async_http_client
+
+    async def verify(self) -> bool:
+        """ Sends the validation request. Returns True if the code is valid.
+        """
+        self._store(await self.__client.run(self.verification_flow(),
+                                            self.deadline))
+        return self.valid
+
+    def _fetch(self):
+        raise RuntimeError('The code has not been verified yet.')
+
+
 class EndpointDiscoverySpider(object):
     """
     This class is responsible for fetching the given online identity by the
@@ -97,9 +167,53 @@ class EndpointDiscoverySpider(object):
       HTTP status code given by the page. An HTTP 301 or HTTP 308 will change
       the canonical URL. An HTTP 302 or HTTP 307 will keep the current URL as
       the canonical URL. Both cases will change the discovery URL anyway.
+
+    * Redirects are followed one hop at a time and the whole chain is kept
+      in redirect_chain. Coming back to an URL already visited raises an
+      exception right away. HTTP 301 and HTTP 308 hops are remembered for a
+      while, so later discoveries jump straight to the target without
+      sending a request. HTTP 302 and HTTP 307 hops are never remembered.
+
+    * Only the <head> of the HTML document is parsed, as it is downloaded.
+      The download stops as soon as the links are found or the head of the
+      document is over. A strict mode that parses the whole document using
+      html5lib is also available.
+
+    * Hosts that have been seen advertising their endpoints only in the
+      HTML document, or that don't support HEAD requests, get a single GET
+      request instead. See DiscoveryStrategy for the details.
+
+    * Discovered documents are cached according to the Cache-Control and
+      Expires headers sent by the server. While an entry is fresh, the URL
+      is not requested again. Once it expires, the spider revalidates it
+      using If-None-Match and If-Modified-Since, and an HTTP 304 response
+      reuses the cached endpoints instead of downloading the page again.
+
+    * Failures are remembered for a short while in a negative cache: pages
+      without an authorization endpoint nor rel="me" links, hosts that
+      can't be resolved or time out, and too many redirects. Until they
+      expire, discovering the same URL again fails right away.
+
+    * Discoveries of the same URL that run at the same time are coalesced:
+      only one of them sends requests, and the rest share its result. See
+      SingleFlight for the details.
+
+    * If a deadline is given, the whole discovery, with every redirect hop,
+      has to be done before it is over, or DeadlineExceeded is raised. The
+      profile is then remembered in the negative cache as a timeout.
+
+    The rules are implemented by discovery_flow(), which doesn't do any I/O
+    by itself. This class runs it using a blocking HTTPClient the first time
+    a property is read. AsyncEndpointDiscoverySpider runs the same flow on
+    an asyncio event loop.
     """
 
-    def __init__(self, discovery_url: str, redirection_limit: int=5):
+    def __init__(self, discovery_url: str, redirection_limit: int=5,
+                 client: HTTPClient=None, cache: DiscoveryCache=None,
+                 strict: bool=False, strategy: DiscoveryStrategy=None,
+                 redirects: RedirectMemo=None,
+                 failures: NegativeCache=None, flights: SingleFlight=None,
+                 deadline: Deadline=None):
         """ Initialize the discovery spider.
 
         This method won't perform any actual HTTP request. This has to be
@@ -114,20 +228,53 @@ class EndpointDiscoverySpider(object):
             request will be done unless it has happened as many times as
             the value of this variable. In such case, an exception will be
             raised.
+        :param client: the HTTP client used to send requests. By default,
+            the shared pooled client is used, so connections to the same
+            hosts are reused across spiders.
+        :param cache: the cache where discovered documents are kept. By
+            default, the shared discovery cache is used.
+        :param strict: if true, parse the whole document using html5lib
+            instead of the streaming link extractor. This is slower, but
+            finds links placed outside of the <head> element.
+        :param strategy: what the spider knows about each host, to decide
+            whether to skip the HEAD request. By default, the shared
+            discovery strategy is used.
+        :param redirects: where permanent redirections are remembered. By
+            default, the shared redirect memo is used.
+        :param failures: where failed discoveries are remembered. By
+            default, the shared negative cache is used.
+        :param flights: coalesces concurrent discoveries of the same URL. By
+            default, the shared coalescer is used.
+        :param deadline: the time budget of the discovery. If not given,
+            requests have no time limit.
         """
 
         # Parameters used during the fetching phase.
         self.__discovery_url = discovery_url
         self.__redirect_limit = redirection_limit
+        self.__client = client or http_client
+        self.__cache = discovery_cache if cache is None else cache
+        self.__strict = strict
+        self.__strategy = discovery_strategy if strategy is None else strategy
+        self.__redirects = redirect_memo if redirects is None else redirects
+        self.__failures = negative_cache if failures is None else failures
+        self.__flights = single_flight if flights is None else flights
+        self.deadline = deadline
 
         # Parameters set after fetching the data.
         self.__canonical_url = None
         self.__target_url = None
+        self.__redirect_chain = []
         self.__authorization_endpoint = None
         self.__token_endpoint = None
         self.__has_relme = False
         self.__fetched = False
 
+    @property
+    def discovery_url(self) -> str:
+        """ Returns the URL given to the spider. """
+        return self.__discovery_url
+
     @property
     def fetched(self) -> bool:
         """ Returns true if the endpoint has already been discovered. """
@@ -137,68 +284,190 @@ class EndpointDiscoverySpider(object):
     def canonical_url(self) -> str:
         """ Returns the canonical URL of the user. """
         if not self.__fetched:
-            self.__fetch()
+            self._fetch()
         return self.__canonical_url
 
     @property
     def target_url(self) -> str:
         """ Returns the URL where the data was finally fetched from. """
         if not self.__fetched:
-            self.__fetch()
+            self._fetch()
         return self.__target_url
 
+    @property
+    def redirect_chain(self) -> list:
+        """ Returns the redirections followed, as a list of tuples with the
+        source URL, the HTTP status code and the target URL of each hop. """
+        if not self.__fetched:
+            self._fetch()
+        return self.__redirect_chain
+
     @property
     def authorization_endpoint(self) -> str:
         """ Returns the authorization endpoint of the user. """
         if not self.__fetched:
-            self.__fetch()
+            self._fetch()
         return self.__authorization_endpoint
 
     @property
     def token_endpoint(self) -> str:
         """ Returns the token endpoint of the user. """
         if not self.__fetched:
-            self.__fetch()
+            self._fetch()
         return self.__token_endpoint
 
     def supports_relmeauth(self) -> bool:
         """ Returns true if this site has rel="me" links. """
         if not self.__fetched:
-            self.__fetch()
+            self._fetch()
         return self.__has_relme
 
-    def __fetch(self):
+    def _fetch(self):
         """ Discover the endpoints for this URL. """
-        fields = self.__discover(self.__discovery_url, self.__redirect_limit)
+        self._store(self.__flights.do(
+            self.__discovery_url,
+            lambda: self.__client.run(self.discovery_flow(), self.deadline)))
+
+    def _store(self, fields: dict):
+        """ Saves the result of the discovery. """
         self.__canonical_url = fields['canonical_url']
         self.__target_url = fields['discovery_url']
+        self.__redirect_chain = [tuple(hop) for hop in fields['redirects']]
         self.__authorization_endpoint = fields['authorization_endpoint']
         self.__token_endpoint = fields['token_endpoint']
         self.__has_relme = fields['relme']
         self.__fetched = True
 
-    @classmethod
-    def __discover(self, discovery_url: str, max_redirects: int=5) -> dict:
-        """ Send an HTTP request to discover the endpoints for this URL. """
-        request = requests.head(discovery_url, allow_redirects=False)
+    def discovery_flow(self):
+        """
+        Discovers the endpoints for this URL. This is a generator that
+        yields the HTTP requests to send instead of sending them, so that it
+        can be run by both HTTPClient and AsyncHTTPClient.
+
+        :return: a dict with the discovered fields.
+        """
+        return self.__discover(self.__discovery_url, self.__redirect_limit)
+
+    def __discover(self, discovery_url: str, max_redirects: int=5):
+        """ Discover the endpoints for this URL, unless it failed recently.
+        """
+        failure = self.__failures.get(discovery_url)
+        if failure is not None:
+            if failure.kind == 'no_endpoint':
+                return dict(failure.data)
+            if failure.kind == 'redirects':
+                raise RedirectionException(failure.message)
+            raise UnreachableProfileException(failure.message)
+
+        try:
+            data = yield from self.__follow(discovery_url, max_redirects)
+        except RedirectionException as e:
+            self.__failures.remember(discovery_url, 'redirects',
+                                     e.message)
+            raise
+        except DeadlineExceeded as e:
+            self.__failures.remember(discovery_url, 'timeout', e.message)
+            raise
+        except Exception as e:
+            kind = failure_kind(e)
+            if kind is None:
+                raise
+            if kind == 'dns':
+                message = 'Could not resolve the host of {}.'
+            else:
+                message = 'Timed out while fetching {}.'
+            message = message.format(discovery_url)
+            self.__failures.remember(discovery_url, kind, message)
+            raise UnreachableProfileException(message) from e
+
+        if not data['authorization_endpoint'] and not data['relme']:
+            # Nothing to log in with. Don't look again for a while.
+            self.__failures.remember(discovery_url, 'no_endpoint',
+                                     data=data)
+        return data
+
+    def __follow(self, discovery_url: str, max_redirects: int):
+        """ Follow the redirections from this URL and discover the endpoints
+        of the document at the end of the chain. """
+        url = canonical_url = discovery_url
+        permanent = True
+        chain = []
+        visited = {discovery_url}
+        while True:
+            # Permanent redirections seen before are followed right away.
+            hop = self.__redirects.get(url)
+            if hop is None:
+                data, response = yield from self.__discover_document(url)
+                if response is None:
+                    break
+                # Note we use urljoin because the location header may be a
+                # relative URL.
+                target_url = urljoin(url, response.headers['location'])
+                hop = (target_url, response.status_code)
+                if response.status_code not in TEMPORARY_REDIRECT_CODES:
+                    self.__redirects.remember(url, target_url,
+                                              response.status_code,
+                                              response.headers)
+            target_url, status_code = hop
+            chain.append((url, status_code, target_url))
+
+            if target_url in visited:
+                raise RedirectionException(
+                    'Redirect loop found at {}.'.format(target_url))
+            if len(chain) > max_redirects:
+                raise RedirectionException('Too many redirects.')
+            visited.add(target_url)
+
+            # The canonical URL follows permanent redirections, up to the
+            # first temporary one.
+            if status_code in TEMPORARY_REDIRECT_CODES:
+                permanent = False
+            elif permanent:
+                canonical_url = target_url
+            url = target_url
+
+        data['canonical_url'] = canonical_url
+        data['redirects'] = chain
+        return data
+
+    def __discover_document(self, discovery_url: str):
+        """ Send an HTTP request to discover the endpoints for this URL.
+
+        :return: a tuple with the discovered data, or None, and the response
+            if it was a redirection, or None.
+        """
+        cached = self.__cache.get(discovery_url)
+        if cached and cached.fresh:
+            return dict(cached.data), None
+
+        # Stale entries are revalidated: a 304 means the page hasn't changed.
+        validators = cached.validators if cached else {}
+        parser = self.__document_parser(discovery_url)
+        if self.__strategy.skip_head(discovery_url):
+            # This host is known to advertise its endpoints in the HTML, so
+            # go straight for the document. Headers are still looked at.
+            method = 'GET'
+            request = yield from self.__send(
+                Fetch('GET', discovery_url, headers=validators, parser=parser))
+        else:
+            method = 'HEAD'
+            request = yield from self.__send(
+                Fetch('HEAD', discovery_url, headers=validators))
+            if request.status_code in (405, 501):
+                # This host doesn't support HEAD requests at all.
+                self.__strategy.head_not_allowed(discovery_url)
+                method = 'GET'
+                request = yield from self.__send(
+                    Fetch('GET', discovery_url, headers=validators,
+                          parser=parser))
+
+        if request.status_code == 304 and cached:
+            self.__cache.refresh(discovery_url, cached, request.headers)
+            return dict(cached.data), None
 
         # Redirections have to be followed.
-        if request.status_code in (301, 302, 307, 308):
-            # Maybe we've gone too deep?
-            if not max_redirects > 0:
-                raise ValueError('Too many redirects.')
-
-            # Build the new discovery URL. Note we use urljoin because the
-            # location header may be a relative URL. Use the discovery URL
-            # to build the final value.
-            target_url = urljoin(discovery_url, request.headers['location'])
-
-            # Send a new request recursively.
-            new_discovery = self.__discover(target_url, max_redirects - 1)
-            if request.status_code in (302, 307):
-                # Not a permanent redirection: keep the canonical URL.
-                new_discovery['canonical_url'] = discovery_url
-            return new_discovery
+        if request.status_code in REDIRECT_CODES:
+            return None, request
 
         # This is the response object that will be returned to the user.
         data = {
@@ -211,47 +480,356 @@ class EndpointDiscoverySpider(object):
 
         # Find for a valid authorization_endpoint in the URL.
         if 'authorization_endpoint' in request.links:
-            auth_endpoint = request.links['authorization_endpoint']['url']
+            auth_endpoint = request.links['authorization_endpoint']
             absolute_auth_endpoint = urljoin(discovery_url, auth_endpoint)
             data['authorization_endpoint'] = absolute_auth_endpoint
 
         # Find for a valid token_endpoint in the URL.
         if 'token_endpoint' in request.links:
-            token_endpoint = request.links['token_endpoint']['url']
+            token_endpoint = request.links['token_endpoint']
             absolute_token_endpoint = urljoin(discovery_url, token_endpoint)
             data['token_endpoint'] = absolute_token_endpoint
+        in_headers = bool(data['authorization_endpoint'])
 
         if not data['authorization_endpoint'] or not data['token_endpoint']:
-            # We'll have to parse the contents of the document anyway.
-            # HEAD and GET status code and headers must be the same, so
-            # we don't have to do this circus again.
-            request = requests.get(discovery_url, stream=True)
-
-            # Note we have set streaming mode to avoid fetching large items.
-            content = b''
-            for chunk in request.iter_content(1024):
-                content += chunk
-                if len(content) >= 1024 * 1024:
-                    chunk.close()
-                    break
+            if method == 'HEAD':
+                # We'll have to parse the contents of the document anyway.
+                # HEAD and GET status code and headers must be the same, so
+                # we don't have to do this circus again.
+                request = yield from self.__send(
+                    Fetch('GET', discovery_url, headers=validators,
+                          parser=parser))
+                if request.status_code == 304 and cached:
+                    # The HTML document hasn't changed since it was parsed,
+                    # so reuse what was found in it. Headers still take
+                    # precedence.
+                    self.__fill_from_html(data, cached.data)
+                    self.__cache.refresh(discovery_url, cached,
+                                         request.headers, data)
+                    return data, None
+                if request.status_code in REDIRECT_CODES:
+                    return None, request
+
+            links = request.parsed or {}
+            auth = links.get('authorization_endpoint')
+            token = links.get('token_endpoint')
+            self.__fill_from_html(data, {
+                'authorization_endpoint': auth[0] if auth else None,
+                'token_endpoint': token[0] if token else None,
+                'relme': bool(links.get('me')),
+            })
+
+        if request.status_code == 200:
+            self.__strategy.record(discovery_url, in_headers,
+                                   bool(data['authorization_endpoint']))
+            self.__cache.store(discovery_url, data, request.headers)
+        return data, None
+
+    @staticmethod
+    def __send(fetch: Fetch):
+        """ Sends a request of the discovery, measuring how long it takes.
+        """
+        return (yield from timed_fetch(fetch, fetch.method.lower(),
+                                       REDIRECT_CODES))
+
+    def __document_parser(self, discovery_url: str):
+        """ Returns a factory for the parser of the GET response body. """
+        def build_parser(status_code, headers):
+            if status_code in REDIRECT_CODES or status_code == 304:
+                return None
+            links = parse_link_header(headers.get('link'))
+            if 'authorization_endpoint' in links and 'token_endpoint' in links:
+                # The headers are enough, there is no need to read the body.
+                return None
+            if self.__strict:
+                return Html5libLinkExtractor(discovery_url)
+            _, params = parse_media_type(headers.get('content-type'))
+            return LinkExtractor(discovery_url,
+                                 encoding=params.get('charset'))
+        return build_parser
+
+    @staticmethod
+    def __fill_from_html(data: dict, html_data: dict):
+        """ Completes data with the links found in a previous HTML parse. """
+        for field in ('authorization_endpoint', 'token_endpoint'):
+            if not data[field]:
+                data[field] = html_data[field]
+        data['relme'] = html_data['relme']
+
+
+class AsyncEndpointDiscoverySpider(EndpointDiscoverySpider):
+    """
+    Non-blocking version of the EndpointDiscoverySpider. It follows exactly
+    the same discovery rules, but the requests are sent when discover() is
+    awaited, so many discoveries can run at once on the same event loop:
 
-            soup = BeautifulSoup(content, 'html5lib')
+        spiders = [AsyncEndpointDiscoverySpider(url) for url in urls]
+        await asyncio.gather(*(spider.discover() for spider in spiders))
 
-            # Seek for an authorization endpoint.
-            tag = soup.find('link', rel='authorization_endpoint')
-            if tag and not data['authorization_endpoint']:
-                endpoint = urljoin(discovery_url, tag['href'])
-                data['authorization_endpoint'] = endpoint
+    After discover() returns, the properties of the spider can be read as
+    usual. Reading them before raises a RuntimeError.
+    """
 
-            # Seek for a token endpoint
-            tag = soup.find('link', rel='token_endpoint')
-            if tag and not data['token_endpoint']:
-                endpoint = urljoin(discovery_url, tag['href'])
-                data['token_endpoint'] = endpoint
+    def __init__(self, discovery_url: str, redirection_limit: int=5,
+                 client: AsyncHTTPClient=None, cache: DiscoveryCache=None,
+                 strict: bool=False, strategy: DiscoveryStrategy=None,
+                 redirects: RedirectMemo=None,
+                 failures: NegativeCache=None, flights: SingleFlight=None,
+                 deadline: Deadline=None):
+        super().__init__(discovery_url, redirection_limit, cache=cache,
+                         strict=strict, strategy=strategy,
+                         redirects=redirects, failures=failures,
+                         flights=flights, deadline=deadline)
+        self.__client = client or async_http_client
+        self.__flights = single_flight if flights is None else flights
+
+    async def discover(self) -> dict:
+        """ Discovers the endpoints for this URL.
+
+        :return: a dict with the discovered fields: canonical_url,
+            discovery_url, authorization_endpoint, token_endpoint, relme.
+        """
+        fields = await self.__flights.do_async(
+            self.discovery_url,
+            lambda: self.__client.run(self.discovery_flow(), self.deadline))
+        self._store(fields)
+        return fields
 
-            # Seek for additional rel="me" links.
-            tag = soup.find('link', rel='me')
-            if tag:
-                data['relme'] = True
+    def _fetch(self):
+        raise RuntimeError('The endpoints have not been discovered yet.')
 
-        return data
+
+class RelMeVerifier(object):
+    """
+    Verifies the rel="me" links of a profile for RelMeAuth. Every <link> and
+    <a> in the profile page with rel="me", and the rel="me" Link header, is
+    a candidate. A candidate is verified if the page it points to has a
+    rel="me" link back to the profile.
+
+    * The whole profile page is parsed, since rel="me" anchors usually are
+      in the body. Only http and https links other than the profile itself
+      are candidates, up to max_links of them.
+
+    * Candidates are fetched in parallel, no more than concurrency at a
+      time, so a profile with many links doesn't take as long as fetching
+      every one of them in turn. Their redirections are followed, since
+      silos tend to redirect their profile URLs.
+
+    * A backlink may point to any of the aliases of the profile, such as
+      the URL the user typed in before it was redirected.
+
+    * The links of a profile and the result of checking each of them are
+      remembered in a RelMeCache, so logging in again doesn't fetch them
+      again. A candidate that can't be fetched, or that doesn't answer
+      before the deadline, is not verified, but it is not remembered.
+
+    The checks are implemented by links_flow() and backlink_flow(), which
+    don't do any I/O by themselves. This class runs them using a blocking
+    HTTPClient, and a thread pool for the candidates, the first time a
+    property is read. AsyncRelMeVerifier runs them on an event loop.
+    """
+
+    def __init__(self, profile_url: str, aliases=(),
+                 client: HTTPClient=None, cache: RelMeCache=None,
+                 concurrency: int=4, max_links: int=20,
+                 redirection_limit: int=5, deadline: Deadline=None):
+        """ Initialize the verifier. No request is sent here.
+
+        :param profile_url: the URL of the profile page, once redirected.
+        :param aliases: other URLs of the profile that backlinks may point
+            to, such as the one typed in by the user.
+        :param client: the HTTP client used to send requests. By default,
+            the shared pooled client is used.
+        :param cache: where the results are remembered. By default, the
+            shared rel="me" cache is used.
+        :param concurrency: how many candidates to fetch at once.
+        :param max_links: how many candidates to check at most.
+        :param redirection_limit: how many redirections of each candidate
+            to follow.
+        :param deadline: the time budget of the whole verification.
+        """
+        self.profile_url = profile_url
+        self.aliases = (profile_url,) + tuple(aliases)
+        self.__client = client or http_client
+        self.__cache = relme_cache if cache is None else cache
+        self.concurrency = concurrency
+        self.max_links = max_links
+        self.redirection_limit = redirection_limit
+        self.deadline = deadline
+        self.__links = []
+        self.__verified_links = []
+        self.__fetched = False
+
+    @property
+    def links(self) -> list:
+        """ Returns the rel="me" links of the profile that were checked. """
+        if not self.__fetched:
+            self._fetch()
+        return self.__links
+
+    @property
+    def verified_links(self) -> list:
+        """ Returns the rel="me" links that link back to the profile. """
+        if not self.__fetched:
+            self._fetch()
+        return self.__verified_links
+
+    def links_back(self, url: str) -> bool:
+        """ Returns true if a URL points to the profile. """
+        key = profile_key(url)
+        return any(key == profile_key(alias) for alias in self.aliases)
+
+    def links_flow(self):
+        """
+        Finds the rel="me" links of the profile. This is a generator that
+        yields the HTTP requests to send instead of sending them, so that it
+        can be run by both HTTPClient and AsyncHTTPClient.
+
+        :return: the list of candidates.
+        """
+        links = self.__cache.links(self.profile_url)
+        if links is not None:
+            return links
+        request = yield from timed_fetch(
+            Fetch('GET', self.profile_url,
+                  parser=self.__link_parser(self.profile_url)), 'relme')
+        if request.status_code != 200:
+            return []
+        links = []
+        for link in self.__found_links(self.profile_url, request):
+            if urlsplit(link).scheme in ('http', 'https') and \
+                    not self.links_back(link) and link not in links:
+                links.append(link)
+        links = links[:self.max_links]
+        self.__cache.remember_links(self.profile_url, links)
+        return links
+
+    def backlink_flow(self, link: str):
+        """
+        Checks whether a candidate links back to the profile. Like
+        links_flow(), this is a generator that yields the requests to send.
+
+        :return: True if the page at the link has a rel="me" link to the
+            profile.
+        """
+        verified = self.__cache.verified(self.profile_url, link)
+        if verified is not None:
+            return verified
+        url, visited = link, {link}
+        for _ in range(self.redirection_limit + 1):
+            request = yield from timed_fetch(
+                Fetch('GET', url, parser=self.__link_parser(url)), 'relme',
+                REDIRECT_CODES)
+            if request.status_code in REDIRECT_CODES:
+                url = urljoin(url, request.headers.get('location', ''))
+                if url in visited:
+                    break
+                visited.add(url)
+                continue
+            verified = request.status_code == 200 and any(
+                self.links_back(found)
+                for found in self.__found_links(url, request))
+            self.__cache.remember_backlink(self.profile_url, link, verified)
+            return verified
+        return False
+
+    def _fetch(self):
+        """ Finds and checks the links. """
+        try:
+            links = self.__client.run(self.links_flow(), self.deadline)
+        except DummyAuthException:
+            raise
+        except Exception as e:
+            raise UnreachableProfileException(
+                self.unreachable_message()) from e
+        if len(links) > 1 and self.concurrency > 1:
+            workers = min(self.concurrency, len(links))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(self.__check, links))
+        else:
+            results = [self.__check(link) for link in links]
+        self._store(links, results)
+
+    def __check(self, link: str) -> bool:
+        try:
+            return self.__client.run(self.backlink_flow(link), self.deadline)
+        except Exception:
+            # Any page on the Internet may be a candidate. One that fails
+            # just doesn't verify.
+            return False
+
+    def _store(self, links: list, results: list):
+        """ Saves the result of the verification. """
+        self.__links = list(links)
+        self.__verified_links = [link for link, verified
+                                 in zip(links, results) if verified]
+        self.__fetched = True
+
+    def unreachable_message(self) -> str:
+        """ Returns the error shown when the profile can't be fetched. """
+        return 'Could not fetch the rel="me" links of {}.'.format(
+            self.profile_url)
+
+    @staticmethod
+    def __found_links(url: str, request) -> list:
+        """ Returns the rel="me" links of a response. """
+        links = list((request.parsed or {}).get('me', []))
+        if 'me' in request.links:
+            links.insert(0, urljoin(url, request.links['me']))
+        return links
+
+    @staticmethod
+    def __link_parser(url: str):
+        """ Returns a factory for the parser of a page with rel="me" links.
+        """
+        def build_parser(status_code, headers):
+            if status_code != 200:
+                return None
+            _, params = parse_media_type(headers.get('content-type'))
+            return LinkExtractor(url, wanted=('me',), head_only=False,
+                                 collect_all=True,
+                                 encoding=params.get('charset'))
+        return build_parser
+
+
+class AsyncRelMeVerifier(RelMeVerifier):
+    """
+    Non-blocking version of the RelMeVerifier. The links are checked when
+    verify() is awaited, using as many tasks as the concurrency allows.
+    After that, the properties of the verifier can be read as usual.
+    """
+
+    def __init__(self, profile_url: str, aliases=(),
+                 client: AsyncHTTPClient=None, cache: RelMeCache=None,
+                 concurrency: int=4, max_links: int=20,
+                 redirection_limit: int=5, deadline: Deadline=None):
+        super().__init__(profile_url, aliases, cache=cache,
+                         concurrency=concurrency, max_links=max_links,
+                         redirection_limit=redirection_limit,
+                         deadline=deadline)
+        self.__client = client or async_http_client
+
+    async def verify(self) -> list:
+        """ Finds and checks the links. Returns the verified ones. """
+        try:
+            links = await self.__client.run(self.links_flow(), self.deadline)
+        except DummyAuthException:
+            raise
+        except Exception as e:
+            raise UnreachableProfileException(
+                self.unreachable_message()) from e
+        limit = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def check(link):
+            async with limit:
+                try:
+                    return await self.__client.run(self.backlink_flow(link),
+                                                   self.deadline)
+                except Exception:
+                    return False
+        results = await asyncio.gather(*(check(link) for link in links))
+        self._store(links, results)
+        return self.verified_links
+
+    def _fetch(self):
+        raise RuntimeError('The rel="me" links have not been verified yet.')
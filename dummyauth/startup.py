@@ -0,0 +1,79 @@
+import gc
+import importlib
+import threading
+from flask import current_app
+
+# The startup profiles understood by create_app().
+PROFILES = ('lazy', 'preload')
+
+# Third party modules that only the spider needs, which take most of the
+# time spent importing the application.
+SPIDER_DEPENDENCIES = ('requests', 'urllib3', 'bs4', 'html5lib')
+
+__lock = threading.Lock()
+
+
+def init_app(app, profile: str):
+    """
+    Prepares an app according to a startup profile:
+
+    * lazy: nothing is done until it is needed. The spider, and requests,
+      bs4 and html5lib with it, are imported by the first login. This is
+      the fastest way to start, for tests and command line tools.
+
+    * preload: everything is imported and built right away: the spider and
+      its dependencies, the templates and the TLS context. Prefork servers
+      such as uWSGI load the app once in the master process and then fork
+      the workers, which share all of this copy-on-write instead of each
+      one building it again on its first request.
+    """
+    if profile not in PROFILES:
+        raise ValueError('Unknown startup profile: {}'.format(profile))
+    app.extensions['dummyauth.startup'] = profile
+    if profile == 'preload':
+        preload(app)
+
+
+def load_spider(app=None):
+    """ Returns the spider module, importing it and configuring its HTTP
+    clients using the settings of the app the first time. """
+    app = app or current_app._get_current_object()
+    spider = app.extensions.get('dummyauth.spider')
+    if spider is not None:
+        return spider
+    with __lock:
+        spider = app.extensions.get('dummyauth.spider')
+        if spider is None:
+            from dummyauth import spider
+            from dummyauth.aio import async_http_client
+            from dummyauth.client import http_client
+            http_client.init_app(app)
+            async_http_client.init_app(app)
+            app.extensions['dummyauth.spider'] = spider
+    return spider
+
+
+def preload(app):
+    """ Imports and builds everything the workers of a prefork server would
+    otherwise build on their own. """
+    load_spider(app)
+    for name in SPIDER_DEPENDENCIES:
+        importlib.import_module(name)
+
+    # Compile every template.
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    # Loading the CA certificates takes a while. The pooled connections
+    # themselves are opened by each worker, since sockets can't be shared.
+    from dummyauth.aio import async_http_client
+    async_http_client.ssl_context
+
+    # Codecs and tables loaded on first use by the profile URL validator.
+    'example.com'.encode('idna')
+
+    # Keep the collector of the workers from touching the shared objects,
+    # which would copy the pages they are in.
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
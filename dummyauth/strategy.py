@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+
+class HostStats(object):
+    """ What the spider has learnt about how a host advertises endpoints. """
+
+    __slots__ = ('in_headers', 'in_html', 'html_streak', 'head_not_allowed',
+                 'heads_sent', 'heads_skipped')
+
+    def __init__(self):
+        self.in_headers = 0
+        self.in_html = 0
+        self.html_streak = 0
+        self.head_not_allowed = False
+        self.heads_sent = 0
+        self.heads_skipped = 0
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class DiscoveryStrategy(object):
+    """
+    Learns, for each host, whether it advertises the endpoints using Link
+    headers or using HTML markup, to decide how the spider should start the
+    discovery the next time.
+
+    The IndieAuth spec makes the spider send a HEAD request first and only
+    GET the document if the headers are not enough. For hosts that only
+    ever put their endpoints in the HTML, that HEAD is a wasted round trip:
+    once a host has been seen advertising them only in the HTML a number of
+    times in a row, the spider goes straight to a single GET, looks at its
+    headers and only parses the body if the headers were not enough. Hosts
+    that reject HEAD requests with 405 or 501 get the same treatment.
+
+    Since the GET response carries the same headers as the HEAD response,
+    the strategy keeps learning: as soon as a host starts sending Link
+    headers, the spider goes back to sending HEAD requests to it.
+    """
+
+    def __init__(self, max_hosts: int=1024, html_threshold: int=2):
+        """ Initialize the strategy.
+
+        :param max_hosts: how many hosts to remember. When full, the least
+            recently seen host is forgotten.
+        :param html_threshold: how many discoveries in a row must find the
+            endpoints only in the HTML before HEAD requests are skipped. A
+            value of zero disables skipping, except for hosts that don't
+            support HEAD requests.
+        """
+        self.__lock = threading.Lock()
+        self.__hosts = OrderedDict()
+        self.max_hosts = max_hosts
+        self.html_threshold = html_threshold
+
+    def init_app(self, app):
+        """ Configure the strategy using the settings of a Flask app. """
+        self.max_hosts = app.config['DISCOVERY_STRATEGY_HOSTS']
+        self.html_threshold = app.config['DISCOVERY_HTML_THRESHOLD']
+        self.clear()
+
+    @staticmethod
+    def host(url: str) -> str:
+        """ Returns the key used to identify the host of a URL. """
+        return urlsplit(url).netloc.lower()
+
+    def __stats(self, url: str) -> HostStats:
+        # Must be called with the lock held.
+        host = self.host(url)
+        stats = self.__hosts.get(host)
+        if stats is None:
+            stats = self.__hosts[host] = HostStats()
+            while len(self.__hosts) > max(self.max_hosts, 1):
+                self.__hosts.popitem(last=False)
+        else:
+            self.__hosts.move_to_end(host)
+        return stats
+
+    def skip_head(self, url: str) -> bool:
+        """ Returns true if discovery on this URL should start with a GET.
+
+        The decision is recorded in the statistics of the host, so this
+        must be called exactly once per discovery request.
+        """
+        with self.__lock:
+            stats = self.__stats(url)
+            skip = stats.head_not_allowed or (
+                self.html_threshold > 0 and
+                stats.html_streak >= self.html_threshold)
+            if skip:
+                stats.heads_skipped += 1
+            else:
+                stats.heads_sent += 1
+            return skip
+
+    def head_not_allowed(self, url: str):
+        """ Notes that the host of this URL rejects HEAD requests. """
+        with self.__lock:
+            self.__stats(url).head_not_allowed = True
+
+    def record(self, url: str, in_headers: bool, in_html: bool):
+        """ Notes where the authorization endpoint of this URL was found. """
+        if not in_headers and not in_html:
+            return
+        with self.__lock:
+            stats = self.__stats(url)
+            if in_headers:
+                stats.in_headers += 1
+                stats.html_streak = 0
+            else:
+                stats.in_html += 1
+                stats.html_streak += 1
+
+    def stats(self) -> dict:
+        """ Returns what has been learnt so far, keyed by host. """
+        with self.__lock:
+            return {host: stats.as_dict()
+                    for host, stats in self.__hosts.items()}
+
+    def clear(self):
+        """ Forget everything. """
+        with self.__lock:
+            self.__hosts.clear()
+
+
+# The strategy used by default. Flask apps configure it using init_app().
+discovery_strategy = DiscoveryStrategy()
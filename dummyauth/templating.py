@@ -0,0 +1,78 @@
+import os
+import tempfile
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from jinja2 import FileSystemBytecodeCache
+
+
+class SharedBytecodeCache(FileSystemBytecodeCache):
+    """
+    A bytecode cache for the templates kept in a directory that every worker
+    shares, so that a template compiled by one of them, or by the
+    precompile-templates command, doesn't have to be compiled by the rest.
+
+    Jinja stores the checksum of the source of each template next to its
+    bytecode, so a template that has changed is compiled again instead of
+    loaded. Files are written to a temporary file and then renamed, so a
+    worker never reads the bytecode that another one is still writing. If
+    the directory can't be written, templates are compiled as usual.
+    """
+
+    def dump_bytecode(self, bucket):
+        try:
+            fd, temp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                bucket.write_bytecode(fp)
+            os.replace(temp, self._get_cache_filename(bucket))
+        except OSError:
+            try:
+                os.unlink(temp)
+            except OSError:
+                pass
+
+
+def init_app(app):
+    """ Uses the bytecode cache in TEMPLATE_CACHE_DIR, if set, and adds the
+    precompile-templates command. """
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = SharedBytecodeCache(directory)
+    app.cli.add_command(precompile_command)
+
+
+def precompile(app) -> dict:
+    """ Compiles every template of an app into its bytecode cache.
+
+    :return: a dict that tells, for each template, whether it had to be
+        compiled or its bytecode was up to date.
+    """
+    env = app.jinja_env
+    cache = env.bytecode_cache
+    results = {}
+    for name in env.list_templates():
+        status = 'compiled'
+        if cache is not None:
+            source, filename, _ = env.loader.get_source(env, name)
+            bucket = cache.get_bucket(env, name, filename, source)
+            if bucket.code is not None:
+                status = 'up to date'
+        env.get_template(name)
+        results[name] = status
+    return results
+
+
+@click.command('precompile-templates')
+@with_appcontext
+def precompile_command():
+    """ Compile the templates into the bytecode cache in TEMPLATE_CACHE_DIR.
+    """
+    if not current_app.config['TEMPLATE_CACHE_DIR']:
+        raise click.UsageError('Set TEMPLATE_CACHE_DIR to the directory '
+                               'where the bytecode cache is kept.')
+    for name, status in sorted(precompile(current_app).items()):
+        click.echo('{}: {}'.format(name, status))
@@ -1,11 +1,24 @@
 import time
-from flask import redirect, render_template, request, session, url_for
+from flask import Response, abort, current_app, jsonify, redirect, \
+    render_template, request, session, url_for
 from flask.views import View
-from dummyauth import exceptions
+from dummyauth import exceptions, startup
+from dummyauth.breaker import circuit_breaker
+from dummyauth.bulkhead import bulkhead
+from dummyauth.deadline import Deadline
 from dummyauth.forms import LoginForm
-from dummyauth.spider import AuthorizationCodeValidator, EndpointDiscoverySpider
+from dummyauth.metrics import CONTENT_TYPE, instrument_view, metrics, \
+    set_outcome
+from dummyauth.prefetch import prefetcher
+from dummyauth.strategy import discovery_strategy
 from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
 
+# Where the ASGI application, or discover_view, leave what they have already
+# fetched for a request, before these views handle it. See dummyauth.asgi.
+DISCOVERY_KEY = 'dummyauth.discovery'
+RELME_KEY = 'dummyauth.relme'
+VERIFICATION_KEY = 'dummyauth.verification'
+
 def __update_qs(url: str, args: dict) -> str:
     """ Modifies the querystring of the given URL adding new parameters. """
     scheme, netloc, path, qs, fragment = urlsplit(url)
@@ -14,22 +27,129 @@ def __update_qs(url: str, args: dict) -> str:
     qs = urlencode(querystring)
     return urlunsplit((scheme, netloc, path, qs, fragment))
 
+def __prefetched(key: str):
+    """ Returns what was fetched beforehand for this request, if anything.
+    If fetching it failed, the error is raised here instead. """
+    value = request.environ.get(key)
+    if isinstance(value, Exception):
+        raise value
+    return value
+
+def discovery_options(config) -> dict:
+    """ Returns the settings of the discovery of a profile. """
+    return {
+        'strict': config['DISCOVERY_STRICT_PARSER'],
+        'deadline': Deadline.from_config(config, 'DEADLINE_DISCOVERY'),
+    }
+
+def relme_options(spider, config) -> dict:
+    """ Returns the settings of the verification of the rel="me" links of
+    a discovered profile. """
+    return {
+        'profile_url': spider.target_url,
+        'aliases': (spider.discovery_url, spider.canonical_url),
+        'concurrency': config['RELME_CONCURRENCY'],
+        'max_links': config['RELME_MAX_LINKS'],
+        'deadline': Deadline.from_config(config, 'DEADLINE_RELME'),
+    }
+
+def verification_options() -> dict:
+    """ Returns the settings of the verification of the code received by
+    the callback. Needs the request and the session. """
+    return {
+        'authorization_endpoint': session['login.endpoint'],
+        'code': request.args['code'],
+        'client_id': url_for('login', _external=True),
+        'redirect_uri': url_for('callback', _external=True),
+        'deadline': Deadline.from_config(current_app.config,
+                                         'DEADLINE_VERIFY'),
+        'max_body_size': current_app.config['VERIFY_MAX_BODY_SIZE'],
+    }
+
+def __prefetch_login(app, url: str) -> dict:
+    """ Does the discovery of a login, and the check of its rel="me"
+    links, in the background. Returns what it fetched, or the errors it got,
+    the same way the ASGI application leaves them in the environ. """
+    spider_module = startup.load_spider(app)
+    fetched = {}
+    try:
+        slot = bulkhead.acquire(url)
+    except exceptions.Overloaded:
+        # Leave it to the login, which may find a place by then.
+        return fetched
+    try:
+        spider = spider_module.EndpointDiscoverySpider(
+            url, **discovery_options(app.config))
+        fetched[DISCOVERY_KEY] = spider
+        if spider.authorization_endpoint or not spider.supports_relmeauth():
+            return fetched
+        verifier = spider_module.RelMeVerifier(
+            **relme_options(spider, app.config))
+        fetched[RELME_KEY] = verifier
+        verifier.verified_links
+    except Exception as e:
+        fetched[RELME_KEY if RELME_KEY in fetched else DISCOVERY_KEY] = e
+    finally:
+        bulkhead.release(slot)
+    return fetched
+
+@instrument_view('discover_view')
+def discover_view():
+    """ Starts discovering a profile URL while the user is still filling in
+    the login form, so that the login finds it done. Takes the login form,
+    CSRF token included, so that other sites can't make it fetch anything.
+    """
+    if not prefetcher.enabled:
+        abort(404)
+    form = LoginForm(request.form)
+    if not form.validate():
+        set_outcome('invalid')
+        return jsonify(error=form.domain.errors[0]), 400
+    app = current_app._get_current_object()
+    status = prefetcher.start(form.domain.data, __prefetch_login, app,
+                              form.domain.data)
+    set_outcome(status)
+    response = jsonify(me=form.domain.data, status=status)
+    response.headers['Cache-Control'] = 'no-store'
+    return response, 503 if status == 'busy' else 202
+
+@instrument_view('login_view')
 def login_view():
     """ Asks the user for a domain to sign in with. """
     form = LoginForm(request.form)
     if request.method == 'POST' and form.validate():
+        if DISCOVERY_KEY not in request.environ:
+            # Use what discover_view has fetched for this URL, if anything.
+            request.environ.update(prefetcher.result(form.domain.data) or {})
+
         # Fetch the authorization endpoint for this user.
-        spider = EndpointDiscoverySpider(form.domain.data)
+        spider_module = startup.load_spider()
+        spider = __prefetched(DISCOVERY_KEY)
+        if spider is None:
+            # Turn the login down now if too many are waiting already.
+            bulkhead.enter(form.domain.data)
+            spider = spider_module.EndpointDiscoverySpider(
+                form.domain.data, **discovery_options(current_app.config))
         if spider.authorization_endpoint:
             # The site has declared an explicit authorization endpoint.
             login_endpoint = spider.authorization_endpoint
         elif spider.supports_relmeauth():
             # The site has not declared an authorization endpoint but has
             # rel="me" links. We can let a third party authorization provider
-            # handle the login process.
+            # handle the login process, as long as some of them link back.
+            verifier = __prefetched(RELME_KEY)
+            if verifier is None:
+                verifier = spider_module.RelMeVerifier(
+                    **relme_options(spider, current_app.config))
+            if not verifier.verified_links:
+                form.domain.errors.append(
+                    'None of the rel="me" links found here link back')
+                set_outcome('no_backlink')
+                return render_template('welcome.html', form=form)
             login_endpoint = 'https://indieauth.com/auth'
         else:
             form.domain.errors.append('No authorization links found here')
+            set_outcome('no_endpoint')
             return render_template('welcome.html', form=form)
 
         # An authorization endpoint was found. Prepare the request.
@@ -47,11 +167,14 @@ def login_view():
 
         # Build the login URL and send the user there.
         login_url = __update_qs(login_endpoint, request_payload)
+        set_outcome('redirect')
         return redirect(login_url), 302
 
     # Catch-all when nothing of the above worked.
+    set_outcome('form')
     return render_template('welcome.html', form=form)
 
+@instrument_view('login_callback')
 def login_callback():
     """ Called as a callback after login, validates the received code. """
     for session_param in ('login.endpoint', 'login.state'):
@@ -65,35 +188,50 @@ def login_callback():
         raise exceptions.InvalidAuthorizationResponseException(error)
 
     # Build a validator using the required parameters.
-    validator_params = {
-        'authorization_endpoint': session['login.endpoint'],
-        'code': request.args['code'],
-        'client_id': url_for('login', _external=True),
-        'redirect_uri': url_for('callback', _external=True)
-    }
-    validator = AuthorizationCodeValidator(**validator_params)
+    validator = __prefetched(VERIFICATION_KEY)
+    if validator is None:
+        bulkhead.enter(session['login.endpoint'])
+        spider_module = startup.load_spider()
+        validator = spider_module.AuthorizationCodeValidator(
+            **verification_options())
 
     # Check the authenticity of the code.
     if validator.valid:
         # Clear session data to inhabilitate repetition attacks.
         session['login.endpoint'] = session['login.state'] = None
         session['login.profile'] = validator.profile_url
+        set_outcome('valid')
         return redirect(url_for('success')), 302
     else:
         session['login.error'] = 'validation_error'
         session['login.message'] = validator.error
+        set_outcome('invalid')
         return redirect(url_for('failure')), 302
 
 def handle_error_response(exception: exceptions.DummyAuthException=None):
     """ Handles an error response. """
     if exception:
-        error = 'exception'
-        message = exception.message
+        if isinstance(exception, exceptions.DeadlineExceeded):
+            error = 'deadline'
+        elif isinstance(exception, exceptions.CircuitOpen):
+            error = 'unavailable'
+        elif isinstance(exception, exceptions.Overloaded):
+            error = 'overloaded'
+        else:
+            error = 'exception'
+        response = render_template('failure.html', error=error,
+                                   message=exception.message), \
+            exception.status_code
+        retry_after = getattr(exception, 'retry_after', None)
+        if retry_after is not None:
+            response += ({'Retry-After': str(max(int(retry_after), 1))},)
+        return response
     else:
         error = session.get('login.error', 'generic_error')
+        message = None
         if error == 'validation_error':
             message = session.get('login.message')
-    return render_template('failure.html', errror=error, message=message)
+    return render_template('failure.html', error=error, message=message)
 
 def display_profile():
     """ If the user is logged in, it will display the profile URL. """
@@ -107,3 +245,16 @@ def clear_session():
     """ Clear user data and redirect to the login view. """
     session.clear()
     return redirect(url_for('login')), 302
+
+def discovery_stats():
+    """ Show what the discovery strategy knows about each host. Debug only. """
+    return jsonify(discovery_strategy.stats())
+
+def circuit_stats():
+    """ Show the circuit of each host the clients have sent requests to.
+    Debug only. """
+    return jsonify(circuit_breaker.stats())
+
+def metrics_view():
+    """ Expose the metrics of every worker in the Prometheus text format. """
+    return Response(metrics.render(), content_type=CONTENT_TYPE)
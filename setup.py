@@ -10,4 +10,9 @@ setup(
     keywords = "indieauth indieweb login",
     url = "https://github.com/danirod/dummyauth",
     packages=['dummyauth', 'test'],
+    entry_points={
+        'console_scripts': [
+            'dummyauth-discover = dummyauth.batch:main',
+        ],
+    },
 )
@@ -0,0 +1,192 @@
+"""
+Stand-ins shared by the tests: a local HTTP server that answers for the
+sites the clients fetch, and a way to run a coroutine without
+asyncio.run(), which is missing from Python 3.6.
+"""
+import asyncio
+import threading
+import time
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+# Pause between the pieces of a body written in pieces, so that each one
+# leaves in its own TCP segment.
+PIECE_PAUSE = 0.01
+
+
+def run_coroutine(coroutine):
+    """ Runs a coroutine on an event loop of its own, like asyncio.run(). """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def normalize_url(url: str) -> str:
+    """ Returns a URL the way a StandInServer sees it, so that routes can
+    be registered for URLs as they are typed. """
+    parts = urlsplit(url)
+    url = '{}://{}{}'.format(parts.scheme, parts.netloc, parts.path or '/')
+    return url + '?' + parts.query if parts.query else url
+
+
+class SentRequest(namedtuple('SentRequest', 'method url path headers body')):
+    """ A request received by a StandInServer, with the attributes of the
+    ones recorded by httpretty. """
+
+    __slots__ = ()
+
+    @property
+    def parsed_body(self) -> dict:
+        return parse_qs(self.body.decode('utf-8'))
+
+
+class Response(object):
+    """
+    What a StandInServer answers to a request.
+
+    :param delay: seconds to wait before answering.
+    :param pieces: if set, the body is written in pieces of this size, each
+        one on its own. With a Transfer-Encoding: chunked header, each piece
+        is a chunk.
+    """
+
+    def __init__(self, status: int=200, headers: dict=None, body=b'',
+                 delay: float=0, pieces: int=None):
+        self.status = status
+        self.headers = headers or {}
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.delay = delay
+        self.pieces = pieces
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """ Answers what the server says, and records the request there. """
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and pieces of the body are written separately. Without this,
+    # they would wait for the delayed ACK of the client.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def respond(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        url = '{}://{}{}'.format(server.scheme, self.headers['Host'],
+                                 self.path)
+        request = SentRequest(self.command, url, self.path, self.headers,
+                              body)
+        with server.lock:
+            server.requests.append(request)
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight,
+                                       server.in_flight)
+        try:
+            response = server.answer(request)
+            time.sleep(response.delay)
+            self.write(response)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    do_GET = do_HEAD = do_POST = respond
+
+    def write(self, response: Response):
+        chunked = response.headers.get('Transfer-Encoding') == 'chunked'
+        self.send_response(response.status)
+        for name, value in response.headers.items():
+            self.send_header(name, value)
+        if not chunked:
+            self.send_header('Content-Length', str(len(response.body)))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        body = response.body
+        size = response.pieces or len(body) or 1
+        for i in range(0, len(body), size):
+            piece = body[i:i + size]
+            if chunked:
+                piece = b'%x\r\n%s\r\n' % (len(piece), piece)
+            self.wfile.write(piece)
+            if response.pieces:
+                time.sleep(PIECE_PAUSE)
+        if chunked:
+            self.wfile.write(b'0\r\n\r\n')
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    """
+    A local HTTP server that stands in for the sites the clients fetch. It
+    answers each request with the response registered for its method and
+    URL, or 404, and records the requests it gets.
+
+    The URL of a request is built from its Host header, so that a server
+    can stand in for any host the clients are pointed at.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, scheme: str='http', handler=StandInHandler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self.scheme = scheme
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.requests = []
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def url(self, path: str='/') -> str:
+        return '{}://127.0.0.1:{}{}'.format(self.scheme, self.server_port,
+                                            path)
+
+    def start(self):
+        """ Serves requests in a thread of its own until stopped. """
+        thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def register(self, method: str, url: str, status: int=200,
+                 headers: dict=None, body='', **kwargs):
+        """ Registers the response to the requests for a URL. Takes the
+        arguments of Response. """
+        self.routes[(method, normalize_url(url))] = Response(
+            status, headers, body, **kwargs)
+
+    def page(self, path: str, body='', status: int=200, headers: dict=None,
+             **kwargs):
+        """ Registers an HTML page of this server, for GET and HEAD. """
+        headers = dict({'Content-Type': 'text/html; charset=utf-8'},
+                       **(headers or {}))
+        for method in ('GET', 'HEAD'):
+            self.register(method, self.url(path), status, headers, body,
+                          **kwargs)
+
+    def answer(self, request: SentRequest) -> Response:
+        """ Returns the response to a request. Override it to answer in a
+        way that depends on the request. """
+        return self.routes.get((request.method, request.url),
+                               Response(404))
+
+    def requested(self) -> list:
+        """ Returns the method and path of every request received. """
+        return [(request.method, request.path) for request in self.requests]
+
+    def get_request(self):
+        with self.lock:
+            self.connections += 1
+        return super().get_request()
@@ -0,0 +1,176 @@
+import json
+import re
+import sure
+from dummyauth import create_app
+from dummyauth.asgi import ASGIApp, build_environ
+from dummyauth.cache import discovery_cache, negative_cache
+from dummyauth.forms import normalize_profile_url, profile_url_memo
+from standin import Response, StandInServer, run_coroutine
+from unittest import TestCase
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+
+class ProviderServer(StandInServer):
+    """ Stands in for the profile of a user and its authorization endpoint.
+    """
+
+    def answer(self, request):
+        if request.method == 'POST':
+            good = request.parsed_body['code'] == ['good']
+            body = json.dumps({'me': self.url('/alice')} if good else
+                              {'error': 'invalid_grant'})
+            return Response(200 if good else 400,
+                            {'Content-Type': 'application/json'}, body)
+        if request.path == '/loop':
+            return Response(301, {'Location': '/loop'})
+        return Response(200, {'Link': '<{0}>; rel="authorization_endpoint", '
+                                      '<{0}>; rel="token_endpoint"'
+                                      .format(self.url('/auth'))})
+
+
+class ASGIClient(object):
+    """ Sends requests to an ASGI app, keeping the cookies it sets. """
+
+    def __init__(self, app):
+        self.app = app
+        self.cookies = {}
+
+    def request(self, method: str, path: str, form: dict=None):
+        path, _, query = path.partition('?')
+        body = urlencode(form or {}).encode('ascii')
+        headers = [(b'host', b'localhost')]
+        if form is not None:
+            headers.append((b'content-type',
+                            b'application/x-www-form-urlencoded'))
+        for name, value in self.cookies.items():
+            headers.append((b'cookie', '{}={}'.format(name, value)
+                                           .encode('latin-1')))
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': query.encode('latin-1'), 'headers': headers,
+                 'scheme': 'http', 'server': ('localhost', 80)}
+        messages = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+        run_coroutine(self.app(scope, receive, send))
+
+        status = sent[0]['status']
+        headers = {}
+        for name, value in sent[0]['headers']:
+            name, value = name.decode('latin-1'), value.decode('latin-1')
+            if name == 'set-cookie':
+                cookie, _, _ = value.partition(';')
+                key, _, value = cookie.partition('=')
+                self.cookies[key] = value
+            headers[name] = value
+        return status, headers, sent[1]['body'].decode('utf-8')
+
+    def csrf_token(self) -> str:
+        _, _, page = self.request('GET', '/')
+        return re.search(r'name="csrf_token" value="([^"]+)"',
+                         page).group(1)
+
+
+class ASGIAppTestCase(TestCase):
+
+    def setUp(self):
+        self.server = ProviderServer().start()
+        self.addCleanup(self.server.stop)
+        discovery_cache.clear()
+        negative_cache.clear()
+
+        app = create_app('lazy')
+        app.config['SECRET_KEY'] = 'asgi'
+        self.client = ASGIClient(ASGIApp(app))
+
+    def profile(self, path: str) -> str:
+        # Profile URLs may not have a port, which the provider has. Vouch
+        # for it in the memo of the validator.
+        url = self.server.url(path)
+        profile_url_memo.set(url, normalize_profile_url(url)._replace(
+            error=None))
+        self.addCleanup(profile_url_memo.discard, url)
+        return url
+
+    def log_in(self, path: str='/alice'):
+        return self.client.request('POST', '/', {
+            'csrf_token': self.client.csrf_token(),
+            'domain': self.profile(path)})
+
+    def test_pages_are_rendered_by_flask(self):
+        status, headers, page = self.client.request('GET', '/')
+        status.should.equal(200)
+        headers['content-type'].should.contain('text/html')
+        page.should.contain('csrf_token')
+
+    def test_login_and_callback(self):
+        status, headers, _ = self.log_in()
+        status.should.equal(302)
+        location = urlsplit(headers['location'])
+        location.path.should.equal('/auth')
+        state = parse_qs(location.query)['state'][0]
+
+        status, headers, _ = self.client.request(
+            'GET', '/callback?code=good&state={}'.format(state))
+        status.should.equal(302)
+        headers['location'].should.contain('/success')
+        _, _, page = self.client.request('GET', '/success')
+        page.should.contain(self.server.url('/alice'))
+        self.server.requested().should.equal([('HEAD', '/alice'),
+                                              ('POST', '/auth')])
+
+    def test_invalid_codes_are_rejected(self):
+        _, headers, _ = self.log_in()
+        state = parse_qs(urlsplit(headers['location']).query)['state'][0]
+        self.client.request(
+            'GET', '/callback?code=bad&state={}'.format(state))
+        _, _, page = self.client.request('GET', '/error')
+        page.should.contain('invalid_grant')
+
+    def test_forms_without_csrf_token_fetch_nothing(self):
+        status, _, page = self.client.request(
+            'POST', '/', {'domain': self.profile('/alice')})
+        status.should.equal(400)
+        page.should.contain('CSRF')
+        self.server.requested().should.be.empty
+
+    def test_forged_callbacks_send_nothing(self):
+        self.log_in()
+        status, _, _ = self.client.request('GET',
+                                           '/callback?code=good&state=1')
+        status.should.equal(401)
+        self.server.requested().should.equal([('HEAD', '/alice')])
+
+    def test_discovery_errors_render_the_error_page(self):
+        status, _, page = self.log_in('/loop')
+        status.should.equal(502)
+        page.should.contain('Redirect loop')
+
+    def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'},
+                    {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+        run_coroutine(self.client.app({'type': 'lifespan'}, receive, send))
+        sent.should.equal(['lifespan.startup.complete',
+                           'lifespan.shutdown.complete'])
+
+    def test_environ_joins_repeated_cookie_headers(self):
+        environ = build_environ({
+            'type': 'http', 'method': 'GET', 'path': '/café',
+            'headers': [(b'cookie', b'a=1'), (b'cookie', b'b=2'),
+                        (b'content-type', b'text/plain')]}, b'x')
+        environ['HTTP_COOKIE'].should.equal('a=1; b=2')
+        environ['CONTENT_TYPE'].should.equal('text/plain')
+        environ['CONTENT_LENGTH'].should.equal('1')
+        environ['PATH_INFO'].should.equal('/café'.encode('utf-8')
+                                          .decode('latin-1'))
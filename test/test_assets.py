@@ -0,0 +1,111 @@
+import gzip
+import os
+import shutil
+import sure
+import tempfile
+from dummyauth import create_app
+from dummyauth.assets import IMMUTABLE, build, fingerprint, gzip_compress, \
+    load_manifest
+from dummyauth.config import BaseConfig
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class AssetsTestCase(TestCase):
+
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source)
+        self.addCleanup(shutil.rmtree, self.output)
+
+    def write(self, name, content):
+        path = os.path.join(self.source, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fp:
+            fp.write(content)
+
+    def create_app(self):
+        with patch.object(BaseConfig, 'STATIC_BUILD_DIR', self.output):
+            app = create_app('lazy')
+        app.config['SECRET_KEY'] = 'assets'
+        return app
+
+    def test_fingerprint_depends_on_the_content(self):
+        fingerprint('vapor.css', b'a').should.match(r'^vapor\.[0-9a-f]{12}\.css$')
+        fingerprint('vapor.css', b'a').should_not.equal(
+            fingerprint('vapor.css', b'b'))
+        fingerprint('img/keys.png', b'a').should.match(r'^img/keys\.')
+
+    def test_build_writes_fingerprinted_and_compressed_assets(self):
+        self.write('vapor.css', b'body { color: red; }')
+        self.write('img/keys.png', b'\x89PNG')
+        manifest = build(self.source, self.output, use_brotli=False)
+        manifest.keys().should.equal({'vapor.css', 'img/keys.png'})
+        load_manifest(self.output).should.equal(manifest)
+
+        css = os.path.join(self.output, manifest['vapor.css'])
+        with open(css + '.gz', 'rb') as fp:
+            gzip.decompress(fp.read()).should.equal(b'body { color: red; }')
+        png = os.path.join(self.output, *manifest['img/keys.png'].split('/'))
+        os.path.exists(png).should.be.true
+        os.path.exists(png + '.gz').should.be.false
+
+    def test_gzip_versions_do_not_depend_on_when_they_were_built(self):
+        with patch('time.time', return_value=1):
+            first = gzip_compress(b'body { color: red; }')
+        with patch('time.time', return_value=2):
+            gzip_compress(b'body { color: red; }').should.equal(first)
+
+    def test_build_keeps_the_assets_of_earlier_builds(self):
+        self.write('vapor.css', b'old')
+        old = build(self.source, self.output, use_brotli=False)['vapor.css']
+        self.write('vapor.css', b'new')
+        new = build(self.source, self.output, use_brotli=False)['vapor.css']
+        new.should_not.equal(old)
+        os.path.exists(os.path.join(self.output, old)).should.be.true
+        load_manifest(self.output)['vapor.css'].should.equal(new)
+
+    def test_no_manifest_before_building(self):
+        load_manifest(self.output).should.be.none
+
+    def test_pages_link_to_fingerprinted_assets(self):
+        manifest = build(os.path.join(os.path.dirname(__file__), '..',
+                                      'dummyauth', 'static'),
+                         self.output, use_brotli=False)
+        client = self.create_app().test_client()
+        page = client.get('/').get_data(as_text=True)
+        page.should.contain('/static/' + manifest['vapor.css'])
+        page.should.contain('/static/' + manifest['keys.png'])
+
+        response = client.get('/static/' + manifest['vapor.css'])
+        response.status_code.should.equal(200)
+        response.headers['Cache-Control'].should.equal(IMMUTABLE)
+        response.close()
+
+    def test_assets_are_served_as_usual_until_built(self):
+        client = self.create_app().test_client()
+        client.get('/').get_data(as_text=True).should.contain(
+            '/static/vapor.css')
+        response = client.get('/static/vapor.css')
+        response.status_code.should.equal(200)
+        response.headers['Cache-Control'].should_not.equal(IMMUTABLE)
+        response.close()
+
+    def test_the_command_builds_the_assets_of_the_application(self):
+        app = self.create_app()
+        result = app.test_cli_runner().invoke(args=['build-assets',
+                                                    '--no-brotli'])
+        result.exit_code.should.equal(0)
+        manifest = load_manifest(self.output)
+        result.output.should.contain('vapor.css -> ' + manifest['vapor.css'])
+        css = os.path.join(self.output, manifest['vapor.css'])
+        os.path.exists(css + '.gz').should.be.true
+        os.path.exists(css + '.br').should.be.false
+
+    def test_the_command_needs_a_build_directory(self):
+        app = self.create_app()
+        app.config['STATIC_BUILD_DIR'] = None
+        result = app.test_cli_runner().invoke(args=['build-assets'])
+        result.exit_code.should.equal(2)
+        result.output.should.contain('STATIC_BUILD_DIR')
@@ -1,123 +1,260 @@
-import httpretty
+import gzip
+import json
 import sure
+from dummyauth.client import HTTPClient
+from dummyauth.deadline import Deadline
+from dummyauth.exceptions import InvalidAuthorizationResponseException
+from dummyauth.parser import FieldsParser
 from dummyauth.spider import AuthorizationCodeValidator
+from standin import StandInServer
+from test_endpoint_discovery_spider import HTTPrettyBackend, StandInBackend
 from unittest import TestCase
 
-class AuthorizationCodeValidatorTestCase(TestCase):
+class AuthorizationCodeValidatorTests(object):
 
-    @httpretty.httprettified
     def test_spider_handles_valid_requests(self):
-        httpretty.register_uri(httpretty.POST, 'http://auth.example.com/login',
-                               adding_headers={'content-type': 'application/json'},
-                               body='{"me": "http://johndoe.example.com/"}')
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"me": "http://johndoe.example.com/"}')
         validator_params={
             'authorization_endpoint': 'http://auth.example.com/login',
             'code': 'deadbeef',
             'client_id': 'http://client.example.com/',
             'redirect_uri': 'http://client.example.com/callback',
         }
-        validator = AuthorizationCodeValidator(**validator_params)
+        validator = self.verify(**validator_params)
         self.assertTrue(validator.valid)
 
-    @httpretty.httprettified
     def test_spider_handles_valid_profile_url(self):
-        httpretty.register_uri(httpretty.POST, 'http://auth.example.com/login',
-                               adding_headers={'content-type': 'application/json'},
-                               body='{"me": "http://johndoe.example.com/"}')
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"me": "http://johndoe.example.com/"}')
         validator_params={
             'authorization_endpoint': 'http://auth.example.com/login',
             'code': 'deadbeef',
             'client_id': 'http://client.example.com/',
             'redirect_uri': 'http://client.example.com/callback',
         }
-        validator = AuthorizationCodeValidator(**validator_params)
+        validator = self.verify(**validator_params)
         validator.profile_url.should.equal('http://johndoe.example.com/')
 
-    @httpretty.httprettified
     def test_spider_handles_invalid_requests(self):
-        httpretty.register_uri(httpretty.POST, 'http://auth.example.com/login',
-                               adding_headers={'content-type': 'application/json'},
-                               body='{"error": "invalid_request"}',
-                               status=400)
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"error": "invalid_request"}',
+                      status=400)
         validator_params={
             'authorization_endpoint': 'http://auth.example.com/login',
             'code': 'deadbeef',
             'client_id': 'http://client.example.com/',
             'redirect_uri': 'http://client.example.com/callback',
         }
-        validator = AuthorizationCodeValidator(**validator_params)
+        validator = self.verify(**validator_params)
         self.assertFalse(validator.valid)
 
-    @httpretty.httprettified
     def test_spider_handles_invalid_request_code(self):
-        httpretty.register_uri(httpretty.POST, 'http://auth.example.com/login',
-                               adding_headers={'content-type': 'application/json'},
-                               body='{"error": "invalid_request"}',
-                               status=400)
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"error": "invalid_request"}',
+                      status=400)
         validator_params={
             'authorization_endpoint': 'http://auth.example.com/login',
             'code': 'deadbeef',
             'client_id': 'http://client.example.com/',
             'redirect_uri': 'http://client.example.com/callback',
         }
-        validator = AuthorizationCodeValidator(**validator_params)
+        validator = self.verify(**validator_params)
         validator.error.should.equal('invalid_request')
 
-    @httpretty.httprettified
     def test_spider_sends_appropiate_request(self):
-        httpretty.register_uri(httpretty.POST, 'http://auth.example.com/login',
-                               adding_headers={'content-type': 'application/json'},
-                               body='{"me": "http://johndoe.example.com/"}')
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"me": "http://johndoe.example.com/"}')
         validator_params={
             'authorization_endpoint': 'http://auth.example.com/login',
             'code': 'deadbeef',
             'client_id': 'http://client.example.com/',
             'redirect_uri': 'http://client.example.com/callback',
         }
-        AuthorizationCodeValidator(**validator_params).valid
-        httpretty.has_request().should.be(True)
+        self.verify(**validator_params)
+        self.sent()[-1].method.should.equal('POST')
+        self.sent()[-1].path.should.equal('/login')
 
-    @httpretty.httprettified
     def test_spider_sends_appropiate_code(self):
-        httpretty.register_uri(httpretty.POST, 'http://auth.example.com/login',
-                               adding_headers={'content-type': 'application/json'},
-                               body='{"me": "http://johndoe.example.com/"}')
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"me": "http://johndoe.example.com/"}')
         validator_params={
             'authorization_endpoint': 'http://auth.example.com/login',
             'code': 'deadbeef',
             'client_id': 'http://client.example.com/',
             'redirect_uri': 'http://client.example.com/callback',
         }
-        AuthorizationCodeValidator(**validator_params).valid
-        payload = httpretty.last_request().parsed_body
+        self.verify(**validator_params)
+        payload = self.sent()[-1].parsed_body
         payload['code'][0].should.equal('deadbeef')
 
-    @httpretty.httprettified
     def test_spider_sends_appropiate_client_id(self):
-        httpretty.register_uri(httpretty.POST, 'http://auth.example.com/login',
-                               adding_headers={'content-type': 'application/json'},
-                               body='{"me": "http://johndoe.example.com/"}')
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"me": "http://johndoe.example.com/"}')
         validator_params={
             'authorization_endpoint': 'http://auth.example.com/login',
             'code': 'deadbeef',
             'client_id': 'http://client.example.com/',
             'redirect_uri': 'http://client.example.com/callback',
         }
-        AuthorizationCodeValidator(**validator_params).valid
-        payload = httpretty.last_request().parsed_body
+        self.verify(**validator_params)
+        payload = self.sent()[-1].parsed_body
         payload['client_id'][0].should.equal('http://client.example.com/')
 
-    @httpretty.httprettified
     def test_spider_sends_appropiate_redirect_uri(self):
-        httpretty.register_uri(httpretty.POST, 'http://auth.example.com/login',
-                               adding_headers={'content-type': 'application/json'},
-                               body='{"me": "http://johndoe.example.com/"}')
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"me": "http://johndoe.example.com/"}')
         validator_params={
             'authorization_endpoint': 'http://auth.example.com/login',
             'code': 'deadbeef',
             'client_id': 'http://client.example.com/',
             'redirect_uri': 'http://client.example.com/callback',
         }
-        AuthorizationCodeValidator(**validator_params).valid
-        payload = httpretty.last_request().parsed_body
+        self.verify(**validator_params)
+        payload = self.sent()[-1].parsed_body
         payload['redirect_uri'][0].should.equal('http://client.example.com/callback')
+
+    def test_spider_sends_a_form_encoded_payload(self):
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"me": "http://johndoe.example.com/"}')
+        validator_params={
+            'authorization_endpoint': 'http://auth.example.com/login',
+            'code': 'deadbeef',
+            'client_id': 'http://client.example.com/',
+            'redirect_uri': 'http://client.example.com/callback',
+        }
+        self.verify(**validator_params)
+        self.sent()[-1].headers['Content-Type'].should.equal(
+            'application/x-www-form-urlencoded')
+
+
+class AuthorizationCodeValidatorTestCase(AuthorizationCodeValidatorTests,
+                                         HTTPrettyBackend, TestCase):
+    pass
+
+
+class AsyncAuthorizationCodeValidatorTestCase(AuthorizationCodeValidatorTests,
+                                              StandInBackend, TestCase):
+    pass
+
+
+class AuthorizationResponseParsingTests(object):
+
+    validator_params = {
+        'authorization_endpoint': 'http://auth.example.com/login',
+        'code': 'deadbeef',
+        'client_id': 'http://client.example.com/',
+        'redirect_uri': 'http://client.example.com/callback',
+    }
+
+    def test_media_type_parameters_are_accepted(self):
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json; charset=utf-8'},
+                      body='{"me": "http://johndoe.example.com/"}')
+        validator = self.verify(**self.validator_params)
+        validator.profile_url.should.equal('http://johndoe.example.com/')
+
+    def test_form_encoded_responses_are_accepted(self):
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'Application/X-WWW-Form-Urlencoded'},
+                      body='me=http%3A%2F%2Fjohndoe.example.com%2F')
+        validator = self.verify(**self.validator_params)
+        validator.profile_url.should.equal('http://johndoe.example.com/')
+
+    def test_unsupported_media_types_are_rejected(self):
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'text/html'},
+                      body='<p>me</p>')
+        with self.assertRaises(InvalidAuthorizationResponseException) as raised:
+            self.verify(**self.validator_params)
+        raised.exception.message.should.equal('Unsupported content-type: text/html')
+
+    def test_oversized_responses_are_rejected(self):
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='{"me": "http://johndoe.example.com/", "x": "' + 'x' * 100 + '"}')
+        with self.assertRaises(InvalidAuthorizationResponseException) as raised:
+            self.verify(**self.validator_params, max_body_size=64)
+        raised.exception.message.should.equal('The response is larger than 64 bytes.')
+
+    def test_responses_that_are_not_objects_are_rejected(self):
+        self.register('POST', 'http://auth.example.com/login',
+                      headers={'content-type': 'application/json'},
+                      body='["http://johndoe.example.com/"]')
+        with self.assertRaises(InvalidAuthorizationResponseException):
+            self.verify(**self.validator_params)
+
+
+class AuthorizationResponseParsingTestCase(AuthorizationResponseParsingTests,
+                                           HTTPrettyBackend, TestCase):
+    pass
+
+
+class AsyncAuthorizationResponseParsingTestCase(
+        AuthorizationResponseParsingTests, StandInBackend, TestCase):
+    pass
+
+
+class FieldsParserTestCase(TestCase):
+
+    def test_bodies_without_length_are_capped_while_streaming(self):
+        parser = FieldsParser('application/json', max_bytes=10)
+        parser.feed(b'{"me": ')
+        with self.assertRaises(InvalidAuthorizationResponseException):
+            parser.feed(b'"http://johndoe.example.com/"}')
+
+    def test_parser_is_done_once_the_whole_body_arrives(self):
+        parser = FieldsParser('application/json', length=8)
+        parser.feed(b'{"a": ')
+        parser.done.should.be.false
+        parser.feed(b'1}')
+        parser.done.should.be.true
+        parser.finish(memoryview(b'{"a": 1}')).should.equal({'a': 1})
+
+    def test_the_length_of_compressed_bodies_is_not_waited_for(self):
+        parser = FieldsParser.for_response({
+            'content-type': 'application/json', 'content-length': '8',
+            'content-encoding': 'gzip'})
+        parser.feed(b'{"a": 1, "b": 2}')
+        parser.done.should.be.false
+
+    def test_charset_is_used_to_decode_the_body(self):
+        parser = FieldsParser('application/x-www-form-urlencoded',
+                              charset='latin-1')
+        parser.finish('error=caf\xe9'.encode('latin-1')).should.equal(
+            {'error': 'caf\xe9'})
+
+
+class CompressedResponseTestCase(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.addCleanup(self.server.stop)
+        self.client = HTTPClient()
+        self.addCleanup(self.client.close)
+
+    def test_compressed_responses_are_read_whole(self):
+        scope = ' '.join('scope{}'.format(i) for i in range(300))
+        fields = {'me': 'http://johndoe.example.com/', 'scope': scope}
+        body = gzip.compress(json.dumps(fields).encode('utf-8'))
+        # Sent in several writes, so that each read gets only a part, and
+        # more than the compressed length arrives before the end.
+        self.server.register('POST', self.server.url('/auth'), headers={
+            'Content-Type': 'application/json', 'Content-Encoding': 'gzip'},
+            body=body, pieces=64)
+        validator = AuthorizationCodeValidator(
+            authorization_endpoint=self.server.url('/auth'), code='deadbeef',
+            client_id='http://client.example.com/',
+            redirect_uri='http://client.example.com/callback',
+            client=self.client, deadline=Deadline(5))
+        validator.valid.should.be.true
+        validator.profile_url.should.equal('http://johndoe.example.com/')
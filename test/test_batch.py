@@ -0,0 +1,77 @@
+import io
+import json
+import sure
+from dummyauth.batch import discover_many, main, read_urls
+from test_endpoint_discovery_spider import SpiderTests, StandInBackend
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class ReadURLsTestCase(TestCase):
+
+    def test_urls_are_canonicalized_skipping_blanks_and_comments(self):
+        lines = ['example.com\n', '\n', '# a comment\n',
+                 ' https://Johndoe.example.com/blog \n']
+        list(read_urls(lines)).should.equal([
+            'http://example.com/', 'https://johndoe.example.com/blog'])
+
+
+class DiscoverManyTestCase(StandInBackend, TestCase):
+
+    def collect(self, urls, **kwargs):
+        async def collect():
+            return [result async for result in discover_many(
+                urls, client=self.client, **kwargs)]
+        return self.wait(collect())
+
+    def test_every_url_gets_a_result(self):
+        for i in range(10):
+            self.register('HEAD', 'http://example.com/user{}'.format(i),
+                          headers={
+                              'Link': '</auth>; rel="authorization_endpoint", '
+                                      '</token>; rel="token_endpoint"'})
+        urls = ['http://example.com/user{}'.format(i) for i in range(10)]
+        results = self.collect(urls, concurrency=3, per_host=2)
+        sorted(result['url'] for result in results).should.equal(sorted(urls))
+        for result in results:
+            result['error'].should.be(None)
+            result['authorization_endpoint'].should.equal(
+                'http://example.com/auth')
+            result['elapsed'].should.be.greater_than_or_equal_to(0)
+
+    def test_errors_are_reported_per_url(self):
+        self.register('HEAD', 'http://example.com/loop', status=302,
+                      headers={'Location': '/loop'})
+        self.register('HEAD', 'http://example.com/ok', headers={
+            'Link': '</auth>; rel="authorization_endpoint", '
+                    '</token>; rel="token_endpoint"'})
+        results = {result['url']: result for result in self.collect(
+            ['http://example.com/loop', 'http://example.com/ok',
+             'http://127.0.0.1:1/'])}
+        results['http://example.com/loop']['error'].should.contain(
+            'Redirect loop')
+        results['http://example.com/ok']['error'].should.be(None)
+        results['http://127.0.0.1:1/']['error'].should.contain('Error')
+
+
+class MainTestCase(SpiderTests, StandInBackend, TestCase):
+
+    def test_main_writes_json_lines(self):
+        self.register('HEAD', 'http://example.com/', headers={
+            'Link': '</auth>; rel="authorization_endpoint", '
+                    '</token>; rel="token_endpoint"'})
+        stdin = io.StringIO('http://example.com/\n')
+        stdout = io.StringIO()
+        with patch('sys.stdin', stdin), patch('sys.stdout', stdout):
+            main([]).should.equal(0)
+        lines = stdout.getvalue().splitlines()
+        len(lines).should.equal(1)
+        json.loads(lines[0])['token_endpoint'].should.equal(
+            'http://example.com/token')
+
+    def test_main_runs_on_a_loop_of_its_own(self):
+        self.register('HEAD', 'http://example.com/')
+        for _ in range(2):
+            with patch('sys.stdin', io.StringIO('http://example.com/\n')), \
+                    patch('sys.stdout', io.StringIO()):
+                main([]).should.equal(0)
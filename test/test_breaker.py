@@ -0,0 +1,175 @@
+import socket
+import sure
+import time
+from dummyauth import create_app
+from dummyauth.aio import AsyncHTTPClient
+from dummyauth.breaker import CircuitBreaker, circuit_breaker
+from dummyauth.client import Fetch, HTTPClient
+from dummyauth.exceptions import CircuitOpen
+from standin import run_coroutine
+from unittest import TestCase
+from unittest.mock import patch
+
+URL = 'http://auth.example.com/auth'
+
+
+class CircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(min_requests=4, error_rate=0.5,
+                                      slow_call_duration=1,
+                                      slow_call_rate=0.5, open_seconds=30)
+        self.now = time.monotonic()
+
+    def call(self, status_code: int=200, error: Exception=None,
+             elapsed: float=0):
+        with patch('dummyauth.breaker.time.monotonic',
+                   side_effect=[self.now, self.now, self.now + elapsed,
+                                self.now + elapsed]):
+            with self.breaker.guard(URL) as call:
+                if error is not None:
+                    raise error
+                call.status_code = status_code
+
+    def fail(self, times: int=1):
+        for _ in range(times):
+            self.assertRaises(ConnectionRefusedError, self.call,
+                              error=ConnectionRefusedError())
+
+    def test_failures_open_the_circuit(self):
+        self.call()
+        self.call()
+        self.fail()
+        self.breaker.state(URL).should.equal('closed')
+        self.fail()
+        self.breaker.state(URL).should.equal('open')
+        with self.assertRaises(CircuitOpen) as context:
+            self.call()
+        context.exception.status_code.should.equal(503)
+        context.exception.host.should.equal('auth.example.com')
+
+    def test_few_requests_never_open_it(self):
+        self.fail(3)
+        self.breaker.state(URL).should.equal('closed')
+
+    def test_server_errors_are_failures_but_client_errors_are_not(self):
+        for _ in range(4):
+            self.call(400)
+        self.breaker.state(URL).should.equal('closed')
+        for _ in range(4):
+            self.call(503)
+        self.breaker.state(URL).should.equal('open')
+
+    def test_rejected_responses_are_not_failures(self):
+        for _ in range(4):
+            self.assertRaises(ValueError, self.call, error=ValueError())
+        self.breaker.state(URL).should.equal('closed')
+
+    def test_slow_requests_open_the_circuit(self):
+        for _ in range(4):
+            self.call(elapsed=2)
+        self.breaker.state(URL).should.equal('open')
+
+    def test_old_requests_are_forgotten(self):
+        self.breaker.window = 10
+        with patch('dummyauth.breaker.time.monotonic', return_value=self.now):
+            for _ in range(3):
+                self.breaker.record(URL, 0, True)
+        with patch('dummyauth.breaker.time.monotonic', return_value=self.now + 11):
+            self.breaker.record(URL, 0, True)
+        self.breaker.state(URL).should.equal('closed')
+
+    def test_circuits_are_per_host(self):
+        self.fail(4)
+        self.breaker.state('https://other.example.com/').should.equal(
+            'closed')
+
+    def test_a_successful_probe_closes_the_circuit(self):
+        self.fail(4)
+        with patch('dummyauth.breaker.time.monotonic', return_value=self.now + 31):
+            self.breaker.state(URL).should.equal('half_open')
+            self.breaker.allow(URL).should.be.true
+            # Only one probe at a time.
+            self.assertRaises(CircuitOpen, self.breaker.allow, URL)
+            self.breaker.record(URL, 0.1, False)
+        self.breaker.state(URL).should.equal('closed')
+        self.breaker.stats()['auth.example.com']['opened'].should.equal(1)
+
+    def test_a_failed_probe_opens_the_circuit_again(self):
+        self.fail(4)
+        with patch('dummyauth.breaker.time.monotonic', return_value=self.now + 31):
+            self.breaker.allow(URL)
+            self.breaker.record(URL, 0.1, True)
+            self.breaker.state(URL).should.equal('open')
+            stats = self.breaker.stats()['auth.example.com']
+        stats['retry_after'].should.equal(30)
+        stats['opened'].should.equal(2)
+
+    def test_a_cancelled_probe_lets_another_one_through(self):
+        self.fail(4)
+        with patch('dummyauth.breaker.time.monotonic', return_value=self.now + 31):
+            self.breaker.allow(URL)
+            self.breaker.cancel(URL)
+            self.breaker.allow(URL).should.be.true
+
+    def test_no_minimum_disables_it(self):
+        self.breaker.min_requests = 0
+        self.fail(10)
+        self.breaker.state(URL).should.equal('closed')
+        self.breaker.stats().should.be.empty
+
+
+class GuardedClientsTestCase(TestCase):
+
+    def setUp(self):
+        # Nothing listens on port 9 of the loopback interface.
+        self.url = 'http://127.0.0.1:9/'
+        self.breaker = CircuitBreaker(min_requests=2)
+
+    def test_sync_client_stops_sending_requests(self):
+        client = HTTPClient(breaker=self.breaker)
+        self.addCleanup(client.close)
+        for _ in range(2):
+            self.assertRaises(IOError, client.fetch, Fetch('GET', self.url))
+        with patch.object(client, 'request') as request:
+            self.assertRaises(CircuitOpen, client.fetch, Fetch('GET', self.url))
+        request.called.should.be.false
+
+    def test_async_client_stops_sending_requests(self):
+        client = AsyncHTTPClient(breaker=self.breaker)
+
+        async def run():
+            for _ in range(2):
+                with self.assertRaises(OSError):
+                    await client.fetch(Fetch('GET', self.url))
+            with patch('asyncio.open_connection') as open_connection:
+                with self.assertRaises(CircuitOpen):
+                    await client.fetch(Fetch('GET', self.url))
+            await client.close()
+            return open_connection.called
+        run_coroutine(run()).should.be.false
+
+
+class CircuitOpenPageTestCase(TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['SECRET_KEY'] = 'circuit'
+        self.addCleanup(circuit_breaker.clear)
+
+    def test_callbacks_fail_right_away(self):
+        for _ in range(circuit_breaker.min_requests):
+            circuit_breaker.record(URL, 0, True)
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['login.endpoint'] = URL
+            session['login.state'] = 1
+        with patch('socket.create_connection',
+                   side_effect=socket.timeout) as connect:
+            response = client.get('/callback?code=x&state=1')
+        connect.called.should.be.false
+        response.status_code.should.equal(503)
+        int(response.headers['Retry-After']).should.be.within(1, 30)
+        page = response.get_data(as_text=True)
+        page.should.contain('not being contacted for a while')
+        page.should.contain('auth.example.com')
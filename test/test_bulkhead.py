@@ -0,0 +1,153 @@
+import re
+import shutil
+import sure
+import tempfile
+from dummyauth import create_app
+from dummyauth.asgi import ASGIApp
+from dummyauth.bulkhead import Bulkhead, bulkhead
+from dummyauth.cache import discovery_cache, negative_cache
+from dummyauth.exceptions import Overloaded
+from dummyauth.forms import normalize_profile_url, profile_url_memo
+from test_asgi import ASGIClient, ProviderServer
+from unittest import TestCase
+
+
+class BulkheadTestCase(TestCase):
+
+    def setUp(self):
+        self.bulkhead = Bulkhead(max_concurrent=3, per_host=2,
+                                 min_concurrent=1, target_latency=1)
+
+    def test_hosts_get_part_of_the_places(self):
+        slots = [self.bulkhead.acquire('https://a.example/x'),
+                 self.bulkhead.acquire('https://a.example/y')]
+        with self.assertRaises(Overloaded) as context:
+            self.bulkhead.acquire('https://A.example/z')
+        context.exception.status_code.should.equal(503)
+        self.bulkhead.acquire('https://b.example/')
+        self.assertRaises(Overloaded, self.bulkhead.acquire,
+                          'https://c.example/')
+        self.bulkhead.stats().should.equal({
+            'limit': 3, 'active': 3, 'hosts': {'a.example': 2,
+                                               'b.example': 1}})
+        self.bulkhead.release(slots[0])
+        self.bulkhead.acquire('https://a.example/z')
+
+    def test_places_are_given_back_after_the_block(self):
+        with self.assertRaises(ValueError):
+            with self.bulkhead.slot('https://a.example/'):
+                raise ValueError()
+        self.bulkhead.stats()['active'].should.equal(0)
+
+    def test_slow_logins_lower_the_limit(self):
+        for _ in range(20):
+            slot = self.bulkhead.acquire('https://a.example/')
+            slot.started -= 2
+            self.bulkhead.release(slot)
+        self.bulkhead.limit.should.equal(1)
+        self.bulkhead.acquire('https://a.example/')
+        self.assertRaises(Overloaded, self.bulkhead.acquire,
+                          'https://b.example/')
+
+    def test_fast_logins_raise_it_back(self):
+        self.bulkhead.limit = 1
+        for _ in range(10):
+            self.bulkhead.release(self.bulkhead.acquire('https://a.example/'))
+        self.bulkhead.limit.should.equal(3)
+
+    def test_no_places_disable_it(self):
+        self.bulkhead.max_concurrent = 0
+        self.bulkhead.acquire('https://a.example/').should.be.none
+        self.bulkhead.release(None)
+
+
+class SharedBulkheadTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def bulkhead(self) -> Bulkhead:
+        # Each one stands in for a worker process.
+        return Bulkhead(max_concurrent=2, per_host=1,
+                        directory=self.directory)
+
+    def test_places_are_shared_between_workers(self):
+        first, second = self.bulkhead(), self.bulkhead()
+        slot = first.acquire('https://a.example/')
+        self.assertRaises(Overloaded, second.acquire, 'https://a.example/')
+        # Places are held while their slot is open, so keep it.
+        other = second.acquire('https://b.example/')
+        self.assertRaises(Overloaded, first.acquire, 'https://c.example/')
+        first.release(slot)
+        second.acquire('https://a.example/').should_not.be.none
+        second.release(other)
+
+    def test_failed_attempts_take_no_place(self):
+        first, second = self.bulkhead(), self.bulkhead()
+        slots = [first.acquire('https://a.example/'),
+                 first.acquire('https://b.example/')]
+        self.assertRaises(Overloaded, second.acquire, 'https://c.example/')
+        # The place for c.example was given back when it was turned down.
+        first.release(slots.pop())
+        second.acquire('https://c.example/').should_not.be.none
+
+
+class SheddingTestCase(TestCase):
+
+    def setUp(self):
+        self.server = ProviderServer().start()
+        self.addCleanup(self.server.stop)
+        discovery_cache.clear()
+        negative_cache.clear()
+
+        self.app = create_app('lazy')
+        self.app.config['SECRET_KEY'] = 'bulkhead'
+        self.client = self.app.test_client()
+        self.url = self.server.url('/alice')
+        profile_url_memo.set(self.url, normalize_profile_url(
+            self.url)._replace(error=None))
+        self.addCleanup(profile_url_memo.discard, self.url)
+
+    def fill(self):
+        """ Takes every place for the provider. """
+        slots = [bulkhead.acquire(self.url)
+                 for _ in range(bulkhead.per_host)]
+        self.addCleanup(lambda: [bulkhead.release(s) for s in slots])
+
+    def log_in(self):
+        page = self.client.get('/').get_data(as_text=True)
+        token = re.search(r'name="csrf_token" value="([^"]+)"', page).group(1)
+        return self.client.post('/', data={'csrf_token': token,
+                                           'domain': self.url})
+
+    def test_logins_release_their_place(self):
+        self.log_in().status_code.should.equal(302)
+        bulkhead.stats()['active'].should.equal(0)
+
+    def test_logins_are_turned_down_when_full(self):
+        self.fill()
+        response = self.log_in()
+        response.status_code.should.equal(503)
+        response.headers['Retry-After'].should.equal('5')
+        response.get_data(as_text=True).should.contain('Too many logins')
+        self.server.requested().should.be.empty
+        bulkhead.stats()['active'].should.equal(bulkhead.per_host)
+
+    def test_callbacks_are_turned_down_when_full(self):
+        self.fill()
+        with self.client.session_transaction() as session:
+            session['login.endpoint'] = self.server.url('/auth')
+            session['login.state'] = 1
+        response = self.client.get('/callback?code=good&state=1')
+        response.status_code.should.equal(503)
+        self.server.requested().should.be.empty
+
+    def test_asgi_logins_are_turned_down_when_full(self):
+        self.fill()
+        client = ASGIClient(ASGIApp(self.app))
+        status, headers, page = client.request('POST', '/', {
+            'csrf_token': client.csrf_token(), 'domain': self.url})
+        status.should.equal(503)
+        headers['retry-after'].should.equal('5')
+        self.server.requested().should.be.empty
@@ -0,0 +1,141 @@
+import sure
+import threading
+import time
+from dummyauth import create_app, views
+from dummyauth.aio import AsyncHTTPClient
+from dummyauth.cache import NegativeCache
+from dummyauth.client import Fetch, HTTPClient, failure_kind
+from dummyauth.deadline import Deadline
+from dummyauth.exceptions import DeadlineExceeded
+from dummyauth.spider import EndpointDiscoverySpider
+from dummyauth.singleflight import SingleFlight
+from standin import StandInHandler, StandInServer, run_coroutine
+from unittest import TestCase
+
+
+class TarpitHandler(StandInHandler):
+    """ Answers with a page, one byte at a time, slowly. If the server has
+    headers false, it doesn't even send the headers. """
+
+    def respond(self):
+        server = self.server
+        try:
+            if server.headers:
+                self.wfile.write(b'HTTP/1.1 200 OK\r\n'
+                                 b'Content-Type: text/html\r\n'
+                                 b'Content-Length: 100000\r\n\r\n')
+            while not server.closed.wait(server.delay):
+                if server.headers:
+                    self.wfile.write(b' ')
+        except OSError:
+            pass
+        self.close_connection = True
+
+    do_GET = do_HEAD = do_POST = respond
+
+
+class TarpitServer(StandInServer):
+    """ A server that takes forever to answer. """
+
+    def __init__(self, headers=True, delay=0.05):
+        super().__init__(handler=TarpitHandler)
+        self.headers = headers
+        self.delay = delay
+        self.closed = threading.Event()
+
+    def stop(self):
+        self.closed.set()
+        super().stop()
+
+
+class DeadlineTestCase(TestCase):
+
+    def test_phases_get_at_most_what_is_left(self):
+        deadline = Deadline(2, connect=5, response=1)
+        deadline.timeout('connect').should.be.lower_than_or_equal_to(2)
+        deadline.timeout('response').should.equal(1)
+        deadline.timeout('body').should.be.lower_than_or_equal_to(2)
+
+    def test_an_expired_deadline_raises(self):
+        deadline = Deadline(0)
+        deadline.expired.should.be.true
+        with self.assertRaises(DeadlineExceeded) as raised:
+            deadline.check('https://example.com/')
+        raised.exception.status_code.should.equal(504)
+        raised.exception.message.should.contain('https://example.com/')
+
+    def test_a_deadline_is_built_from_the_app_settings(self):
+        app = create_app()
+        app.config.update(DEADLINE_VERIFY=4, DEADLINE_CONNECT=1,
+                          DEADLINE_RESPONSE=2, DEADLINE_BODY=3)
+        deadline = Deadline.from_config(app.config, 'DEADLINE_VERIFY')
+        (deadline.budget, deadline.connect, deadline.response,
+         deadline.body).should.equal((4, 1, 2, 3))
+
+
+class DeadlineClientTestCase(TestCase):
+
+    def setUp(self):
+        self.server = TarpitServer().start()
+        self.addCleanup(self.server.stop)
+
+    def fetch(self, deadline):
+        fetch = Fetch('GET', self.server.url(), read_body=True)
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            HTTPClient().fetch(fetch, deadline)
+        return time.monotonic() - start
+
+    def test_slow_bodies_are_given_up_when_the_budget_is_over(self):
+        self.fetch(Deadline(0.3, response=1)).should.be.lower_than(0.8)
+
+    def test_slow_bodies_are_given_up_when_the_body_phase_is_over(self):
+        fetch = Fetch('GET', self.server.url(), read_body=True)
+        with self.assertRaises(Exception) as raised:
+            HTTPClient().fetch(fetch, Deadline(5, body=0.2))
+        failure_kind(raised.exception).should.equal('timeout')
+        raised.exception.shouldnt.be.a(DeadlineExceeded)
+
+    def test_the_async_client_gives_up_slow_bodies(self):
+        fetch = Fetch('GET', self.server.url(), read_body=True)
+
+        async def run():
+            client = AsyncHTTPClient()
+            try:
+                await client.fetch(fetch, Deadline(0.3, response=1))
+            finally:
+                await client.close()
+
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            run_coroutine(run())
+        (time.monotonic() - start).should.be.lower_than(0.8)
+
+    def test_expired_deadlines_send_no_requests(self):
+        client = HTTPClient()
+        client.request = lambda *args, **kwargs: self.fail('Request sent')
+        with self.assertRaises(DeadlineExceeded):
+            client.fetch(Fetch('GET', self.server.url()), Deadline(0))
+
+
+class DeadlineSpiderTestCase(TestCase):
+
+    def test_silent_hosts_exhaust_the_deadline_and_are_remembered(self):
+        server = TarpitServer(headers=False).start()
+        self.addCleanup(server.stop)
+        failures = NegativeCache()
+        spider = EndpointDiscoverySpider(
+            server.url(), client=HTTPClient(), failures=failures,
+            flights=SingleFlight(), deadline=Deadline(0.3))
+        with self.assertRaises(DeadlineExceeded):
+            spider.authorization_endpoint
+        failures.get(server.url()).kind.should.equal('timeout')
+
+    def test_the_error_page_explains_the_deadline(self):
+        app = create_app()
+        app.config['SECRET_KEY'] = 'secret'
+        with app.test_request_context('/'):
+            body, status = views.handle_error_response(
+                DeadlineExceeded('Ran out of time.'))
+        status.should.equal(504)
+        body.should.contain('took too long to answer')
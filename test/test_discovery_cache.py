@@ -0,0 +1,115 @@
+import sure
+import time
+from dummyauth.cache import DiscoveryCache, TTLCache, freshness_lifetime
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class FreshnessLifetimeTestCase(TestCase):
+
+    def test_max_age_sets_the_lifetime(self):
+        headers = {'cache-control': 'public, max-age=600'}
+        freshness_lifetime(headers, 86400).should.equal(600)
+
+    def test_s_maxage_has_precedence_over_max_age(self):
+        headers = {'cache-control': 'max-age=600, s-maxage=60'}
+        freshness_lifetime(headers, 86400).should.equal(60)
+
+    def test_age_is_subtracted_from_the_lifetime(self):
+        headers = {'cache-control': 'max-age=600', 'age': '100'}
+        freshness_lifetime(headers, 86400).should.equal(500)
+
+    def test_expires_is_relative_to_date(self):
+        headers = {
+            'date': 'Sun, 18 Oct 2026 12:00:00 GMT',
+            'expires': 'Sun, 18 Oct 2026 12:05:00 GMT',
+        }
+        freshness_lifetime(headers, 86400).should.equal(300)
+
+    def test_invalid_expires_means_expired(self):
+        headers = {'expires': '0'}
+        freshness_lifetime(headers, 86400).should.equal(0)
+
+    def test_last_modified_gives_heuristic_lifetime(self):
+        headers = {
+            'date': 'Sun, 18 Oct 2026 12:00:00 GMT',
+            'last-modified': 'Sun, 18 Oct 2026 11:00:00 GMT',
+        }
+        freshness_lifetime(headers, 86400).should.equal(360)
+
+    def test_lifetime_is_capped(self):
+        headers = {'cache-control': 'max-age=31536000'}
+        freshness_lifetime(headers, 3600).should.equal(3600)
+
+    def test_no_store_and_private_are_not_stored(self):
+        freshness_lifetime({'cache-control': 'no-store'}, 3600).should.be(None)
+        freshness_lifetime({'cache-control': 'private'}, 3600).should.be(None)
+
+
+class DiscoveryCacheTestCase(TestCase):
+
+    data = {'authorization_endpoint': 'https://auth.example.com/'}
+
+    def test_cache_stores_fresh_entries(self):
+        cache = DiscoveryCache()
+        cache.store('https://example.com/', self.data,
+                    {'cache-control': 'max-age=60'})
+        cache.get('https://example.com/').fresh.should.be(True)
+
+    def test_cache_keeps_stale_entries_with_validators(self):
+        cache = DiscoveryCache()
+        cache.store('https://example.com/', self.data,
+                    {'cache-control': 'no-cache', 'etag': '"abc"'})
+        entry = cache.get('https://example.com/')
+        entry.fresh.should.be(False)
+        entry.validators.should.equal({'If-None-Match': '"abc"'})
+
+    def test_cache_skips_entries_that_cannot_be_reused(self):
+        cache = DiscoveryCache()
+        cache.store('https://example.com/', self.data, {})
+        cache.get('https://example.com/').should.be(None)
+
+    def test_cache_evicts_least_recently_used_entries(self):
+        cache = DiscoveryCache(max_entries=2)
+        headers = {'cache-control': 'max-age=60'}
+        cache.store('https://a.example.com/', self.data, headers)
+        cache.store('https://b.example.com/', self.data, headers)
+        cache.get('https://a.example.com/')
+        cache.store('https://c.example.com/', self.data, headers)
+        cache.get('https://b.example.com/').should.be(None)
+        cache.get('https://a.example.com/').shouldnt.be(None)
+
+    def test_refresh_keeps_previous_validators(self):
+        cache = DiscoveryCache()
+        entry = cache.store('https://example.com/', self.data,
+                            {'cache-control': 'no-cache', 'etag': '"abc"'})
+        entry = cache.refresh('https://example.com/', entry,
+                              {'cache-control': 'max-age=60'})
+        entry.etag.should.equal('"abc"')
+        entry.fresh.should.be(True)
+
+
+class TTLCacheTestCase(TestCase):
+
+    def test_cache_returns_stored_values(self):
+        cache = TTLCache()
+        cache.set('key', 'value')
+        cache.get('key').should.equal('value')
+        cache.get('missing', 'default').should.equal('default')
+
+    def test_cache_expires_entries(self):
+        cache = TTLCache(ttl=60)
+        cache.set('key', 'value')
+        with patch('dummyauth.cache.time.monotonic',
+                   return_value=time.monotonic() + 61):
+            cache.get('key').should.be(None)
+        len(cache).should.equal(0)
+
+    def test_cache_evicts_least_recently_used_entries(self):
+        cache = TTLCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        cache.get('b').should.be(None)
+        cache.get('a').should.equal(1)
@@ -0,0 +1,38 @@
+import sure
+from dummyauth.strategy import DiscoveryStrategy
+from unittest import TestCase
+
+
+class DiscoveryStrategyTestCase(TestCase):
+
+    def test_strategy_sends_head_to_unknown_hosts(self):
+        strategy = DiscoveryStrategy()
+        strategy.skip_head('http://example.com/').should.be(False)
+
+    def test_strategy_skips_head_after_a_streak_of_html_hits(self):
+        strategy = DiscoveryStrategy(html_threshold=2)
+        strategy.record('http://example.com/a', False, True)
+        strategy.skip_head('http://example.com/b').should.be(False)
+        strategy.record('http://example.com/b', False, True)
+        strategy.skip_head('http://EXAMPLE.com/c').should.be(True)
+
+    def test_strategy_resets_the_streak_on_header_hits(self):
+        strategy = DiscoveryStrategy(html_threshold=1)
+        strategy.record('http://example.com/', False, True)
+        strategy.record('http://example.com/', True, False)
+        strategy.skip_head('http://example.com/').should.be(False)
+
+    def test_strategy_can_be_disabled(self):
+        strategy = DiscoveryStrategy(html_threshold=0)
+        for i in range(5):
+            strategy.record('http://example.com/', False, True)
+        strategy.skip_head('http://example.com/').should.be(False)
+        strategy.head_not_allowed('http://example.com/')
+        strategy.skip_head('http://example.com/').should.be(True)
+
+    def test_strategy_forgets_least_recently_seen_hosts(self):
+        strategy = DiscoveryStrategy(max_hosts=2)
+        for host in ('a', 'b', 'c'):
+            strategy.record('http://{}.example.com/'.format(host), True, False)
+        sorted(strategy.stats()).should.equal(['b.example.com',
+                                               'c.example.com'])
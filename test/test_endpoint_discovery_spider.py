@@ -1,50 +1,245 @@
+import asyncio
 import httpretty
+import requests
+import socket
 import sure
-from dummyauth.spider import EndpointDiscoverySpider
+from dummyauth.aio import AsyncHTTPClient
+from dummyauth.breaker import CircuitBreaker
+from dummyauth.cache import DiscoveryCache, NegativeCache, RedirectMemo, \
+    discovery_cache, negative_cache, redirect_memo
+from dummyauth.client import HTTPClient
+from dummyauth.exceptions import RedirectionException, \
+    UnreachableProfileException
+from dummyauth.resolver import dns_cache
+from dummyauth.spider import AsyncAuthorizationCodeValidator, \
+    AsyncEndpointDiscoverySpider, AuthorizationCodeValidator, \
+    EndpointDiscoverySpider
+from dummyauth.strategy import DiscoveryStrategy, discovery_strategy
+from standin import StandInServer, run_coroutine
 from unittest import TestCase
+from unittest.mock import patch
 
+open_connection = asyncio.open_connection
 
-class EndpointDiscoverySpiderTestCase(TestCase):
 
-    @httpretty.httprettified
+class FailingHTTPClient(HTTPClient):
+    """ A client whose requests always fail with the given error. """
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+        self.calls = 0
+
+    def fetch(self, fetch, deadline=None):
+        self.calls += 1
+        raise self.error
+
+
+class FailingAsyncHTTPClient(AsyncHTTPClient):
+    """ An async client whose requests always fail with the given error. """
+
+    def __init__(self, error):
+        super().__init__()
+        self.error = error
+        self.calls = 0
+
+    async def fetch(self, fetch, deadline=None):
+        self.calls += 1
+        raise self.error
+
+
+class HTTPrettyBackend(object):
+    """
+    Runs the tests using the blocking spider and validator, whose
+    HTTPClient is answered by httpretty.
+    """
+
+    timeout_error = requests.exceptions.ReadTimeout
+    connection_error = requests.exceptions.ConnectionError
+
+    def setUp(self):
+        super().setUp()
+        httpretty.reset()
+        httpretty.enable()
+        self.addCleanup(httpretty.reset)
+        self.addCleanup(httpretty.disable)
+
+    def register(self, method: str, url: str, status: int=200,
+                 headers: dict=None, body: str=''):
+        httpretty.register_uri(method, url, status=status,
+                               adding_headers=headers, body=body)
+
+    def reset(self):
+        httpretty.reset()
+
+    def sent(self) -> list:
+        return httpretty.latest_requests()
+
+    def dns_error(self) -> Exception:
+        error = requests.exceptions.ConnectionError()
+        error.__context__ = socket.gaierror(-2, 'Name or service not known')
+        return error
+
+    def failing_client(self, error: Exception):
+        return FailingHTTPClient(error)
+
+    def discover(self, url: str, **kwargs):
+        spider = EndpointDiscoverySpider(url, **kwargs)
+        spider.authorization_endpoint
+        return spider
+
+    def verify(self, *args, **kwargs):
+        validator = AuthorizationCodeValidator(*args, **kwargs)
+        validator.valid
+        return validator
+
+
+class StandInNetwork(object):
+    """
+    Stands in for every host the AsyncHTTPClient connects to, using a
+    StandInServer for http URLs and another one for https URLs, which is
+    spoken in plain text. Both share their routes and requests.
+    """
+
+    def __init__(self):
+        http, https = StandInServer('http'), StandInServer('https')
+        https.routes, https.requests = http.routes, http.requests
+        self.routes, self.requests = http.routes, http.requests
+        self.servers = {80: http, 443: https}
+
+    @property
+    def connections(self) -> int:
+        return sum(server.connections for server in self.servers.values())
+
+    def start(self):
+        for server in self.servers.values():
+            server.start()
+
+    def stop(self):
+        for server in self.servers.values():
+            server.stop()
+
+    def register(self, method: str, url: str, *args, **kwargs):
+        self.servers[80].register(method, url, *args, **kwargs)
+
+    async def open_connection(self, host: str, port: int, **kwargs):
+        # The TLS arguments are left out, the servers don't speak it.
+        server = self.servers.get(port)
+        if server is None:
+            raise ConnectionRefusedError(111, 'Connection refused')
+        return await open_connection('127.0.0.1', server.server_port)
+
+
+class StandInBackend(object):
+    """
+    Runs the tests using the non-blocking spider and validator, whose
+    AsyncHTTPClient connects to a StandInNetwork instead of the hosts.
+    """
+
+    timeout_error = asyncio.TimeoutError
+    connection_error = ConnectionRefusedError
+
+    def setUp(self):
+        super().setUp()
+        self.network = StandInNetwork()
+        self.network.start()
+        self.addCleanup(self.network.stop)
+        for patcher in [
+            patch('asyncio.open_connection', self.network.open_connection),
+            patch.object(dns_cache, 'cached_addresses',
+                         return_value=['127.0.0.1']),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = AsyncHTTPClient(breaker=CircuitBreaker())
+
+    def register(self, method: str, url: str, status: int=200,
+                 headers: dict=None, body: str='', **kwargs):
+        self.network.register(method, url, status, headers, body, **kwargs)
+
+    def reset(self):
+        self.network.routes.clear()
+        del self.network.requests[:]
+
+    def sent(self) -> list:
+        return list(self.network.requests)
+
+    def dns_error(self) -> Exception:
+        return socket.gaierror(-2, 'Name or service not known')
+
+    def failing_client(self, error: Exception):
+        return FailingAsyncHTTPClient(error)
+
+    def wait(self, awaitable):
+        """ Awaits on a new event loop, closing the connections after. """
+        async def run():
+            try:
+                return await awaitable
+            finally:
+                await self.client.close()
+        return run_coroutine(run())
+
+    def discover(self, url: str, **kwargs):
+        kwargs.setdefault('client', self.client)
+        spider = AsyncEndpointDiscoverySpider(url, **kwargs)
+        self.wait(spider.discover())
+        return spider
+
+    def verify(self, *args, **kwargs):
+        kwargs.setdefault('client', self.client)
+        validator = AsyncAuthorizationCodeValidator(*args, **kwargs)
+        self.wait(validator.verify())
+        return validator
+
+
+class SpiderTests(object):
+
+    def setUp(self):
+        super().setUp()
+        # What the shared caches learn in a test must not leak into others.
+        discovery_strategy.clear()
+        discovery_cache.clear()
+        redirect_memo.clear()
+        negative_cache.clear()
+
+
+class EndpointDiscoverySpiderTests(SpiderTests):
+
     def test_spider_can_use_headers_for_auth_endpoint(self):
         # Set up the authorization endpoint as an HTTP header.
         request_headers = ', '.join([
             '<http://login.example.com/auth>; rel="authorization_endpoint"',
             '<http://login.example.com/token>; rel="token_endpoint"'
         ])
-        httpretty.register_uri(httpretty.HEAD, 'http://johndoe.example.com',
-                               adding_headers={'Link': request_headers})
+        self.register('HEAD', 'http://johndoe.example.com',
+                      headers={'Link': request_headers})
 
-        spider = EndpointDiscoverySpider('http://johndoe.example.com')
+        spider = self.discover('http://johndoe.example.com')
         auth_endpoint = spider.authorization_endpoint
         token_endpoint = spider.token_endpoint
 
         auth_endpoint.should.equal('http://login.example.com/auth')
         token_endpoint.should.equal('http://login.example.com/token')
 
-    @httpretty.httprettified
     def test_spider_solves_non_absolute_links_in_headers(self):
         # Set up the authorization endpoint as an HTTP header.
         request_headers = ', '.join([
             '</auth>; rel="authorization_endpoint"',
             '<extra/token>; rel="token_endpoint"'
         ])
-        httpretty.register_uri(httpretty.HEAD, 'http://example.com/johndoe/',
-                               adding_headers={'Link': request_headers})
+        self.register('HEAD', 'http://example.com/johndoe/',
+                      headers={'Link': request_headers})
 
-        spider = EndpointDiscoverySpider('http://example.com/johndoe/')
+        spider = self.discover('http://example.com/johndoe/')
         auth_endpoint = spider.authorization_endpoint
         token_endpoint = spider.token_endpoint
 
         auth_endpoint.should.equal('http://example.com/auth')
         token_endpoint.should.equal('http://example.com/johndoe/extra/token')
 
-    @httpretty.httprettified
     def test_spider_fetches_html_if_no_headers_have_links(self):
-        httpretty.register_uri(httpretty.HEAD, 'http://johndoe.example.com')
-        httpretty.register_uri(httpretty.GET, 'http://johndoe.example.com',
-                               body="""<!DOCTYPE html>
+        self.register('HEAD', 'http://johndoe.example.com')
+        self.register('GET', 'http://johndoe.example.com', body="""<!DOCTYPE html>
         <html>
             <head>
                 <title>John Doe Website</title>
@@ -55,18 +250,16 @@ class EndpointDiscoverySpiderTestCase(TestCase):
         </html>
         """)
 
-        spider = EndpointDiscoverySpider('http://johndoe.example.com')
+        spider = self.discover('http://johndoe.example.com')
         auth_endpoint = spider.authorization_endpoint
         token_endpoint = spider.token_endpoint
 
         auth_endpoint.should.equal('http://auth.example.com/')
         token_endpoint.should.equal('http://token.example.com/')
 
-    @httpretty.httprettified
     def test_spider_solves_non_absolute_links_in_html(self):
-        httpretty.register_uri(httpretty.HEAD, 'http://example.com/johndoe/')
-        httpretty.register_uri(httpretty.GET, 'http://example.com/johndoe/',
-                               body="""<!DOCTYPE html>
+        self.register('HEAD', 'http://example.com/johndoe/')
+        self.register('GET', 'http://example.com/johndoe/', body="""<!DOCTYPE html>
         <html>
             <head>
                 <title>John Doe Website</title>
@@ -77,20 +270,18 @@ class EndpointDiscoverySpiderTestCase(TestCase):
         </html>
         """)
 
-        spider = EndpointDiscoverySpider('http://example.com/johndoe/')
+        spider = self.discover('http://example.com/johndoe/')
         auth_endpoint = spider.authorization_endpoint
         token_endpoint = spider.token_endpoint
 
         auth_endpoint.should.equal('http://example.com/auth')
         token_endpoint.should.equal('http://example.com/johndoe/extra/token')
 
-    @httpretty.httprettified
     def test_spider_fetches_html_if_a_header_is_missing(self):
         link = '<http://auth.example.com/>; rel="authorization_endpoint"'
-        httpretty.register_uri(httpretty.HEAD, 'http://johndoe.example.com',
-                               adding_headers={'Link': link})
-        httpretty.register_uri(httpretty.GET, 'http://johndoe.example.com',
-                               body="""<!DOCTYPE html>
+        self.register('HEAD', 'http://johndoe.example.com',
+                      headers={'Link': link})
+        self.register('GET', 'http://johndoe.example.com', body="""<!DOCTYPE html>
         <html>
             <head>
                 <title>John Doe Website</title>
@@ -100,20 +291,18 @@ class EndpointDiscoverySpiderTestCase(TestCase):
         </html>
         """)
 
-        spider = EndpointDiscoverySpider('http://johndoe.example.com')
+        spider = self.discover('http://johndoe.example.com')
         auth_endpoint = spider.authorization_endpoint
         token_endpoint = spider.token_endpoint
 
         auth_endpoint.should.equal('http://auth.example.com/')
         token_endpoint.should.equal('http://token.example.com/')
 
-    @httpretty.httprettified
     def test_spider_prioritizes_headers_over_html_tags(self):
         link = '<http://auth.example.com/>; rel="authorization_endpoint"'
-        httpretty.register_uri(httpretty.HEAD, 'http://johndoe.example.com',
-                               adding_headers={'Link': link})
-        httpretty.register_uri(httpretty.GET, 'http://johndoe.example.com',
-                               body="""<!DOCTYPE html>
+        self.register('HEAD', 'http://johndoe.example.com',
+                      headers={'Link': link})
+        self.register('GET', 'http://johndoe.example.com', body="""<!DOCTYPE html>
         <html>
             <head>
                 <title>John Doe Website</title>
@@ -124,15 +313,13 @@ class EndpointDiscoverySpiderTestCase(TestCase):
         </html>
         """)
 
-        spider = EndpointDiscoverySpider('http://johndoe.example.com')
+        spider = self.discover('http://johndoe.example.com')
         auth_endpoint = spider.authorization_endpoint
         auth_endpoint.should.equal('http://auth.example.com/')
 
-    @httpretty.httprettified
     def test_spider_parses_relme_as_fallback(self):
-        httpretty.register_uri(httpretty.HEAD, 'http://example.com/johndoe/')
-        httpretty.register_uri(httpretty.GET, 'http://example.com/johndoe/',
-                               body="""<!DOCTYPE html>
+        self.register('HEAD', 'http://example.com/johndoe/')
+        self.register('GET', 'http://example.com/johndoe/', body="""<!DOCTYPE html>
         <html>
             <head>
                 <title>John Doe Website</title>
@@ -142,14 +329,12 @@ class EndpointDiscoverySpiderTestCase(TestCase):
         </html>
         """)
 
-        spider = EndpointDiscoverySpider('http://example.com/johndoe/')
+        spider = self.discover('http://example.com/johndoe/')
         spider.supports_relmeauth().should.equal(True)
 
-    @httpretty.httprettified
     def test_spider_counts_no_relme_links_as_no_relmeauth(self):
-        httpretty.register_uri(httpretty.HEAD, 'http://example.com/johndoe/')
-        httpretty.register_uri(httpretty.GET, 'http://example.com/johndoe/',
-                               body="""<!DOCTYPE html>
+        self.register('HEAD', 'http://example.com/johndoe/')
+        self.register('GET', 'http://example.com/johndoe/', body="""<!DOCTYPE html>
         <html>
             <head>
                 <title>John Doe Website</title>
@@ -157,37 +342,459 @@ class EndpointDiscoverySpiderTestCase(TestCase):
         </html>
         """)
 
-        spider = EndpointDiscoverySpider('http://example.com/johndoe/')
+        spider = self.discover('http://example.com/johndoe/')
         spider.supports_relmeauth().should.equal(False)
 
-    @httpretty.httprettified
     def test_spider_follows_temporally_redirects(self):
         old_headers = {'Location': 'http://new.example.com'}
-        httpretty.register_uri(httpretty.HEAD, 'http://old.example.com',
-                               status=302, adding_headers=old_headers)
+        self.register('HEAD', 'http://old.example.com', status=302,
+                      headers=old_headers)
         link_tags = ', '.join([
             '<http://login.example.com/auth>; rel="authorization_endpoint"',
             '<http://login.example.com/token>; rel="token_endpoint"'
         ])
-        httpretty.register_uri(httpretty.HEAD, 'http://new.example.com',
-                               adding_headers={'Link': link_tags})
+        self.register('HEAD', 'http://new.example.com',
+                      headers={'Link': link_tags})
 
-        spider = EndpointDiscoverySpider('http://old.example.com')
+        spider = self.discover('http://old.example.com')
         spider.canonical_url.should.equal('http://old.example.com')
         spider.target_url.should.equal('http://new.example.com')
 
-    @httpretty.httprettified
     def test_spider_follows_permanent_redirects(self):
         old_headers = {'Location': 'http://new.example.com'}
-        httpretty.register_uri(httpretty.HEAD, 'http://old.example.com',
-                               status=301, adding_headers=old_headers)
+        self.register('HEAD', 'http://old.example.com', status=301,
+                      headers=old_headers)
         link_tags = ', '.join([
             '<http://login.example.com/auth>; rel="authorization_endpoint"',
             '<http://login.example.com/token>; rel="token_endpoint"'
         ])
-        httpretty.register_uri(httpretty.HEAD, 'http://new.example.com',
-                               adding_headers={'Link': link_tags})
+        self.register('HEAD', 'http://new.example.com',
+                      headers={'Link': link_tags})
 
-        spider = EndpointDiscoverySpider('http://old.example.com')
+        spider = self.discover('http://old.example.com')
         spider.canonical_url.should.equal('http://new.example.com')
         spider.target_url.should.equal('http://new.example.com')
+
+
+class EndpointDiscoverySpiderTestCase(EndpointDiscoverySpiderTests,
+                                      HTTPrettyBackend, TestCase):
+    pass
+
+
+class AsyncEndpointDiscoverySpiderTestCase(EndpointDiscoverySpiderTests,
+                                           StandInBackend, TestCase):
+
+    def discover_all(self, spiders: list):
+        async def discover():
+            await asyncio.gather(*(spider.discover() for spider in spiders))
+        self.wait(discover())
+
+    def test_spider_requires_discover_before_reading_properties(self):
+        spider = AsyncEndpointDiscoverySpider('http://johndoe.example.com/')
+        (lambda: spider.authorization_endpoint).should.throw(RuntimeError)
+
+    def test_spider_reads_chunked_documents(self):
+        html = """<html><head>
+            <link rel="me" href="https://github.com/johndoe">
+        </head><body>""" + 'x' * 5000
+        self.register('HEAD', 'http://johndoe.example.com/')
+        self.register('GET', 'http://johndoe.example.com/', body=html,
+                      headers={'Transfer-Encoding': 'chunked'}, pieces=1000)
+        spider = self.discover('http://johndoe.example.com/')
+        spider.supports_relmeauth().should.be(True)
+
+    def test_spider_runs_many_discoveries_on_one_loop_reusing_connections(self):
+        for i in range(20):
+            self.register('HEAD', 'http://example.com/user{}'.format(i),
+                          headers={'Link': '</auth>; rel="authorization_endpoint"'})
+            self.register('GET', 'http://example.com/user{}'.format(i))
+        spiders = [AsyncEndpointDiscoverySpider(
+            'http://example.com/user{}'.format(i), client=self.client,
+            cache=DiscoveryCache()) for i in range(20)]
+        self.discover_all(spiders)
+        for spider in spiders:
+            spider.authorization_endpoint.should.equal(
+                'http://example.com/auth')
+        len(self.sent()).should.equal(40)
+        self.network.connections.should.be.lower_than(20)
+
+    def test_concurrent_discoveries_of_the_same_url_are_coalesced(self):
+        self.register('HEAD', 'http://johndoe.example.com/', headers={
+            'Link': '</auth>; rel="authorization_endpoint", '
+                    '</token>; rel="token_endpoint"'})
+        spiders = [AsyncEndpointDiscoverySpider(
+            'http://johndoe.example.com/', client=self.client,
+            cache=DiscoveryCache()) for _ in range(5)]
+        self.discover_all(spiders)
+        for spider in spiders:
+            spider.token_endpoint.should.equal(
+                'http://johndoe.example.com/token')
+        len(self.sent()).should.equal(1)
+
+
+class EndpointDiscoverySpiderCacheTests(SpiderTests):
+
+    html_body = """<!DOCTYPE html>
+    <html>
+        <head>
+            <link rel="authorization_endpoint" href="http://auth.example.com/">
+            <link rel="token_endpoint" href="http://token.example.com/">
+        </head>
+    </html>
+    """
+
+    def test_spider_serves_fresh_documents_from_cache(self):
+        cache_headers = {'Cache-Control': 'max-age=300'}
+        self.register('HEAD', 'http://johndoe.example.com/',
+                      headers=cache_headers)
+        self.register('GET', 'http://johndoe.example.com/',
+                      headers=cache_headers, body=self.html_body)
+
+        cache = DiscoveryCache()
+        self.discover('http://johndoe.example.com/', cache=cache)
+        requests_sent = len(self.sent())
+
+        spider = self.discover('http://johndoe.example.com/', cache=cache)
+        spider.authorization_endpoint.should.equal('http://auth.example.com/')
+        spider.token_endpoint.should.equal('http://token.example.com/')
+        len(self.sent()).should.equal(requests_sent)
+
+    def test_spider_revalidates_stale_documents(self):
+        cache_headers = {'Cache-Control': 'no-cache', 'ETag': '"v1"'}
+        self.register('HEAD', 'http://johndoe.example.com/',
+                      headers=cache_headers)
+        self.register('GET', 'http://johndoe.example.com/',
+                      headers=cache_headers, body=self.html_body)
+
+        cache = DiscoveryCache()
+        self.discover('http://johndoe.example.com/', cache=cache)
+
+        self.reset()
+        self.register('HEAD', 'http://johndoe.example.com/', status=304,
+                      headers=cache_headers)
+        spider = self.discover('http://johndoe.example.com/', cache=cache)
+        spider.authorization_endpoint.should.equal('http://auth.example.com/')
+        request = self.sent()[-1]
+        request.method.should.equal('HEAD')
+        request.headers['If-None-Match'].should.equal('"v1"')
+
+    def test_spider_reuses_parsed_html_if_get_is_not_modified(self):
+        cache_headers = {'Cache-Control': 'no-cache', 'ETag': '"v1"'}
+        self.register('HEAD', 'http://johndoe.example.com/',
+                      headers=cache_headers)
+        self.register('GET', 'http://johndoe.example.com/',
+                      headers=cache_headers, body=self.html_body)
+
+        cache = DiscoveryCache()
+        self.discover('http://johndoe.example.com/', cache=cache)
+
+        self.reset()
+        self.register('HEAD', 'http://johndoe.example.com/',
+                      headers=cache_headers)
+        self.register('GET', 'http://johndoe.example.com/', status=304,
+                      headers=cache_headers)
+        spider = self.discover('http://johndoe.example.com/', cache=cache)
+        spider.token_endpoint.should.equal('http://token.example.com/')
+        self.sent()[-1].method.should.equal('GET')
+
+    def test_spider_does_not_cache_no_store_documents(self):
+        cache_headers = {'Cache-Control': 'no-store', 'ETag': '"v1"'}
+        self.register('HEAD', 'http://johndoe.example.com/',
+                      headers=cache_headers)
+        self.register('GET', 'http://johndoe.example.com/',
+                      headers=cache_headers, body=self.html_body)
+
+        cache = DiscoveryCache()
+        self.discover('http://johndoe.example.com/', cache=cache)
+        len(cache).should.equal(0)
+
+
+class EndpointDiscoverySpiderCacheTestCase(EndpointDiscoverySpiderCacheTests,
+                                           HTTPrettyBackend, TestCase):
+    pass
+
+
+class AsyncEndpointDiscoverySpiderCacheTestCase(
+        EndpointDiscoverySpiderCacheTests, StandInBackend, TestCase):
+    pass
+
+
+class EndpointDiscoverySpiderStrictModeTests(SpiderTests):
+
+    def test_strict_spider_finds_links_outside_of_head(self):
+        self.register('HEAD', 'http://johndoe.example.com/')
+        self.register('GET', 'http://johndoe.example.com/', body="""<!DOCTYPE html>
+        <html>
+            <head><title>John Doe Website</title></head>
+            <body>
+                <link rel="authorization_endpoint" href="/auth">
+            </body>
+        </html>
+        """)
+
+        spider = self.discover('http://johndoe.example.com/', strict=True,
+                               cache=DiscoveryCache())
+        spider.authorization_endpoint.should.equal(
+            'http://johndoe.example.com/auth')
+
+        spider = self.discover('http://johndoe.example.com/',
+                               cache=DiscoveryCache())
+        spider.authorization_endpoint.should.be(None)
+
+
+class EndpointDiscoverySpiderStrictModeTestCase(
+        EndpointDiscoverySpiderStrictModeTests, HTTPrettyBackend, TestCase):
+    pass
+
+
+class AsyncEndpointDiscoverySpiderStrictModeTestCase(
+        EndpointDiscoverySpiderStrictModeTests, StandInBackend, TestCase):
+    pass
+
+
+class EndpointDiscoverySpiderStrategyTests(SpiderTests):
+
+    html_body = """<!DOCTYPE html>
+    <html>
+        <head>
+            <link rel="authorization_endpoint" href="http://auth.example.com/">
+            <link rel="token_endpoint" href="http://token.example.com/">
+        </head>
+    </html>
+    """
+
+    def discover_with(self, strategy):
+        spider = self.discover('http://johndoe.example.com/',
+                               cache=DiscoveryCache(), strategy=strategy,
+                               failures=NegativeCache())
+        spider.authorization_endpoint.should.equal('http://auth.example.com/')
+        return spider
+
+    def test_spider_skips_head_for_hosts_advertising_in_html(self):
+        self.register('HEAD', 'http://johndoe.example.com/')
+        self.register('GET', 'http://johndoe.example.com/',
+                      body=self.html_body)
+        strategy = DiscoveryStrategy(html_threshold=2)
+        self.discover_with(strategy)
+        self.discover_with(strategy)
+        len(self.sent()).should.equal(4)
+
+        self.discover_with(strategy)
+        len(self.sent()).should.equal(5)
+        self.sent()[-1].method.should.equal('GET')
+        stats = strategy.stats()['johndoe.example.com']
+        stats['heads_sent'].should.equal(2)
+        stats['heads_skipped'].should.equal(1)
+
+    def test_spider_falls_back_to_get_if_head_is_not_allowed(self):
+        self.register('HEAD', 'http://johndoe.example.com/', status=405)
+        self.register('GET', 'http://johndoe.example.com/',
+                      body=self.html_body)
+        strategy = DiscoveryStrategy()
+        self.discover_with(strategy)
+        [r.method for r in self.sent()].should.equal(['HEAD', 'GET'])
+
+        self.discover_with(strategy)
+        [r.method for r in self.sent()].should.equal(['HEAD', 'GET', 'GET'])
+        strategy.stats()['johndoe.example.com']['head_not_allowed'] \
+            .should.be(True)
+
+    def test_spider_goes_back_to_head_when_headers_have_links(self):
+        link = ', '.join([
+            '<http://auth.example.com/>; rel="authorization_endpoint"',
+            '<http://token.example.com/>; rel="token_endpoint"'
+        ])
+        self.register('GET', 'http://johndoe.example.com/',
+                      headers={'Link': link}, body=self.html_body)
+        strategy = DiscoveryStrategy(html_threshold=1)
+        strategy.record('http://johndoe.example.com/', False, True)
+        self.discover_with(strategy)
+        self.sent()[-1].method.should.equal('GET')
+
+        self.register('HEAD', 'http://johndoe.example.com/',
+                      headers={'Link': link})
+        self.discover_with(strategy)
+        self.sent()[-1].method.should.equal('HEAD')
+
+
+class EndpointDiscoverySpiderStrategyTestCase(
+        EndpointDiscoverySpiderStrategyTests, HTTPrettyBackend, TestCase):
+    pass
+
+
+class AsyncEndpointDiscoverySpiderStrategyTestCase(
+        EndpointDiscoverySpiderStrategyTests, StandInBackend, TestCase):
+    pass
+
+
+class EndpointDiscoverySpiderRedirectTests(SpiderTests):
+
+    link = ', '.join([
+        '<http://login.example.com/auth>; rel="authorization_endpoint"',
+        '<http://login.example.com/token>; rel="token_endpoint"'
+    ])
+
+    def discover_with(self, url, memo, **kwargs):
+        return self.discover(url, cache=DiscoveryCache(),
+                             strategy=DiscoveryStrategy(), redirects=memo,
+                             failures=NegativeCache(), **kwargs)
+
+    def test_spider_records_the_redirect_chain(self):
+        self.register('HEAD', 'http://example.com/', status=301,
+                      headers={'Location': 'https://example.com/'})
+        self.register('HEAD', 'https://example.com/', status=302,
+                      headers={'Location': 'https://www.example.com/'})
+        self.register('HEAD', 'https://www.example.com/',
+                      headers={'Link': self.link})
+
+        spider = self.discover_with('http://example.com/', RedirectMemo())
+        spider.redirect_chain.should.equal([
+            ('http://example.com/', 301, 'https://example.com/'),
+            ('https://example.com/', 302, 'https://www.example.com/'),
+        ])
+        spider.canonical_url.should.equal('https://example.com/')
+        spider.target_url.should.equal('https://www.example.com/')
+
+    def test_spider_memoizes_permanent_redirects_only(self):
+        self.register('HEAD', 'http://example.com/', status=308,
+                      headers={'Location': 'https://example.com/'})
+        self.register('HEAD', 'https://example.com/', status=307,
+                      headers={'Location': 'https://www.example.com/'})
+        self.register('HEAD', 'https://www.example.com/',
+                      headers={'Link': self.link})
+
+        memo = RedirectMemo()
+        self.discover_with('http://example.com/', memo)
+        self.reset()
+        self.register('HEAD', 'https://example.com/', status=307,
+                      headers={'Location': 'https://www.example.com/'})
+        self.register('HEAD', 'https://www.example.com/',
+                      headers={'Link': self.link})
+
+        spider = self.discover_with('http://example.com/', memo)
+        [r.headers['Host'] for r in self.sent()] \
+            .should.equal(['example.com', 'www.example.com'])
+        spider.canonical_url.should.equal('https://example.com/')
+        spider.target_url.should.equal('https://www.example.com/')
+        len(spider.redirect_chain).should.equal(2)
+
+    def test_spider_does_not_memoize_uncacheable_redirects(self):
+        self.register('HEAD', 'http://example.com/', status=301, headers={
+            'Location': 'https://example.com/',
+            'Cache-Control': 'no-store'})
+        self.register('HEAD', 'https://example.com/',
+                      headers={'Link': self.link})
+        memo = RedirectMemo()
+        self.discover_with('http://example.com/', memo)
+        len(memo).should.equal(0)
+
+    def test_spider_detects_redirect_loops(self):
+        self.register('HEAD', 'http://a.example.com/', status=302,
+                      headers={'Location': 'http://b.example.com/'})
+        self.register('HEAD', 'http://b.example.com/', status=302,
+                      headers={'Location': 'http://a.example.com/'})
+        with self.assertRaises(RedirectionException) as raised:
+            self.discover_with('http://a.example.com/', RedirectMemo(),
+                               redirection_limit=50)
+        raised.exception.message.should.contain('Redirect loop')
+        len(self.sent()).should.equal(2)
+
+    def test_spider_gives_up_after_too_many_redirects(self):
+        for i in range(3):
+            self.register('HEAD', 'http://example.com/{}'.format(i),
+                          status=302, headers={
+                              'Location': 'http://example.com/{}'.format(i + 1)})
+        with self.assertRaises(RedirectionException) as raised:
+            self.discover_with('http://example.com/0', RedirectMemo(),
+                               redirection_limit=2)
+        raised.exception.message.should.equal('Too many redirects.')
+
+
+class EndpointDiscoverySpiderRedirectTestCase(
+        EndpointDiscoverySpiderRedirectTests, HTTPrettyBackend, TestCase):
+    pass
+
+
+class AsyncEndpointDiscoverySpiderRedirectTestCase(
+        EndpointDiscoverySpiderRedirectTests, StandInBackend, TestCase):
+    pass
+
+
+class EndpointDiscoverySpiderNegativeCacheTests(SpiderTests):
+
+    def discover_with(self, url, failures, client=None):
+        kwargs = {} if client is None else {'client': client}
+        return self.discover(url, cache=DiscoveryCache(),
+                             strategy=DiscoveryStrategy(),
+                             redirects=RedirectMemo(), failures=failures,
+                             **kwargs)
+
+    def test_pages_without_endpoints_are_not_fetched_again(self):
+        self.register('HEAD', 'http://johndoe.example.com/')
+        self.register('GET', 'http://johndoe.example.com/',
+                      body='<html><head></head></html>')
+        failures = NegativeCache()
+        self.discover_with('http://johndoe.example.com/', failures)
+        len(self.sent()).should.equal(2)
+
+        spider = self.discover_with('http://johndoe.example.com/', failures)
+        len(self.sent()).should.equal(2)
+        spider.authorization_endpoint.should.be(None)
+        spider.supports_relmeauth().should.be(False)
+
+    def test_dns_failures_are_not_retried(self):
+        client = self.failing_client(self.dns_error())
+        failures = NegativeCache()
+        for _ in range(2):
+            with self.assertRaises(UnreachableProfileException) as raised:
+                self.discover_with('http://nowhere.example.com/', failures,
+                                   client)
+            raised.exception.message.should.contain('Could not resolve')
+        client.calls.should.equal(1)
+
+    def test_timeouts_are_not_retried(self):
+        client = self.failing_client(self.timeout_error())
+        failures = NegativeCache()
+        for _ in range(2):
+            with self.assertRaises(UnreachableProfileException) as raised:
+                self.discover_with('http://slow.example.com/', failures,
+                                   client)
+            raised.exception.message.should.contain('Timed out')
+        client.calls.should.equal(1)
+
+    def test_other_errors_are_not_cached(self):
+        client = self.failing_client(self.connection_error())
+        failures = NegativeCache()
+        for _ in range(2):
+            with self.assertRaises(self.connection_error):
+                self.discover_with('http://down.example.com/', failures,
+                                   client)
+        client.calls.should.equal(2)
+
+    def test_redirect_loops_are_not_followed_again(self):
+        self.register('HEAD', 'http://loop.example.com/', status=302,
+                      headers={'Location': 'http://loop.example.com/'})
+        failures = NegativeCache()
+        for _ in range(2):
+            with self.assertRaises(RedirectionException):
+                self.discover_with('http://loop.example.com/', failures)
+        len(self.sent()).should.equal(1)
+
+    def test_a_zero_ttl_disables_a_kind_of_failure(self):
+        client = self.failing_client(self.timeout_error())
+        failures = NegativeCache(ttls={'timeout': 0})
+        for _ in range(2):
+            with self.assertRaises(UnreachableProfileException):
+                self.discover_with('http://slow.example.com/', failures,
+                                   client)
+        client.calls.should.equal(2)
+
+
+class EndpointDiscoverySpiderNegativeCacheTestCase(
+        EndpointDiscoverySpiderNegativeCacheTests, HTTPrettyBackend, TestCase):
+    pass
+
+
+class AsyncEndpointDiscoverySpiderNegativeCacheTestCase(
+        EndpointDiscoverySpiderNegativeCacheTests, StandInBackend, TestCase):
+    pass
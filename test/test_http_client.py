@@ -0,0 +1,243 @@
+import asyncio
+import httpretty
+import re
+import requests
+import socket
+import sure
+from dummyauth.aio import AsyncHTTPClient
+from dummyauth.breaker import CircuitBreaker
+from dummyauth.client import BoundedReader, Fetch, HTTPClient, \
+    IdleExpiryMixin, failure_kind
+from standin import run_coroutine
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+
+class HTTPClientTestCase(TestCase):
+
+    def test_client_reuses_the_same_session(self):
+        client = HTTPClient()
+        client.session.should.be(client.session)
+
+    def test_client_builds_a_new_session_after_fork(self):
+        client = HTTPClient()
+        session = client.session
+        with patch('dummyauth.client.os.getpid', return_value=-1):
+            client.session.shouldnt.be(session)
+
+    def test_client_discards_session_when_reconfigured(self):
+        client = HTTPClient()
+        session = client.session
+        client.configure(pool_hosts=1, pool_maxsize=1, pool_block=True,
+                         idle_timeout=1)
+        client.session.shouldnt.be(session)
+
+    def test_client_applies_per_host_pool_limits(self):
+        client = HTTPClient(pool_hosts=3, pool_maxsize=2, pool_block=True)
+        adapter = client.session.get_adapter('https://example.com/')
+        pool = adapter.poolmanager.connection_from_url('https://example.com/')
+        pool.pool.maxsize.should.equal(2)
+        pool.block.should.be(True)
+        pool.idle_timeout.should.equal(30.0)
+
+    @httpretty.httprettified
+    def test_client_does_not_follow_redirects_on_head(self):
+        httpretty.register_uri(httpretty.HEAD, 'http://old.example.com/',
+                               status=301, adding_headers={
+                                   'Location': 'http://new.example.com/'})
+        response = HTTPClient().head('http://old.example.com/')
+        response.status_code.should.equal(301)
+
+
+class IdleExpiryMixinTestCase(TestCase):
+
+    class FakePool(object):
+        def __init__(self, conn):
+            self.conn = conn
+
+        def _get_conn(self, timeout=None):
+            return self.conn
+
+        def _put_conn(self, conn):
+            pass
+
+    def build_pool(self, conn, idle_timeout):
+        pool_class = type('Pool', (IdleExpiryMixin, self.FakePool),
+                          {'idle_timeout': idle_timeout})
+        return pool_class(conn)
+
+    def test_pool_reuses_recently_used_connections(self):
+        conn = Mock()
+        pool = self.build_pool(conn, idle_timeout=30)
+        pool._put_conn(conn)
+        pool._get_conn().should.be(conn)
+        conn.close.called.should.be(False)
+
+    def test_pool_drops_idle_connections(self):
+        conn = Mock()
+        pool = self.build_pool(conn, idle_timeout=30)
+        pool._put_conn(conn)
+        conn.idle_since -= 60
+        pool._get_conn().should.be(conn)
+        conn.close.called.should.be(True)
+
+
+class BoundedReaderTestCase(TestCase):
+
+    @httpretty.httprettified
+    def test_reader_reads_the_whole_body(self):
+        httpretty.register_uri(httpretty.GET, 'http://example.com/',
+                               body='0123456789' * 100)
+        response = HTTPClient().get('http://example.com/', stream=True)
+        reader = BoundedReader(max_bytes=4096, chunk_size=64)
+        content = reader.read(response)
+        bytes(content).should.equal(b'0123456789' * 100)
+        reader.complete.should.be(True)
+
+    @httpretty.httprettified
+    def test_reader_stops_at_the_limit(self):
+        httpretty.register_uri(httpretty.GET, 'http://example.com/',
+                               body='0123456789' * 100)
+        response = HTTPClient().get('http://example.com/', stream=True)
+        reader = BoundedReader(max_bytes=25, chunk_size=10)
+        chunks = [bytes(chunk) for chunk in reader.iter_chunks(response)]
+        chunks.should.equal([b'0123456789', b'0123456789', b'01234'])
+        reader.complete.should.be(False)
+        len(reader.content).should.equal(25)
+
+    @httpretty.httprettified
+    def test_reader_reuses_its_buffer(self):
+        httpretty.register_uri(httpretty.GET, 'http://example.com/',
+                               body='hello')
+        client = HTTPClient()
+        reader = client.reader()
+        first = reader.read(client.get('http://example.com/', stream=True))
+        second = reader.read(client.get('http://example.com/', stream=True))
+        first.obj.should.be(second.obj)
+        client.reader().should.be(reader)
+
+    def test_reader_drains_short_leftovers_to_reuse_the_connection(self):
+        # Only what urllib3 1.x responses have too.
+        response = Mock()
+        response.raw = Mock(spec=['length_remaining', 'read', 'release_conn'])
+        response.raw.length_remaining = 100
+        response.raw.read.side_effect = [b'x' * 64, b'x' * 36, b'']
+        reader = BoundedReader(max_bytes=10, chunk_size=64, drain_limit=1024)
+        reader.release(response)
+        response.raw.read.call_count.should.equal(3)
+        response.raw.release_conn.called.should.be(True)
+        response.close.called.should.be(False)
+
+    def test_reader_closes_connections_with_long_leftovers(self):
+        response = Mock()
+        response.raw.length_remaining = None
+        reader = BoundedReader(max_bytes=10, drain_limit=1024)
+        reader.release(response)
+        response.close.called.should.be(True)
+        response.raw.read.called.should.be(False)
+
+    def test_reader_closes_connections_that_send_more_than_announced(self):
+        response = Mock()
+        response.raw.length_remaining = 10
+        response.raw.read.return_value = b'x' * 64
+        reader = BoundedReader(max_bytes=10, chunk_size=64, drain_limit=100)
+        reader.release(response)
+        response.close.called.should.be(True)
+        response.raw.release_conn.called.should.be(False)
+
+    @httpretty.httprettified
+    def test_reader_reuses_the_connection_after_stopping_early(self):
+        httpretty.register_uri(httpretty.GET, 'http://example.com/',
+                               body='0123456789' * 10)
+        response = HTTPClient().get('http://example.com/', stream=True)
+        reader = BoundedReader(max_bytes=25, chunk_size=10)
+        reader.read(response)
+        reader.complete.should.be(False)
+        response.raw.length_remaining.should.equal(0)
+
+
+class FailureKindTestCase(TestCase):
+
+    def test_resolution_errors_are_found_in_the_causes(self):
+        try:
+            try:
+                raise socket.gaierror(-2, 'Name or service not known')
+            except socket.gaierror as e:
+                raise requests.exceptions.ConnectionError(e)
+        except requests.exceptions.ConnectionError as e:
+            failure_kind(e).should.equal('dns')
+
+    def test_timeouts_are_recognized(self):
+        failure_kind(requests.exceptions.ConnectTimeout()).should.equal(
+            'timeout')
+        failure_kind(asyncio.TimeoutError()).should.equal('timeout')
+
+    def test_other_errors_have_no_kind(self):
+        failure_kind(requests.exceptions.ConnectionError()).should.be(None)
+        failure_kind(ValueError('nope')).should.be(None)
+
+
+class AsyncHTTPClientRetryTestCase(TestCase):
+    """ The server hangs up on the second request of every connection, as if
+    it had closed the connection right when the client reused it. """
+
+    def setUp(self):
+        self.received = []
+
+    async def handle(self, reader, writer):
+        try:
+            for served in range(2):
+                head = await reader.readuntil(b'\r\n\r\n')
+                length = re.search(rb'Content-Length: (\d+)', head)
+                if length:
+                    await reader.readexactly(int(length.group(1)))
+                self.received.append(head.split(b' ', 1)[0].decode())
+                if served:
+                    break
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok')
+                await writer.drain()
+        except asyncio.IncompleteReadError:
+            pass
+        writer.close()
+
+    def fetch_twice(self, method: str, data: dict=None):
+        async def fetch_twice():
+            server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+            url = 'http://127.0.0.1:{}/'.format(
+                server.sockets[0].getsockname()[1])
+            client = AsyncHTTPClient(breaker=CircuitBreaker())
+            try:
+                for _ in range(2):
+                    result = await client.fetch(
+                        Fetch(method, url, data=data, read_body=True))
+                return result
+            finally:
+                await client.close()
+                server.close()
+                await server.wait_closed()
+        return run_coroutine(fetch_twice())
+
+    def test_idempotent_requests_are_sent_again(self):
+        self.fetch_twice('GET').status_code.should.equal(200)
+        self.received.should.equal(['GET', 'GET', 'GET'])
+
+    def test_other_requests_are_not_sent_again(self):
+        with self.assertRaises((ConnectionError, asyncio.IncompleteReadError)):
+            self.fetch_twice('POST', {'code': 'deadbeef'})
+        self.received.should.equal(['POST', 'POST'])
+
+
+class AsyncHTTPClientConnectTestCase(TestCase):
+
+    def test_hosts_without_addresses_fail_to_connect(self):
+        async def fetch():
+            client = AsyncHTTPClient(breaker=CircuitBreaker())
+            try:
+                return await client.fetch(Fetch('GET', 'http://empty.test/'))
+            finally:
+                await client.close()
+        with patch('dummyauth.aio.dns_cache.cached_addresses',
+                   return_value=[]):
+            with self.assertRaises(ConnectionError) as context:
+                run_coroutine(fetch())
+        str(context.exception).should.contain('empty.test')
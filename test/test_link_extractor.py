@@ -0,0 +1,149 @@
+import sure
+from dummyauth.parser import LinkExtractor, extract_links_html5lib
+from unittest import TestCase
+
+# Documents used by the endpoint discovery spider test suite. Both parsers
+# should find the same links in all of them.
+SPIDER_FIXTURES = [
+    """<!DOCTYPE html>
+    <html>
+        <head>
+            <title>John Doe Website</title>
+            <link rel="canonical" href="http://johndoe.example.com">
+            <link rel="authorization_endpoint" href="http://auth.example.com/">
+            <link rel="token_endpoint" href="http://token.example.com/">
+        </head>
+    </html>
+    """,
+    """<!DOCTYPE html>
+    <html>
+        <head>
+            <title>John Doe Website</title>
+            <link rel="canonical" href="http://example.com/johndoe/">
+            <link rel="authorization_endpoint" href="/auth">
+            <link rel="token_endpoint" href="extra/token">
+        </head>
+    </html>
+    """,
+    """<!DOCTYPE html>
+    <html>
+        <head>
+            <title>John Doe Website</title>
+            <link rel="canonical" href="http://johndoe.example.com">
+            <link rel="token_endpoint" href="http://token.example.com/">
+        </head>
+    </html>
+    """,
+    """<!DOCTYPE html>
+    <html>
+        <head>
+            <title>John Doe Website</title>
+            <link rel="me" href="https://twitter.com/danirod93">
+            <link rel="me" href="https://github.com/danirod">
+        </head>
+    </html>
+    """,
+    """<!DOCTYPE html>
+    <html>
+        <head>
+            <title>John Doe Website</title>
+        </head>
+    </html>
+    """,
+]
+
+
+def extract(document, base_url='http://example.com/johndoe/', chunk_size=None,
+            **kwargs):
+    extractor = LinkExtractor(base_url, **kwargs)
+    data = document.encode('utf-8')
+    chunk_size = chunk_size or len(data)
+    for i in range(0, len(data), chunk_size):
+        extractor.feed(data[i:i + chunk_size])
+    extractor.close()
+    return extractor
+
+
+class LinkExtractorTestCase(TestCase):
+
+    def test_extractor_matches_html5lib_on_spider_fixtures(self):
+        for document in SPIDER_FIXTURES:
+            expected = extract_links_html5lib(document.encode('utf-8'),
+                                              'http://example.com/johndoe/')
+            links = extract(document).links
+            for rel in expected:
+                links[rel][:1].should.equal(expected[rel][:1])
+
+    def test_extractor_does_not_depend_on_chunk_boundaries(self):
+        for document in SPIDER_FIXTURES:
+            extract(document, chunk_size=1).links.should.equal(
+                extract(document).links)
+
+    def test_extractor_understands_multi_valued_rel(self):
+        document = """<html><head>
+        <link rel="Authorization_Endpoint  token_endpoint" href="/indieauth">
+        </head></html>"""
+        extractor = extract(document)
+        extractor.first('authorization_endpoint').should.equal(
+            'http://example.com/indieauth')
+        extractor.first('token_endpoint').should.equal(
+            'http://example.com/indieauth')
+
+    def test_extractor_resolves_relative_links(self):
+        document = '<link rel="me" href="../janedoe/">'
+        extractor = extract(document, wanted=('me',))
+        extractor.first('me').should.equal('http://example.com/janedoe/')
+
+    def test_extractor_stops_when_leaving_head(self):
+        document = """<html><head><title>Hi</title></head>
+        <body><link rel="authorization_endpoint" href="/auth"></body></html>"""
+        extractor = LinkExtractor('http://example.com/')
+        extractor.feed(document.encode('utf-8'))
+        extractor.done.should.be(True)
+        extractor.links['authorization_endpoint'].should.equal([])
+
+    def test_extractor_stops_when_head_is_implicitly_closed(self):
+        document = """<title>Hi</title><div>
+        <link rel="authorization_endpoint" href="/auth">"""
+        extract(document).first('authorization_endpoint').should.be(None)
+
+    def test_extractor_stops_when_everything_was_found(self):
+        document = """<html><head>
+        <link rel="authorization_endpoint" href="/auth">
+        <link rel="token_endpoint" href="/token">
+        <link rel="me" href="https://github.com/johndoe">
+        <link rel="me" href="https://twitter.com/johndoe">"""
+        extractor = LinkExtractor('http://example.com/')
+        extractor.feed(document.encode('utf-8'))
+        extractor.done.should.be(True)
+        extractor.links['me'].should.equal(['https://github.com/johndoe'])
+
+    def test_extractor_finds_relme_anchors_in_body(self):
+        document = """<html><head></head><body>
+        <a rel="me" href="https://github.com/johndoe">GitHub</a>
+        <a rel="me nofollow" href="https://twitter.com/johndoe">Twitter</a>
+        <a rel="authorization_endpoint" href="/auth">Not a link</a>
+        </body></html>"""
+        extractor = extract(document, head_only=False, collect_all=True)
+        extractor.links['me'].should.equal([
+            'https://github.com/johndoe',
+            'https://twitter.com/johndoe',
+        ])
+        extractor.links['authorization_endpoint'].should.equal([])
+
+    def test_extractor_ignores_links_in_scripts(self):
+        document = """<html><head><script>
+        document.write('<link rel="authorization_endpoint" href="/fake">');
+        </script>
+        <link rel="authorization_endpoint" href="/auth">
+        </head></html>"""
+        extract(document).first('authorization_endpoint').should.equal(
+            'http://example.com/auth')
+
+    def test_extractor_decodes_using_the_given_encoding(self):
+        document = '<link rel="me" href="/jos\xe9/">'.encode('latin-1')
+        extractor = LinkExtractor('http://example.com/', wanted=('me',),
+                                  encoding='latin-1')
+        extractor.feed(document)
+        extractor.close()
+        extractor.first('me').should.equal('http://example.com/jos\xe9/')
@@ -0,0 +1,168 @@
+import multiprocessing
+import os
+import shutil
+import sure
+import tempfile
+from dummyauth import create_app
+from dummyauth.client import Fetch, build_result
+from dummyauth.metrics import Metrics, MmapValues, metrics, timed_fetch
+from dummyauth.parser import LinkExtractor
+from unittest import TestCase
+
+
+def increment_in_child(counter):
+    counter.inc(view='login_view', outcome='ok')
+    counter.inc(view='login_view', outcome='ok')
+
+
+class MetricsTestCase(TestCase):
+
+    def test_counters_are_rendered_in_text_format(self):
+        registry = Metrics()
+        counter = registry.counter('requests_total', 'Requests.', ('view',))
+        counter.inc(view='login')
+        counter.inc(2, view='login')
+        registry.render().should.equal(
+            '# HELP requests_total Requests.\n'
+            '# TYPE requests_total counter\n'
+            'requests_total{view="login"} 3\n')
+
+    def test_histograms_have_cumulative_buckets(self):
+        registry = Metrics()
+        histogram = registry.histogram('latency_seconds', 'Latency.',
+                                       buckets=(0.1, 1.0, float('inf')))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        registry.render().should.equal(
+            '# HELP latency_seconds Latency.\n'
+            '# TYPE latency_seconds histogram\n'
+            'latency_seconds_bucket{le="0.1"} 1\n'
+            'latency_seconds_bucket{le="1"} 2\n'
+            'latency_seconds_bucket{le="+Inf"} 2\n'
+            'latency_seconds_sum 0.55\n'
+            'latency_seconds_count 2\n')
+
+    def test_label_values_are_escaped(self):
+        registry = Metrics()
+        counter = registry.counter('errors_total', 'Errors.', ('message',))
+        counter.inc(message='say "hi"\n')
+        registry.render().should.contain(
+            'errors_total{message="say \\"hi\\"\\n"} 1')
+
+
+class SharedMetricsTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_values_survive_reopening_the_file(self):
+        path = os.path.join(self.directory, 'metrics_1.db')
+        values = MmapValues(path)
+        values.add('a', 1.5)
+        values.close()
+        values = MmapValues(path)
+        values.add('a', 1)
+        dict(values.items()).should.equal({'a': 2.5})
+        values.close()
+
+    def test_file_grows_when_full(self):
+        path = os.path.join(self.directory, 'metrics_1.db')
+        values = MmapValues(path)
+        for i in range(5000):
+            values.add('key-{}'.format(i), i)
+        values.close()
+        entries = dict(MmapValues.read_file(path))
+        len(entries).should.equal(5000)
+        entries['key-4999'].should.equal(4999)
+
+    def test_values_are_added_up_across_processes(self):
+        registry = Metrics(self.directory)
+        counter = registry.counter('requests_total', 'Requests.',
+                                   ('view', 'outcome'))
+        counter.inc(view='login_view', outcome='ok')
+
+        context = multiprocessing.get_context('fork')
+        child = context.Process(target=increment_in_child,
+                                args=(counter,))
+        child.start()
+        child.join()
+        child.exitcode.should.equal(0)
+
+        len(os.listdir(self.directory)).should.equal(2)
+        registry.render().should.contain(
+            'requests_total{view="login_view",outcome="ok"} 3\n')
+
+
+class TimedFetchTestCase(TestCase):
+
+    def run_flow(self, fetch, phase, result=None, error=None):
+        flow = timed_fetch(fetch, phase, (301, 302))
+        next(flow)
+        try:
+            if error is not None:
+                flow.throw(error)
+            flow.send(result)
+        except StopIteration:
+            pass
+
+    def test_requests_are_counted_by_phase_and_outcome(self):
+        before = metrics.collect()
+        self.run_flow(Fetch('HEAD', 'http://example.com/'), 'head',
+                      build_result(200, {}))
+        self.run_flow(Fetch('HEAD', 'http://example.com/'), 'head',
+                      build_result(301, {}))
+        self.run_flow.when.called_with(
+            Fetch('HEAD', 'http://example.com/'), 'head',
+            error=ConnectionError()).should.throw(ConnectionError)
+        after = metrics.collect()
+
+        def delta(phase, outcome):
+            key = '["dummyauth_outbound_requests_total",[["phase","{}"],' \
+                  '["outcome","{}"]]]'.format(phase, outcome)
+            return after.get(key, 0) - before.get(key, 0)
+
+        delta('head', '2xx').should.equal(1)
+        delta('redirect', '3xx').should.equal(1)
+        delta('head', 'error').should.equal(1)
+
+    def parse(self, body: bytes):
+        url = 'http://example.com/'
+
+        def build_parser(status_code, headers):
+            return LinkExtractor(url)
+        flow = timed_fetch(Fetch('GET', url, parser=build_parser), 'get')
+        parser = next(flow).parser(200, {})
+        parser.feed(body)
+        parsed = parser.finish(memoryview(body))
+        try:
+            flow.send(build_result(200, {}, parsed=parsed))
+        except StopIteration:
+            pass
+
+    def test_parses_are_counted_by_whether_links_were_found(self):
+        key = '["dummyauth_outbound_requests_total",[["phase","parse"],' \
+              '["outcome","{}"]]]'
+        before = metrics.collect()
+        self.parse(b'<html><head><title>Nothing</title></head></html>')
+        self.parse(b'<html><head><link rel="me" href="/me"></head></html>')
+        after = metrics.collect()
+        for outcome in ('empty', 'found'):
+            (after.get(key.format(outcome), 0) -
+             before.get(key.format(outcome), 0)).should.equal(1)
+
+
+class MetricsViewTestCase(TestCase):
+
+    def test_metrics_are_exposed_by_the_app(self):
+        app = create_app()
+        app.config['SECRET_KEY'] = 'secret'
+        client = app.test_client()
+        client.get('/')
+        response = client.get('/metrics')
+        response.status_code.should.equal(200)
+        response.content_type.should.contain('text/plain')
+        response.get_data(as_text=True).should.contain(
+            'dummyauth_view_requests_total{view="login_view",outcome="form"}')
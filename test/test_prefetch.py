@@ -0,0 +1,175 @@
+import re
+import sure
+import threading
+from dummyauth import create_app
+from dummyauth.asgi import ASGIApp
+from dummyauth.bulkhead import bulkhead
+from dummyauth.cache import discovery_cache, negative_cache
+from dummyauth.forms import normalize_profile_url, profile_url_memo
+from dummyauth.prefetch import Prefetcher, prefetcher
+from test_asgi import ASGIClient, ProviderServer
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import urlencode, urlsplit
+
+
+class PrefetcherTestCase(TestCase):
+
+    def setUp(self):
+        self.release = threading.Event()
+        self.running = threading.Semaphore(0)
+        self.calls = []
+
+    def tearDown(self):
+        self.release.set()
+
+    def blocked(self, value):
+        self.calls.append(value)
+        self.running.release()
+        self.release.wait(5)
+        return value
+
+    def test_calls_are_started_once_per_key(self):
+        fetcher = Prefetcher(workers=2)
+        fetcher.start('a', self.blocked, 1).should.equal('started')
+        fetcher.start('a', self.blocked, 2).should.equal('pending')
+        self.release.set()
+        fetcher.result('a').should.equal(1)
+        fetcher.start('a', self.blocked, 3).should.equal('ready')
+        self.calls.should.equal([1])
+
+    def test_unknown_keys_have_no_result(self):
+        Prefetcher().result('a').should.be.none
+
+    def test_too_many_pending_calls_are_turned_down(self):
+        fetcher = Prefetcher(workers=1, max_pending=1)
+        fetcher.start('a', self.blocked, 1).should.equal('started')
+        self.running.acquire(timeout=5)
+        fetcher.start('b', self.blocked, 2).should.equal('started')
+        fetcher.start('c', self.blocked, 3).should.equal('busy')
+
+    def test_taking_a_queued_call_cancels_it(self):
+        fetcher = Prefetcher(workers=1, max_pending=1)
+        fetcher.start('a', self.blocked, 1)
+        self.running.acquire(timeout=5)
+        fetcher.start('b', self.blocked, 2)
+        fetcher.take('b').should.be.none
+        fetcher.start('c', self.blocked, 3).should.equal('started')
+        self.release.set()
+        self.running.acquire(timeout=5)
+        fetcher.result('c').should.equal(3)
+        self.calls.should.equal([1, 3])
+
+    def test_no_workers_disable_it(self):
+        fetcher = Prefetcher(workers=0)
+        fetcher.enabled.should.be.false
+        fetcher.start('a', self.blocked, 1).should.equal('busy')
+
+
+class DiscoverViewTestCase(TestCase):
+
+    def setUp(self):
+        self.server = ProviderServer().start()
+        self.addCleanup(self.server.stop)
+        discovery_cache.clear()
+        negative_cache.clear()
+
+        self.app = create_app('lazy')
+        self.app.config['SECRET_KEY'] = 'prefetch'
+        self.addCleanup(prefetcher.clear)
+        self.client = self.app.test_client()
+
+    def url(self, path: str) -> str:
+        # Profile URLs may not have a port, which the provider has. Vouch
+        # for it in the memo of the validator.
+        url = self.server.url(path)
+        profile_url_memo.set(url, normalize_profile_url(url)._replace(
+            error=None))
+        self.addCleanup(profile_url_memo.discard, url)
+        return url
+
+    def csrf_token(self) -> str:
+        page = self.client.get('/').get_data(as_text=True)
+        return re.search(r'name="csrf_token" value="([^"]+)"', page).group(1)
+
+    def discover(self, url: str):
+        return self.client.post('/discover', data={
+            'csrf_token': self.csrf_token(), 'domain': url})
+
+    def log_in(self, url: str):
+        return self.client.post('/', data={'csrf_token': self.csrf_token(),
+                                           'domain': url})
+
+    def test_invalid_urls_are_rejected(self):
+        response = self.discover('ftp://example.com/')
+        response.status_code.should.equal(400)
+        response.get_json()['error'].should.equal('Please, use a valid URL')
+        self.discover('').status_code.should.equal(400)
+
+    def test_discoveries_need_the_csrf_token_of_the_form(self):
+        url = self.url('/alice')
+        self.client.get('/discover?' + urlencode({'me': url})) \
+            .status_code.should.equal(405)
+        response = self.client.post('/discover', data={'domain': url})
+        response.status_code.should.equal(400)
+        response.get_data(as_text=True).should.contain('CSRF')
+        response = self.client.post('/discover', data={
+            'csrf_token': 'forged', 'domain': url})
+        response.status_code.should.equal(400)
+        prefetcher.take(url).should.be.none
+        self.server.requested().should.be.empty
+
+    def test_login_uses_the_prefetched_discovery(self):
+        url = self.url('/alice')
+        response = self.discover(url)
+        response.status_code.should.equal(202)
+        response.headers['Cache-Control'].should.equal('no-store')
+        response.get_json().should.equal({'me': url, 'status': 'started'})
+
+        response = self.log_in(url)
+        response.status_code.should.equal(302)
+        urlsplit(response.headers['Location']).path.should.equal('/auth')
+        self.server.requested().should.equal([('HEAD', '/alice')])
+        self.discover(url).get_json()['status'].should.equal('ready')
+
+    def test_login_raises_the_prefetched_errors(self):
+        url = self.url('/loop')
+        self.discover(url)
+        response = self.log_in(url)
+        response.status_code.should.equal(502)
+        response.get_data(as_text=True).should.contain('Redirect loop')
+
+    def test_asgi_login_uses_the_prefetched_discovery(self):
+        url = self.url('/alice')
+        client = ASGIClient(ASGIApp(self.app))
+        status, _, _ = client.request('POST', '/discover', {
+            'csrf_token': client.csrf_token(), 'domain': url})
+        status.should.equal(202)
+        status, _, _ = client.request('POST', '/', {
+            'csrf_token': client.csrf_token(), 'domain': url})
+        status.should.equal(302)
+        self.server.requested().should.equal([('HEAD', '/alice')])
+
+    def test_asgi_login_discovers_what_the_bulkhead_turned_away(self):
+        url = self.url('/alice')
+        client = ASGIClient(ASGIApp(self.app))
+        slots = [bulkhead.acquire(url) for _ in range(bulkhead.per_host)]
+        status, _, _ = client.request('POST', '/discover', {
+            'csrf_token': client.csrf_token(), 'domain': url})
+        status.should.equal(202)
+        prefetcher.result(url).should.equal({})
+        for slot in slots:
+            bulkhead.release(slot)
+
+        # The blocking spider would hold the event loop up.
+        with patch('dummyauth.spider.EndpointDiscoverySpider',
+                   side_effect=AssertionError('blocking discovery')):
+            status, _, _ = client.request('POST', '/', {
+                'csrf_token': client.csrf_token(), 'domain': url})
+        status.should.equal(302)
+        self.server.requested().should.equal([('HEAD', '/alice')])
+
+    def test_disabled_prefetching_is_not_found(self):
+        prefetcher.workers = 0
+        self.addCleanup(setattr, prefetcher, 'workers', 4)
+        self.discover(self.url('/alice')).status_code.should.equal(404)
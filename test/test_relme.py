@@ -0,0 +1,129 @@
+import sure
+from dummyauth.aio import AsyncHTTPClient
+from dummyauth.cache import RelMeCache
+from dummyauth.client import HTTPClient
+from dummyauth.exceptions import UnreachableProfileException
+from dummyauth.spider import AsyncRelMeVerifier, RelMeVerifier, profile_key
+from standin import StandInServer, run_coroutine
+from unittest import TestCase
+
+
+class RelMeVerifierTestCase(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.addCleanup(self.server.stop)
+        self.client = HTTPClient()
+        self.addCleanup(self.client.close)
+        self.cache = RelMeCache()
+        self.profile = self.server.url('/me')
+
+    def profile_links_to(self, *paths, headers=None):
+        links = ''.join('<a rel="me" href="{}">x</a>'.format(path)
+                        for path in paths)
+        self.server.page('/me', '<html><head><title>Me</title></head>'
+                                '<body><p>Hi</p>{}</body></html>'.format(links),
+                         headers=headers)
+
+    def backlink(self, path: str, target: str=None, delay: float=0):
+        self.server.page(path, '<body><a href="{}" rel="me nofollow">'
+                               'me</a></body>'.format(target or self.profile),
+                         delay=delay)
+
+    def verifier(self, **kwargs):
+        return RelMeVerifier(self.profile, client=self.client,
+                             cache=self.cache, **kwargs)
+
+    def test_profile_key_ignores_scheme_case_and_trailing_slash(self):
+        profile_key('https://Example.com/').should.equal(
+            profile_key('http://example.com'))
+        profile_key('https://example.com/a').should_not.equal(
+            profile_key('https://example.com/b'))
+
+    def test_links_that_link_back_are_verified(self):
+        self.profile_links_to('/github', '/twitter', '/gone', 'mailto:me@x.y',
+                              '/me')
+        self.backlink('/github')
+        self.server.page('/twitter', '<a rel="me" href="/elsewhere">x</a>')
+        verifier = self.verifier()
+        verifier.links.should.equal([self.server.url('/github'),
+                                     self.server.url('/twitter'),
+                                     self.server.url('/gone')])
+        verifier.verified_links.should.equal([self.server.url('/github')])
+
+    def test_link_headers_are_candidates_and_backlinks(self):
+        self.profile_links_to(headers={'Link': '</github>; rel="me"'})
+        self.server.page('/github', headers={
+            'Link': '<{}>; rel="me"'.format(self.profile)})
+        self.verifier().verified_links.should.equal(
+            [self.server.url('/github')])
+
+    def test_backlinks_may_point_to_an_alias(self):
+        self.profile_links_to('/github')
+        self.backlink('/github', 'https://alias.example/')
+        self.verifier().verified_links.should.be.empty
+        self.cache.clear()
+        self.verifier(aliases=('http://alias.example',)) \
+            .verified_links.should.have.length_of(1)
+
+    def test_redirections_of_candidates_are_followed(self):
+        self.profile_links_to('/old')
+        self.server.page('/old', status=301, headers={'Location': '/new'})
+        self.backlink('/new')
+        self.verifier().verified_links.should.equal([self.server.url('/old')])
+
+    def test_candidates_are_fetched_in_parallel(self):
+        paths = ['/silo{}'.format(i) for i in range(6)]
+        self.profile_links_to(*paths)
+        for path in paths:
+            self.backlink(path, delay=0.1)
+        self.verifier(concurrency=3).verified_links.should.have.length_of(6)
+        self.server.max_in_flight.should.equal(3)
+
+    def test_candidates_are_capped(self):
+        self.profile_links_to(*('/silo{}'.format(i) for i in range(5)))
+        self.verifier(max_links=2).links.should.have.length_of(2)
+
+    def test_verifying_again_uses_the_cache(self):
+        self.profile_links_to('/github', '/twitter')
+        self.backlink('/github')
+        self.verifier().verified_links.should.have.length_of(1)
+        requests = len(self.server.requests)
+        self.verifier().verified_links.should.have.length_of(1)
+        len(self.server.requests).should.equal(requests)
+
+    def test_failed_candidates_are_not_verified_nor_remembered(self):
+        self.profile_links_to('http://127.0.0.1:9/')
+        verifier = self.verifier()
+        verifier.verified_links.should.be.empty
+        self.cache.verified(self.profile, 'http://127.0.0.1:9/') \
+            .should.be.none
+
+    def test_unreachable_profiles_raise(self):
+        verifier = RelMeVerifier('http://127.0.0.1:9/', client=self.client,
+                                 cache=self.cache)
+        with self.assertRaises(UnreachableProfileException) as context:
+            verifier.links
+        context.exception.message.should.contain('127.0.0.1:9')
+
+    def test_async_verifier_checks_the_same_links(self):
+        paths = ['/silo{}'.format(i) for i in range(4)]
+        self.profile_links_to(*paths, '/nope')
+        for path in paths:
+            self.backlink(path, delay=0.1)
+
+        async def run():
+            client = AsyncHTTPClient()
+            verifier = AsyncRelMeVerifier(self.profile, client=client,
+                                          cache=self.cache, concurrency=2)
+            try:
+                return await verifier.verify()
+            finally:
+                await client.close()
+        run_coroutine(run()).should.equal([self.server.url(path)
+                                           for path in paths])
+        self.server.max_in_flight.should.equal(2)
+
+    def test_async_verifier_must_be_awaited(self):
+        verifier = AsyncRelMeVerifier(self.profile, cache=self.cache)
+        self.assertRaises(RuntimeError, lambda: verifier.links)
@@ -0,0 +1,151 @@
+import os
+import requests
+import socket
+import sure
+from dummyauth.aio import AsyncHTTPClient
+from dummyauth.client import Fetch, HTTPClient, failure_kind
+from dummyauth.resolver import DNSCache, dns_cache
+from standin import StandInServer, run_coroutine
+from unittest import TestCase
+from unittest.mock import patch
+from urllib3.exceptions import NewConnectionError
+
+
+class StandInResolver(object):
+    """ Resolves the names it knows to local addresses, and counts the
+    lookups it is asked for. """
+
+    def __init__(self, hosts: dict):
+        self.hosts = hosts
+        self.lookups = []
+
+    def __call__(self, host, port, family=0, type=0, proto=0, flags=0):
+        self.lookups.append(host)
+        if host not in self.hosts:
+            raise socket.gaierror(socket.EAI_NONAME, 'Name or service not known')
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '',
+                 (address, port)) for address in self.hosts[host]]
+
+
+class DNSCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.resolver = StandInResolver({'example.test': ['127.0.0.1']})
+        self.cache = DNSCache(max_entries=2, ttl=60, negative_ttl=5,
+                              resolver=self.resolver)
+
+    def test_lookups_are_cached(self):
+        self.cache.addresses('example.test', 80).should.equal(['127.0.0.1'])
+        self.cache.addresses('example.test', 80).should.equal(['127.0.0.1'])
+        self.resolver.lookups.should.equal(['example.test'])
+        self.cache.stats().should.equal({'entries': 1, 'hits': 1,
+                                         'misses': 1})
+
+    def test_lookups_expire(self):
+        with patch('dummyauth.cache.time.monotonic', return_value=1000):
+            self.cache.addresses('example.test', 80)
+        with patch('dummyauth.cache.time.monotonic', return_value=1061):
+            self.cache.addresses('example.test', 80)
+        self.resolver.lookups.should.have.length_of(2)
+
+    def test_failed_lookups_are_cached_for_less_time(self):
+        with patch('dummyauth.cache.time.monotonic', return_value=1000):
+            self.assertRaises(socket.gaierror, self.cache.addresses,
+                              'missing.test', 80)
+            self.assertRaises(socket.gaierror, self.cache.addresses,
+                              'missing.test', 80)
+        self.resolver.lookups.should.equal(['missing.test'])
+        with patch('dummyauth.cache.time.monotonic', return_value=1006):
+            self.assertRaises(socket.gaierror, self.cache.addresses,
+                              'missing.test', 80)
+        self.resolver.lookups.should.have.length_of(2)
+
+    def test_least_recently_used_lookups_are_evicted(self):
+        self.resolver.hosts.update({'a.test': ['127.0.0.2'],
+                                    'b.test': ['127.0.0.3']})
+        for host in ('example.test', 'a.test', 'b.test', 'example.test'):
+            self.cache.addresses(host, 80)
+        self.resolver.lookups.should.equal(['example.test', 'a.test',
+                                            'b.test', 'example.test'])
+
+    def test_addresses_are_not_looked_up(self):
+        self.cache.addresses('127.0.0.1', 80).should.equal(['127.0.0.1'])
+        self.cache.cached_addresses('::1', 80).should.equal(['::1'])
+        self.resolver.lookups.should.be.empty
+
+    def test_cached_addresses_never_ask_the_resolver(self):
+        self.cache.cached_addresses('example.test', 80).should.be.none
+        self.cache.addresses('example.test', 80)
+        self.cache.cached_addresses('example.test', 80).should.equal(
+            ['127.0.0.1'])
+        self.resolver.lookups.should.equal(['example.test'])
+
+    def test_forked_children_start_with_an_empty_cache(self):
+        self.cache.addresses('example.test', 80)
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                self.cache.addresses('example.test', 80)
+                os.write(write, str(self.cache.stats()['misses']).encode())
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        os.read(read, 16).should.equal(b'1')
+        os.close(read)
+        os.close(write)
+        self.cache.stats()['hits'].should.equal(0)
+
+
+class CachedConnectionsTestCase(TestCase):
+
+    def setUp(self):
+        self.server = StandInServer().start()
+        self.addCleanup(self.server.stop)
+
+        # 127.0.0.9 refuses connections, so the second address is used.
+        self.resolver = StandInResolver({
+            'profile.test': ['127.0.0.9', '127.0.0.1']})
+        patcher = patch.object(dns_cache, 'resolver', self.resolver)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        dns_cache.clear()
+        self.addCleanup(dns_cache.clear)
+        self.url = 'http://profile.test:{}/'.format(self.server.server_port)
+        self.server.register('GET', self.url)
+
+    def test_sync_client_uses_the_cache(self):
+        client = HTTPClient()
+        for _ in range(2):
+            client.fetch(Fetch('GET', self.url)).status_code.should.equal(200)
+        client.close()
+        self.resolver.lookups.should.equal(['profile.test'])
+
+    def test_async_client_uses_the_cache(self):
+        async def run():
+            client = AsyncHTTPClient()
+            results = [await client.fetch(Fetch('GET', self.url))
+                       for _ in range(2)]
+            await client.close()
+            return results
+        [result.status_code for result in run_coroutine(run())].should.equal(
+            [200, 200])
+        self.resolver.lookups.should.equal(['profile.test'])
+
+    def test_failed_lookups_are_dns_failures(self):
+        client = HTTPClient()
+        url = 'http://missing.test/'
+        with self.assertRaises(Exception) as context:
+            client.fetch(Fetch('GET', url))
+        failure_kind(context.exception).should.equal('dns')
+        with self.assertRaises(Exception):
+            run_coroutine(AsyncHTTPClient().fetch(Fetch('GET', url)))
+        self.resolver.lookups.should.equal(['missing.test'])
+
+    def test_failed_lookups_raise_what_urllib3_raises(self):
+        client = HTTPClient()
+        with self.assertRaises(requests.exceptions.ConnectionError) as context:
+            client.fetch(Fetch('GET', 'http://missing.test/'))
+        error = context.exception.args[0].reason
+        error.should.be.a(NewConnectionError)
+        error.__cause__.should.be.a(socket.gaierror)
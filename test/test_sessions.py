@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+import shutil
+import sure
+import tempfile
+import time
+from flask import Flask, session
+from dummyauth import create_app, sessions
+from dummyauth.sessions import MemorySessionStore, SQLiteSessionStore, \
+    ServerSessionInterface
+from unittest import TestCase
+
+
+def write_in_child(path):
+    SQLiteSessionStore(path).set('child', b'{"a":1}', 60)
+
+
+def build_app(store, ttl=3600):
+    app = Flask(__name__)
+    app.secret_key = 'secret'
+    app.session_interface = ServerSessionInterface(store, ttl)
+
+    @app.route('/set')
+    def set_view():
+        session['login.state'] = 'state'
+        return ''
+
+    @app.route('/get')
+    def get_view():
+        return session.get('login.state', 'none')
+
+    @app.route('/clear')
+    def clear_view():
+        session.clear()
+        return ''
+
+    return app
+
+
+class ServerSessionTestCase(TestCase):
+
+    def setUp(self):
+        self.store = MemorySessionStore()
+        self.client = build_app(self.store).test_client()
+
+    def test_session_data_is_kept_in_the_store(self):
+        response = self.client.get('/set')
+        sid = response.headers['Set-Cookie'].split(';')[0].split('=')[1]
+        self.store.get(sid).should_not.be.none
+        self.client.get('/get').data.should.equal(b'state')
+
+    def test_the_cookie_only_has_an_opaque_id(self):
+        cookie = self.client.get('/set').headers['Set-Cookie']
+        cookie.should_not.contain('state')
+        cookie.should.contain('HttpOnly')
+
+    def test_empty_sessions_are_not_stored(self):
+        response = self.client.get('/get')
+        response.headers.get('Set-Cookie').should.be.none
+
+    def test_unmodified_sessions_are_not_saved_again(self):
+        self.client.get('/set')
+        response = self.client.get('/get')
+        response.headers.get('Set-Cookie').should.be.none
+
+    def test_cleared_sessions_are_deleted(self):
+        response = self.client.get('/set')
+        sid = response.headers['Set-Cookie'].split(';')[0].split('=')[1]
+        self.client.get('/clear')
+        self.store.get(sid).should.be.none
+        self.client.get('/get').data.should.equal(b'none')
+
+    def test_unknown_session_ids_start_a_new_session(self):
+        self.client.set_cookie('localhost', 'session', 'x' * 43)
+        self.client.get('/get').data.should.equal(b'none')
+        response = self.client.get('/set')
+        response.headers['Set-Cookie'].should_not.contain('x' * 43)
+
+    def test_sessions_expire(self):
+        client = build_app(self.store, ttl=0.05).test_client()
+        client.get('/set')
+        time.sleep(0.1)
+        client.get('/get').data.should.equal(b'none')
+
+
+class SQLiteSessionStoreTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'sessions.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sessions_are_shared_between_instances(self):
+        SQLiteSessionStore(self.path).set('abc', b'data', 60)
+        SQLiteSessionStore(self.path).get('abc').should.equal(b'data')
+
+    def test_expired_sessions_are_not_returned(self):
+        store = SQLiteSessionStore(self.path)
+        store.set('abc', b'data', -1)
+        store.get('abc').should.be.none
+
+    def test_sessions_are_deleted(self):
+        store = SQLiteSessionStore(self.path)
+        store.set('abc', b'data', 60)
+        store.delete('abc')
+        store.get('abc').should.be.none
+
+    def test_the_sessions_closest_to_expiring_are_deleted_past_the_limit(self):
+        store = SQLiteSessionStore(self.path, max_entries=2)
+        store.PURGE_EVERY = 4
+        for n in range(4):
+            store.set(str(n), b'data', 60 + n)
+        [store.get(str(n)) for n in range(4)].should.equal(
+            [None, None, b'data', b'data'])
+
+    def test_sessions_are_shared_with_forked_workers(self):
+        store = SQLiteSessionStore(self.path)
+        store.get('child').should.be.none
+        context = multiprocessing.get_context('fork')
+        child = context.Process(target=write_in_child, args=(self.path,))
+        child.start()
+        child.join()
+        store.get('child').should.equal(b'{"a":1}')
+
+    def test_login_handshake_works_with_the_sqlite_backend(self):
+        app = create_app()
+        app.config.update(SECRET_KEY='secret', SESSION_BACKEND='sqlite',
+                          SESSION_SQLITE_PATH=self.path)
+        sessions.init_app(app)
+        app.session_interface.should.be.a(ServerSessionInterface)
+        with app.test_client() as client:
+            client.get('/')
+            session.should_not.be.empty
+        SQLiteSessionStore(self.path).connection.execute(
+            'SELECT COUNT(*) FROM sessions').fetchone()[0].should.equal(1)
+
+    def test_the_database_is_kept_in_the_instance_folder_by_default(self):
+        app = create_app()
+        app.instance_path = os.path.join(self.directory, 'instance')
+        app.config.update(SESSION_BACKEND='sqlite', SESSION_SQLITE_PATH=None)
+        sessions.init_app(app)
+        app.session_interface.store.path.should.equal(
+            os.path.join(app.instance_path, 'sessions.sqlite3'))
+        os.path.isdir(app.instance_path).should.be.true
@@ -0,0 +1,156 @@
+import asyncio
+import multiprocessing
+import os
+import shutil
+import sure
+import tempfile
+import threading
+import time
+from dummyauth.singleflight import SingleFlight
+from unittest import TestCase
+
+
+def hold_the_lock(directory, started):
+    def slow():
+        started.set()
+        time.sleep(0.3)
+        return {'from': 'child'}
+    SingleFlight(directory).do('http://example.com/', slow)
+
+
+def fail_holding_the_lock(directory, started):
+    def failing():
+        started.set()
+        time.sleep(0.3)
+        raise ValueError('nope')
+    try:
+        SingleFlight(directory).do('http://example.com/', failing)
+    except ValueError:
+        pass
+
+
+class SingleFlightTestCase(TestCase):
+
+    def run_concurrently(self, flights, function, count=5):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flights.do('http://example.com/', function))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_calls_run_once(self):
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.1)
+            return {'endpoint': 'http://auth.example.com/'}
+
+        results, errors = self.run_concurrently(SingleFlight(), slow)
+        len(calls).should.equal(1)
+        errors.should.equal([])
+        results.should.equal([{'endpoint': 'http://auth.example.com/'}] * 5)
+
+    def test_errors_are_shared(self):
+        def failing():
+            time.sleep(0.1)
+            raise ValueError('nope')
+
+        results, errors = self.run_concurrently(SingleFlight(), failing)
+        results.should.equal([])
+        len(errors).should.equal(5)
+
+    def test_calls_that_do_not_overlap_run_again(self):
+        flights = SingleFlight()
+        flights.do('key', lambda: 1).should.equal(1)
+        flights.do('key', lambda: 2).should.equal(2)
+
+    def test_concurrent_coroutines_run_once(self):
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return {'relme': True}
+
+        async def run():
+            flights = SingleFlight()
+            return await asyncio.gather(*(
+                flights.do_async('key', slow) for _ in range(5)))
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(run()).should.equal([{'relme': True}] * 5)
+        len(calls).should.equal(1)
+
+
+class SharedSingleFlightTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_processes_share_the_result(self):
+        context = multiprocessing.get_context('fork')
+        started = context.Event()
+        child = context.Process(target=hold_the_lock,
+                                args=(self.directory, started))
+        child.start()
+        started.wait(5).should.be(True)
+
+        calls = []
+        flights = SingleFlight(self.directory)
+        result = flights.do('http://example.com/',
+                            lambda: calls.append(1) or {'from': 'parent'})
+        child.join()
+        result.should.equal({'from': 'child'})
+        calls.should.equal([])
+
+    def test_lock_files_are_removed_after_the_call(self):
+        def failing():
+            raise ValueError('nope')
+
+        flights = SingleFlight(self.directory)
+        for i in range(10):
+            flights.do('http://example.com/{}'.format(i), lambda: i)
+        self.assertRaises(ValueError, flights.do, 'http://example.com/',
+                          failing)
+        os.listdir(self.directory).should.be.empty
+
+    def test_waiting_processes_run_the_call_if_it_failed(self):
+        context = multiprocessing.get_context('fork')
+        started = context.Event()
+        child = context.Process(target=fail_holding_the_lock,
+                                args=(self.directory, started))
+        child.start()
+        started.wait(5).should.be(True)
+
+        flights = SingleFlight(self.directory)
+        result = flights.do('http://example.com/', lambda: {'from': 'parent'})
+        child.join()
+        result.should.equal({'from': 'parent'})
+        os.listdir(self.directory).should.be.empty
+
+    def test_calls_run_anyway_if_the_wait_is_over(self):
+        context = multiprocessing.get_context('fork')
+        started = context.Event()
+        child = context.Process(target=hold_the_lock,
+                                args=(self.directory, started))
+        child.start()
+        started.wait(5).should.be(True)
+
+        flights = SingleFlight(self.directory, wait=0.05)
+        result = flights.do('http://example.com/', lambda: {'from': 'parent'})
+        child.join()
+        result.should.equal({'from': 'parent'})
@@ -0,0 +1,47 @@
+import subprocess
+import sure
+import sys
+from dummyauth import create_app, startup
+from dummyauth.client import http_client
+from unittest import TestCase
+
+IMPORTED = '''
+import sys
+from dummyauth import create_app
+create_app({!r})
+print(' '.join(name for name in ('requests', 'bs4', 'dummyauth.spider')
+               if name in sys.modules))
+'''
+
+
+def imported_by(profile):
+    """ Returns the heavy modules imported by create_app in a new process. """
+    output = subprocess.run([sys.executable, '-c', IMPORTED.format(profile)],
+                            check=True, stdout=subprocess.PIPE).stdout
+    return output.decode('utf-8').split()
+
+
+class StartupTestCase(TestCase):
+
+    def test_lazy_profile_does_not_import_the_spider(self):
+        imported_by('lazy').should.equal([])
+
+    def test_preload_profile_imports_everything(self):
+        imported_by('preload').should.equal(['requests', 'bs4',
+                                             'dummyauth.spider'])
+
+    def test_spider_is_configured_on_first_use(self):
+        app = create_app('lazy')
+        app.config['HTTP_POOL_MAXSIZE'] = 7
+        app.extensions.should_not.contain('dummyauth.spider')
+        try:
+            spider = startup.load_spider(app)
+            adapter = http_client.session.get_adapter('http://example.com/')
+            adapter._pool_maxsize.should.equal(7)
+        finally:
+            http_client.configure(pool_maxsize=4)
+        spider.EndpointDiscoverySpider.should.be.a(type)
+        startup.load_spider(app).should.be(spider)
+
+    def test_unknown_profiles_are_rejected(self):
+        create_app.when.called_with('eager').should.throw(ValueError)
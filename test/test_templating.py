@@ -0,0 +1,60 @@
+import os
+import shutil
+import sure
+import tempfile
+from dummyauth import create_app
+from dummyauth.config import BaseConfig
+from dummyauth.templating import SharedBytecodeCache, precompile
+from jinja2 import DictLoader, Environment
+from unittest import TestCase
+from unittest.mock import patch
+
+
+class TemplatingTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def create_app(self):
+        with patch.object(BaseConfig, 'TEMPLATE_CACHE_DIR', self.directory):
+            return create_app('lazy')
+
+    def cached(self):
+        return [name for name in os.listdir(self.directory)
+                if name.endswith('.cache')]
+
+    def test_precompile_fills_the_cache(self):
+        app = self.create_app()
+        results = precompile(app)
+        results.should.contain('welcome.html')
+        set(results.values()).should.equal({'compiled'})
+        self.cached().should.have.length_of(len(results))
+
+    def test_other_workers_load_the_precompiled_templates(self):
+        precompile(self.create_app())
+        app = self.create_app()
+        set(precompile(app).values()).should.equal({'up to date'})
+        with patch.object(Environment, 'compile') as compile:
+            self.create_app().jinja_env.get_template('welcome.html')
+        compile.called.should.be.false
+
+    def test_changed_templates_are_compiled_again(self):
+        env = Environment(loader=DictLoader({'page.html': 'Hello'}),
+                          bytecode_cache=SharedBytecodeCache(self.directory))
+        env.get_template('page.html')
+        env = Environment(loader=DictLoader({'page.html': 'Bye'}),
+                          bytecode_cache=SharedBytecodeCache(self.directory))
+        env.get_template('page.html').render().should.equal('Bye')
+
+    def test_failed_writes_leave_nothing_behind(self):
+        env = Environment(loader=DictLoader({'page.html': 'Hello'}),
+                          bytecode_cache=SharedBytecodeCache(self.directory))
+        with patch('os.replace', side_effect=OSError):
+            env.get_template('page.html').render().should.equal('Hello')
+        os.listdir(self.directory).should.be.empty
+
+    def test_templates_are_compiled_without_a_cache_directory(self):
+        app = create_app('lazy')
+        app.jinja_env.bytecode_cache.should.be.none
+        set(precompile(app).values()).should.equal({'compiled'})
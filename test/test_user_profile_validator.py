@@ -49,3 +49,7 @@ class LoginFormTestCase(TestCase):
     def test_validator_rejects_url_with_ip_address(self, form):
         field = Mock(data='https://172.28.92.51/')
         self.assertRaises(ValidationError, ValidUserProfile(), form, field)
+
+    def test_validator_rejects_hostnames_without_a_top_level_domain(self, form):
+        field = Mock(data='https://localhost/')
+        self.assertRaises(ValidationError, ValidUserProfile(), form, field)
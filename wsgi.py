@@ -1,6 +1,9 @@
+import os
 from dummyauth import create_app
 
-app = create_app()
+# Prefork servers load the app before forking the workers, so build
+# everything now for the workers to share it. See dummyauth.startup.
+app = create_app(os.environ.get('STARTUP_PROFILE', 'preload'))
 
 if __name__ == "__main__":
     app.run()